@@ -0,0 +1,234 @@
+# amqp_publisher.py - Asyncio RabbitMQ publisher with publisher confirms
+import asyncio
+import json
+import os
+from collections import deque
+from datetime import datetime
+from typing import Any, Callable, Deque, Dict, List, Optional
+
+import aio_pika
+from pamqp.commands import Basic
+
+EXCHANGE = "swiftlogistics"
+QUEUES = ["order.submitted", "order.submitted.dlq", "order.processed", "order.failed", "delivery.updated"]
+
+class PendingMessage:
+    """A message waiting in the local buffer until the broker confirms it"""
+
+    __slots__ = ("routing_key", "body", "confirmed", "attempts")
+
+    def __init__(self, routing_key: str, body: bytes, confirmed: Optional[asyncio.Future]):
+        self.routing_key = routing_key
+        self.body = body
+        self.confirmed = confirmed
+        self.attempts = 0
+
+    def resolve(self, ok: bool):
+        if self.confirmed is not None and not self.confirmed.done():
+            self.confirmed.set_result(ok)
+
+class AMQPPublisher:
+    """Publishes from a bounded local buffer over a dedicated confirm-mode channel
+
+    Callers only enqueue; a single task drains the buffer in windows of up
+    to ``batch_size`` messages, publishing a window at once and awaiting
+    all of its confirms together. Messages that are not confirmed stay
+    buffered and are sent again after reconnecting, so delivery is
+    at-least-once while the process lives.
+    """
+
+    def __init__(
+        self,
+        url_factory: Callable[[], str],
+        buffer_size: int = int(os.getenv("AMQP_PUBLISH_BUFFER_SIZE", "10000")),
+        batch_size: int = int(os.getenv("AMQP_PUBLISH_BATCH_SIZE", "100")),
+        confirm_timeout: float = float(os.getenv("AMQP_CONFIRM_TIMEOUT", "10")),
+        enqueue_timeout: float = float(os.getenv("AMQP_ENQUEUE_TIMEOUT", "1")),
+        max_attempts: int = int(os.getenv("AMQP_PUBLISH_MAX_ATTEMPTS", "5")),
+        reconnect_backoff: float = float(os.getenv("AMQP_RECONNECT_BACKOFF", "1")),
+        max_reconnect_backoff: float = 30.0
+    ):
+        self.url_factory = url_factory
+        self.batch_size = batch_size
+        self.confirm_timeout = confirm_timeout
+        self.enqueue_timeout = enqueue_timeout
+        self.max_attempts = max_attempts
+        self.reconnect_backoff = reconnect_backoff
+        self.max_reconnect_backoff = max_reconnect_backoff
+        self._buffer: Optional[asyncio.Queue] = None
+        self._buffer_size = buffer_size
+        self._retry: Deque[PendingMessage] = deque()
+        self._runner: Optional[asyncio.Task] = None
+        self._connection = None
+        self._ready: Optional[asyncio.Event] = None
+        self._closing = False
+        self.connected = False
+        self.in_flight = 0
+        self.confirmed = 0
+        self.retried = 0
+        self.failed = 0
+        self.dropped = 0
+        self.reconnects = 0
+
+    def start(self):
+        """Start the publishing task; called lazily on the first publish"""
+        if self._runner is None:
+            self._closing = False
+            self._buffer = asyncio.Queue(maxsize=self._buffer_size)
+            self._ready = asyncio.Event()
+            self._runner = asyncio.create_task(self._run())
+
+    async def publish(self, routing_key: str, message: Dict[str, Any], confirm: bool = False) -> bool:
+        """Buffer a message for publishing
+
+        Returns once the message is buffered, or with ``confirm`` once the
+        broker has confirmed it. False means it was not accepted: the buffer
+        stayed full for ``enqueue_timeout``, or with ``confirm`` the broker was
+        unreachable or never confirmed.
+        """
+        self.start()
+        if confirm and not self.connected:
+            # Callers that need a confirm have their own fallback; don't park them behind an outage
+            if self.reconnects:
+                return False
+            try:
+                await asyncio.wait_for(self._ready.wait(), self.enqueue_timeout)
+            except asyncio.TimeoutError:
+                return False
+        confirmed = asyncio.get_running_loop().create_future() if confirm else None
+        pending = PendingMessage(routing_key, json.dumps(message).encode(), confirmed)
+        try:
+            await asyncio.wait_for(self._buffer.put(pending), self.enqueue_timeout)
+        except asyncio.TimeoutError:
+            self.dropped += 1
+            print(f"AMQP publish buffer full - message to {routing_key} not sent")
+            return False
+        if confirmed is None:
+            return True
+        try:
+            return await asyncio.wait_for(asyncio.shield(confirmed), self.confirm_timeout)
+        except asyncio.TimeoutError:
+            # Still buffered and will be sent, but the caller cannot count on it
+            return False
+
+    async def close(self, drain_timeout: float = float(os.getenv("AMQP_DRAIN_TIMEOUT", "5"))):
+        """Flush buffered messages for up to ``drain_timeout`` seconds, then disconnect"""
+        if self._runner is None:
+            return
+        if self.connected:
+            deadline = asyncio.get_running_loop().time() + drain_timeout
+            while (self._buffer.qsize() or self._retry or self.in_flight) and asyncio.get_running_loop().time() < deadline:
+                await asyncio.sleep(0.05)
+        left = self._buffer.qsize() + len(self._retry)
+        if left:
+            print(f"AMQP publisher closing with {left} unsent messages")
+        self._closing = True
+        self._runner.cancel()
+        try:
+            await self._runner
+        except asyncio.CancelledError:
+            pass
+        self._runner = None
+        await self._disconnect()
+
+    async def _disconnect(self):
+        self.connected = False
+        self._ready.clear()
+        if self._connection is not None:
+            try:
+                await self._connection.close()
+            except Exception:
+                pass
+            self._connection = None
+
+    async def _connect(self):
+        self._connection = await aio_pika.connect(self.url_factory(), timeout=self.confirm_timeout)
+        channel = await self._connection.channel(publisher_confirms=True)
+        exchange = await channel.declare_exchange(EXCHANGE, aio_pika.ExchangeType.TOPIC, durable=True)
+        for name in QUEUES:
+            queue = await channel.declare_queue(name, durable=True)
+            await queue.bind(exchange, routing_key=name)
+        self.connected = True
+        self._ready.set()
+        return exchange
+
+    async def _next_window(self) -> List[PendingMessage]:
+        """Retries first, then whatever is buffered, up to one window"""
+        window = []
+        while self._retry and len(window) < self.batch_size:
+            window.append(self._retry.popleft())
+        if not window:
+            window.append(await self._buffer.get())
+        while len(window) < self.batch_size and not self._buffer.empty():
+            window.append(self._buffer.get_nowait())
+        return window
+
+    async def _run(self):
+        backoff = self.reconnect_backoff
+        while not self._closing:
+            try:
+                exchange = await self._connect()
+                backoff = self.reconnect_backoff
+                while True:
+                    window = await self._next_window()
+                    await self._publish_window(exchange, window)
+                    if self._connection.is_closed:
+                        raise ConnectionError("connection closed")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"AMQP publisher disconnected: {e!r}; retrying in {backoff:.1f}s")
+                await self._disconnect()
+                self.reconnects += 1
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, self.max_reconnect_backoff)
+
+    async def _publish_window(self, exchange, window: List[PendingMessage]):
+        """Publish a window of messages and wait for all of their confirms"""
+        timestamp = datetime.utcnow()
+        self.in_flight = len(window)
+        try:
+            results = await asyncio.gather(*(
+                exchange.publish(
+                    aio_pika.Message(
+                        pending.body,
+                        content_type="application/json",
+                        delivery_mode=aio_pika.DeliveryMode.PERSISTENT,
+                        timestamp=timestamp
+                    ),
+                    routing_key=pending.routing_key,
+                    timeout=self.confirm_timeout
+                )
+                for pending in window
+            ), return_exceptions=True)
+        finally:
+            self.in_flight = 0
+
+        # Only broker rejections count as attempts; a lost connection just resends after reconnecting
+        connection_lost = self._connection is None or self._connection.is_closed
+        for pending, result in zip(window, results):
+            if isinstance(result, Basic.Ack):
+                self.confirmed += 1
+                pending.resolve(True)
+                continue
+            if not connection_lost:
+                pending.attempts += 1
+            if pending.attempts >= self.max_attempts:
+                self.failed += 1
+                print(f"AMQP publish to {pending.routing_key} failed after {pending.attempts} attempts: {result!r}")
+                pending.resolve(False)
+            else:
+                self.retried += 1
+                self._retry.append(pending)
+
+    def stats(self):
+        return {
+            "connected": self.connected,
+            "buffered": (self._buffer.qsize() if self._buffer is not None else 0) + len(self._retry),
+            "in_flight": self.in_flight,
+            "confirmed": self.confirmed,
+            "retried": self.retried,
+            "failed": self.failed,
+            "dropped": self.dropped,
+            "reconnects": self.reconnects
+        }
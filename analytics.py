@@ -0,0 +1,267 @@
+# analytics.py - Delivery performance rollups and queries (roll up with: python analytics.py --follow)
+import argparse
+import asyncio
+import os
+from datetime import date, datetime, time, timedelta
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+from dotenv import load_dotenv
+from sqlalchemy import delete, func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database import AsyncSessionLocal
+from models import DeliveryUpdate, DriverDailyStats, Order
+from order_stats import delivery_rate, get_stats_timeseries
+
+load_dotenv()
+
+# Delivery latency histogram: log-spaced bins from one minute to 30 days,
+# plus an underflow and an overflow bin; each bin is ~19% wide
+LATENCY_EDGES = np.geomspace(60, 30 * 86400, 63)
+LATENCY_BINS = len(LATENCY_EDGES) + 1
+# Latency reported for each bin (geometric middle; the open-ended bins use their bound)
+LATENCY_VALUES = np.concatenate((
+    LATENCY_EDGES[:1], np.sqrt(LATENCY_EDGES[:-1] * LATENCY_EDGES[1:]), LATENCY_EDGES[-1:]
+))
+
+# driver_id of the summary row that totals all drivers for a day
+ALL_DRIVERS = -1
+
+ANALYTICS_ROLLUP_INTERVAL = float(os.getenv("ANALYTICS_ROLLUP_INTERVAL", "300"))
+
+def histogram_percentiles(histograms: np.ndarray, fractions) -> np.ndarray:
+    """Percentiles in seconds of one histogram or a stack of them; NaN where a histogram is empty"""
+    histograms = np.atleast_2d(histograms)
+    cumulative = np.cumsum(histograms, axis=-1)
+    totals = cumulative[:, -1:]
+    result = np.full((len(histograms), len(fractions)), np.nan)
+    for column, fraction in enumerate(fractions):
+        bins = (cumulative >= np.maximum(totals * fraction, 1)).argmax(axis=-1)
+        result[:, column] = np.where(totals[:, 0] > 0, LATENCY_VALUES[bins], np.nan)
+    return result
+
+async def extract_day(db: AsyncSession, day: date) -> Dict[str, np.ndarray]:
+    """Delivered and failed updates of one day as columns: driver_id, delivered, latency_s"""
+    start = datetime.combine(day, time())
+    result = await db.execute(
+        select(
+            DeliveryUpdate.driver_id,
+            DeliveryUpdate.status,
+            func.extract("epoch", DeliveryUpdate.created_at - Order.created_at)
+        )
+        .join(Order, Order.id == DeliveryUpdate.order_id)
+        .where(
+            DeliveryUpdate.created_at >= start,
+            DeliveryUpdate.created_at < start + timedelta(days=1),
+            DeliveryUpdate.status.in_(("delivered", "failed"))
+        )
+    )
+    rows = result.all()
+    return {
+        "driver_id": np.fromiter((row[0] or 0 for row in rows), dtype=np.int64, count=len(rows)),
+        "delivered": np.fromiter((row[1] == "delivered" for row in rows), dtype=bool, count=len(rows)),
+        "latency_s": np.fromiter((row[2] or 0 for row in rows), dtype=np.float64, count=len(rows))
+    }
+
+def group_sum(index: np.ndarray, values: np.ndarray, size: int) -> np.ndarray:
+    """Sum rows of values that share a group index into an array of size groups"""
+    totals = np.zeros((size,) + values.shape[1:], dtype=values.dtype)
+    if len(index):
+        order = np.argsort(index, kind="stable")
+        ordered = index[order]
+        starts = np.flatnonzero(np.r_[True, ordered[1:] != ordered[:-1]])
+        totals[ordered[starts]] = np.add.reduceat(values[order], starts, axis=0)
+    return totals
+
+def summarize_day(columns: Dict[str, np.ndarray]) -> List[Dict[str, Any]]:
+    """Per-driver deliveries, failures and latency histogram for one day's extract, plus an ALL_DRIVERS row"""
+    drivers, index = np.unique(columns["driver_id"], return_inverse=True)
+    delivered = columns["delivered"]
+    deliveries = np.bincount(index[delivered], minlength=len(drivers))
+    failures = np.bincount(index[~delivered], minlength=len(drivers))
+    latency = columns["latency_s"][delivered]
+    latency_sum = np.bincount(index[delivered], weights=latency, minlength=len(drivers))
+    bins = np.searchsorted(LATENCY_EDGES, latency, side="right")
+    histograms = np.bincount(
+        index[delivered] * LATENCY_BINS + bins, minlength=len(drivers) * LATENCY_BINS
+    ).reshape(len(drivers), LATENCY_BINS).astype(np.int32)
+    rows = [
+        {
+            "driver_id": int(drivers[i]),
+            "deliveries": int(deliveries[i]),
+            "failures": int(failures[i]),
+            "latency_sum_s": float(latency_sum[i]),
+            "latency_histogram": histograms[i].tobytes()
+        }
+        for i in range(len(drivers))
+    ]
+    if rows:
+        rows.append({
+            "driver_id": ALL_DRIVERS,
+            "deliveries": int(deliveries.sum()),
+            "failures": int(failures.sum()),
+            "latency_sum_s": float(latency_sum.sum()),
+            "latency_histogram": histograms.sum(axis=0, dtype=np.int32).tobytes()
+        })
+    return rows
+
+async def rollup_day(day: date) -> int:
+    """Replace the summary rows of one day; returns the number of drivers"""
+    async with AsyncSessionLocal() as db:
+        rows = summarize_day(await extract_day(db, day))
+        now = datetime.utcnow()
+        await db.execute(delete(DriverDailyStats).where(DriverDailyStats.day == day))
+        if rows:
+            await db.execute(DriverDailyStats.__table__.insert(), [
+                {**row, "day": day, "rolled_up_at": now} for row in rows
+            ])
+        await db.commit()
+    return max(len(rows) - 1, 0)
+
+async def rollup_days(days: int):
+    """Roll up today and the days before it; past days only change through late updates"""
+    today = datetime.utcnow().date()
+    for offset in range(days):
+        day = today - timedelta(days=offset)
+        drivers = await rollup_day(day)
+        print(f"Rolled up {day}: {drivers} drivers")
+
+def summary(deliveries, failures, latency_sum, percentiles) -> Dict[str, Any]:
+    deliveries, failures = int(deliveries), int(failures)
+    return {
+        "deliveries": deliveries,
+        "failures": failures,
+        "failure_rate": delivery_rate(failures, deliveries + failures),  # Same percentage as /admin/stats
+        "latency_mean_s": round(float(latency_sum) / deliveries, 1) if deliveries else None,
+        **{
+            name: None if np.isnan(value) else round(float(value), 1)
+            for name, value in zip(("latency_p50_s", "latency_p90_s", "latency_p99_s"), percentiles)
+        }
+    }
+
+PERCENTILES = (0.50, 0.90, 0.99)
+
+async def get_delivery_analytics(
+    db: AsyncSession,
+    days: int = 90,
+    driver_id: Optional[int] = None,
+    top_drivers: int = 50
+) -> Dict[str, Any]:
+    """Latency percentiles, throughput and failure rates per day and per driver, from the summary table
+
+    Reads one row per day (the ALL_DRIVERS totals, or the requested
+    driver), ranks drivers with a SQL aggregate and merges histograms only
+    for the drivers returned.
+    """
+    until = datetime.utcnow().date()
+    since = until - timedelta(days=days - 1)
+    in_window = (DriverDailyStats.day >= since, DriverDailyStats.day <= until)
+
+    rows = (await db.execute(
+        select(
+            DriverDailyStats.day,
+            DriverDailyStats.deliveries,
+            DriverDailyStats.failures,
+            DriverDailyStats.latency_sum_s,
+            DriverDailyStats.latency_histogram,
+            DriverDailyStats.rolled_up_at
+        ).where(*in_window, DriverDailyStats.driver_id == (ALL_DRIVERS if driver_id is None else driver_id))
+    )).all()
+    daily_rows = {row.day: row for row in rows}
+    histograms = np.zeros((days, LATENCY_BINS), dtype=np.int64)
+    for row in rows:
+        histograms[(row.day - since).days] = np.frombuffer(row.latency_histogram, dtype=np.int32)
+    day_percentiles = histogram_percentiles(histograms, PERCENTILES)
+
+    # Orders created per day, from the counters kept by order_stats.py
+    created = {}
+    if driver_id is None:
+        for bucket in await get_stats_timeseries(
+            db, "day", datetime.combine(since, time()), datetime.combine(until + timedelta(days=1), time())
+        ):
+            created[bucket["bucket"].date()] = bucket["created"]
+
+    daily = []
+    for offset in range(days):
+        day = since + timedelta(days=offset)
+        row = daily_rows.get(day)
+        daily.append({
+            "day": day,
+            **({"created": created.get(day, 0)} if driver_id is None else {}),
+            **summary(
+                row.deliveries if row else 0, row.failures if row else 0,
+                row.latency_sum_s if row else 0, day_percentiles[offset]
+            )
+        })
+
+    # Busiest drivers by deliveries in the window, then their histograms
+    deliveries = func.sum(DriverDailyStats.deliveries)
+    ranking = select(
+        DriverDailyStats.driver_id,
+        deliveries,
+        func.sum(DriverDailyStats.failures),
+        func.sum(DriverDailyStats.latency_sum_s),
+        func.count().over()
+    ).where(*in_window).group_by(DriverDailyStats.driver_id)
+    if driver_id is None:
+        ranking = ranking.where(DriverDailyStats.driver_id != ALL_DRIVERS)
+    else:
+        ranking = ranking.where(DriverDailyStats.driver_id == driver_id)
+    ranked = (await db.execute(
+        ranking.order_by(deliveries.desc(), DriverDailyStats.driver_id).limit(top_drivers)
+    )).all()
+    driver_ids = [row[0] for row in ranked]
+
+    driver_histograms = np.zeros((len(ranked), LATENCY_BINS), dtype=np.int64)
+    if ranked:
+        histogram_rows = (await db.execute(
+            select(DriverDailyStats.driver_id, DriverDailyStats.latency_histogram)
+            .where(*in_window, DriverDailyStats.driver_id.in_(driver_ids))
+        )).all()
+        position = {driver: rank for rank, driver in enumerate(driver_ids)}
+        index = np.fromiter((position[row[0]] for row in histogram_rows), dtype=np.int64, count=len(histogram_rows))
+        stacked = np.frombuffer(
+            b"".join(row[1] for row in histogram_rows), dtype=np.int32
+        ).reshape(len(histogram_rows), LATENCY_BINS).astype(np.int64)
+        driver_histograms = group_sum(index, stacked, len(ranked))
+    driver_percentiles = histogram_percentiles(driver_histograms, PERCENTILES)
+
+    return {
+        "since": since,
+        "until": until,
+        "rolled_up_at": max((row.rolled_up_at for row in rows if row.rolled_up_at), default=None),
+        "totals": {
+            **summary(
+                sum(row.deliveries for row in rows),
+                sum(row.failures for row in rows),
+                sum(row.latency_sum_s for row in rows),
+                histogram_percentiles(histograms.sum(axis=0), PERCENTILES)[0]
+            ),
+            "drivers": ranked[0][4] if ranked else 0
+        },
+        "daily": daily,
+        "drivers": [
+            {
+                "driver_id": driver,
+                "deliveries_per_day": round(int(delivered) / days, 2),
+                **summary(delivered, failed, latency_sum, driver_percentiles[rank])
+            }
+            for rank, (driver, delivered, failed, latency_sum, _) in enumerate(ranked)
+        ]
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Roll up delivery updates into driver_daily_stats")
+    parser.add_argument("--days", type=int, default=2, help="Days to roll up, counting back from today")
+    parser.add_argument("--follow", action="store_true",
+                        help="Keep rolling up today and yesterday every ANALYTICS_ROLLUP_INTERVAL seconds")
+    args = parser.parse_args()
+
+    async def main():
+        await rollup_days(args.days)
+        while args.follow:
+            await asyncio.sleep(ANALYTICS_ROLLUP_INTERVAL)
+            await rollup_days(2)
+
+    asyncio.run(main())
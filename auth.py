@@ -1,16 +1,20 @@
 # auth.py - Authentication system
 from datetime import datetime, timedelta
-from typing import Optional
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Tuple
+import asyncio
 from jose import JWTError, jwt
 from passlib.context import CryptContext
 from fastapi import HTTPException, Depends, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from sqlalchemy.orm import Session
+from sqlalchemy import select, event
+from sqlalchemy.ext.asyncio import AsyncSession
 import os
 from dotenv import load_dotenv
 
-from database import get_db
+from database import get_db, AsyncSessionLocal
 from models import User
+from principal_cache import Principal, principal_cache
 
 load_dotenv()
 
@@ -19,9 +23,18 @@ SECRET_KEY = os.getenv("SECRET_KEY", "your-secret-key-here")  # Change this in p
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 1440  # 24 hours
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))  # Each extra round doubles hashing time
+
+# bcrypt releases the GIL, so a thread pool hashes in parallel without blocking the event loop
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(os.cpu_count() or 1)))
+PASSWORD_HASH_MAX_PENDING = int(os.getenv("PASSWORD_HASH_MAX_PENDING", "64"))
+
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=BCRYPT_ROUNDS)
 security = HTTPBearer()
 
+_hash_executor = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="password-hash")
+_hash_pending = 0
+
 def hash_password(password: str) -> str:
     """Hash a password"""
     return pwd_context.hash(password)
@@ -30,6 +43,41 @@ def verify_password(plain_password: str, hashed_password: str) -> bool:
     """Verify a password"""
     return pwd_context.verify(plain_password, hashed_password)
 
+async def _run_hasher(func, *args):
+    """Run a bcrypt call on the hashing pool, shedding load once too many are queued"""
+    global _hash_pending
+    if _hash_pending >= PASSWORD_HASH_MAX_PENDING:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Authentication is busy, please retry",
+            headers={"Retry-After": "1"},
+        )
+    _hash_pending += 1
+    try:
+        return await asyncio.get_running_loop().run_in_executor(_hash_executor, func, *args)
+    finally:
+        _hash_pending -= 1
+
+async def hash_password_async(password: str) -> str:
+    """Hash a password without blocking the event loop"""
+    return await _run_hasher(pwd_context.hash, password)
+
+async def verify_password_async(plain_password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+    """Verify a password without blocking the event loop
+
+    Also returns a replacement hash when the stored one uses a different
+    BCRYPT_ROUNDS, so the caller can upgrade it.
+    """
+    return await _run_hasher(pwd_context.verify_and_update, plain_password, hashed_password)
+
+def password_hasher_stats():
+    return {
+        "workers": PASSWORD_HASH_WORKERS,
+        "pending": _hash_pending,
+        "max_pending": PASSWORD_HASH_MAX_PENDING,
+        "bcrypt_rounds": BCRYPT_ROUNDS
+    }
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     """Create JWT access token"""
     to_encode = data.copy()
@@ -63,13 +111,41 @@ def verify_token(credentials: HTTPAuthorizationCredentials = Depends(security)):
             headers={"WWW-Authenticate": "Bearer"},
         )
 
-def get_current_user(token_data: dict = Depends(verify_token), db: Session = Depends(get_db)):
+async def get_current_user(token_data: dict = Depends(verify_token), db: AsyncSession = Depends(get_db)):
     """Get current authenticated user"""
-    user = db.query(User).filter(User.id == token_data["user_id"]).first()
+    result = await db.execute(select(User).where(User.id == token_data["user_id"]))
+    user = result.scalars().first()
     if user is None:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="User not found",
             headers={"WWW-Authenticate": "Bearer"},
         )
-    return user
\ No newline at end of file
+    return user
+
+async def get_current_principal(credentials: HTTPAuthorizationCredentials = Depends(security)) -> Principal:
+    """Get current authenticated principal, from cache when possible"""
+    token_data = verify_token(credentials)
+    principal = await principal_cache.get(token_data["user_id"], credentials.credentials)
+    if principal is not None:
+        return principal
+    
+    async with AsyncSessionLocal() as db:
+        result = await db.execute(select(User).where(User.id == token_data["user_id"]))
+        user = result.scalars().first()
+    if user is None:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="User not found",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    
+    principal = Principal.from_user(user)
+    await principal_cache.set(user.id, credentials.credentials, principal)
+    return principal
+
+# Drop cached principals whenever a user row changes through the ORM
+@event.listens_for(User, "after_update")
+@event.listens_for(User, "after_delete")
+def invalidate_cached_principal(mapper, connection, target):
+    principal_cache.schedule_invalidate(target.id)
@@ -0,0 +1,80 @@
+# bench_dispatch.py - Nearest-driver lookups and batch assignment on synthetic data
+#
+# Scatters drivers and orders uniformly over an area around a city centre,
+# times single nearest-driver lookups on the grid in dispatch.py, checks a
+# sample of them against a brute-force scan, and times assigning every order
+# in one batch.
+#
+#   python bench_dispatch.py --drivers 10000 --orders 100000 --capacity 10
+import argparse
+import time
+
+import numpy as np
+
+from dispatch import Dispatcher, DriverGrid
+from geo import haversine_km_array
+from metrics import percentile
+
+def scatter(rng, count: int, latitude: float, longitude: float, radius_degrees: float):
+    return (
+        latitude + rng.uniform(-radius_degrees, radius_degrees, count),
+        longitude + rng.uniform(-radius_degrees, radius_degrees, count)
+    )
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the dispatch spatial index")
+    parser.add_argument("--drivers", type=int, default=10000)
+    parser.add_argument("--orders", type=int, default=100000)
+    parser.add_argument("--capacity", type=int, default=10, help="Orders per driver in the batch run")
+    parser.add_argument("--latitude", type=float, default=6.9271)
+    parser.add_argument("--longitude", type=float, default=79.8612)
+    parser.add_argument("--radius", type=float, default=0.5, help="Half-width of the area in degrees")
+    parser.add_argument("--cell", type=float, default=0.01, help="Grid cell size in degrees")
+    parser.add_argument("--lookups", type=int, default=10000)
+    parser.add_argument("--check", type=int, default=1000, help="Lookups compared with a brute-force scan")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    driver_lat, driver_lon = scatter(rng, args.drivers, args.latitude, args.longitude, args.radius)
+    order_lat, order_lon = scatter(rng, args.orders, args.latitude, args.longitude, args.radius)
+
+    started = time.perf_counter()
+    grid = DriverGrid(args.cell)
+    for driver_id, (latitude, longitude) in enumerate(zip(driver_lat.tolist(), driver_lon.tolist())):
+        grid.update(driver_id, latitude, longitude)
+    print(f"Indexed {len(grid)} drivers in {(time.perf_counter() - started) * 1000:.1f}ms")
+
+    latencies = []
+    for latitude, longitude in zip(order_lat[:args.lookups].tolist(), order_lon[:args.lookups].tolist()):
+        started = time.perf_counter()
+        grid.nearest(latitude, longitude)
+        latencies.append(time.perf_counter() - started)
+    print(
+        f"Nearest lookup: p50 {percentile(latencies, 0.50) * 1e6:.1f}us  "
+        f"p99 {percentile(latencies, 0.99) * 1e6:.1f}us  max {max(latencies) * 1e6:.1f}us"
+    )
+
+    mismatches = 0
+    for i in range(min(args.check, args.orders)):
+        distances = haversine_km_array(order_lat[i], order_lon[i], driver_lat, driver_lon)
+        found = grid.nearest(float(order_lat[i]), float(order_lon[i]), max_km=float("inf"))
+        if not found or abs(found[0][0] - distances.min()) > 1e-9:
+            mismatches += 1
+    print(f"Brute-force check: {mismatches} mismatches in {min(args.check, args.orders)} lookups")
+
+    dispatcher = Dispatcher(capacity=args.capacity, cell_degrees=args.cell)
+    dispatcher.load(
+        {driver_id: position for driver_id, position in enumerate(zip(driver_lat.tolist(), driver_lon.tolist()))}, {}
+    )
+    orders = list(zip(range(args.orders), order_lat.tolist(), order_lon.tolist()))
+    started = time.perf_counter()
+    assignments = dispatcher.assign(orders)
+    elapsed = time.perf_counter() - started
+    distances = np.array([distance for _, distance in assignments.values()])
+    print(
+        f"Batch: assigned {len(assignments)}/{args.orders} orders in {elapsed * 1000:.0f}ms "
+        f"({elapsed / args.orders * 1e6:.1f}us per order), "
+        f"mean distance {distances.mean() if len(distances) else 0:.2f}km, "
+        f"p99 {np.percentile(distances, 99) if len(distances) else 0:.2f}km"
+    )
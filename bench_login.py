@@ -0,0 +1,110 @@
+# bench_login.py - Login throughput under concurrent load
+#
+# In-process (default): compares bcrypt verification run inline on the event
+# loop against the hashing pool in auth.py, reporting throughput, latency and
+# the longest event loop stall seen by a 10ms heartbeat.
+#
+#   python bench_login.py --logins 200 --concurrency 50 --rounds 10
+#
+# Against a running server (register the user first):
+#
+#   python bench_login.py --url http://localhost:8000 --email test@client.com --password password123
+import argparse
+import asyncio
+import os
+import statistics
+import time
+
+from metrics import percentile
+
+async def heartbeat(stop: asyncio.Event, stalls: list, interval: float = 0.01):
+    """Record how late the event loop wakes up a periodic task"""
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(interval)
+        stalls.append(time.perf_counter() - started - interval)
+
+async def run_load(login, logins: int, concurrency: int):
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    stalls = []
+    stop = asyncio.Event()
+
+    async def one():
+        async with semaphore:
+            started = time.perf_counter()
+            await login()
+            latencies.append(time.perf_counter() - started)
+
+    monitor = asyncio.create_task(heartbeat(stop, stalls))
+    started = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(logins)))
+    elapsed = time.perf_counter() - started
+    stop.set()
+    await monitor
+    return {
+        "throughput": logins / elapsed,
+        "p50_ms": percentile(latencies, 0.50) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+        "max_loop_stall_ms": max(stalls, default=0) * 1000,
+        "mean_loop_stall_ms": statistics.mean(stalls) * 1000 if stalls else 0
+    }
+
+def report(name: str, result: dict):
+    print(
+        f"{name:>8}: {result['throughput']:8.1f} logins/s  "
+        f"p50 {result['p50_ms']:7.1f}ms  p99 {result['p99_ms']:7.1f}ms  "
+        f"max loop stall {result['max_loop_stall_ms']:7.1f}ms"
+    )
+
+async def bench_in_process(args):
+    os.environ["BCRYPT_ROUNDS"] = str(args.rounds)
+    os.environ["PASSWORD_HASH_MAX_PENDING"] = str(max(args.logins, 64))
+    # auth.py reads its settings at import time
+    from auth import hash_password, verify_password, verify_password_async, PASSWORD_HASH_WORKERS
+
+    hashed = hash_password("password123")
+    print(f"bcrypt rounds={args.rounds} pool workers={PASSWORD_HASH_WORKERS} "
+          f"logins={args.logins} concurrency={args.concurrency}")
+
+    async def inline_login():
+        verify_password("password123", hashed)
+
+    async def pooled_login():
+        await verify_password_async("password123", hashed)
+
+    report("inline", await run_load(inline_login, args.logins, args.concurrency))
+    report("pool", await run_load(pooled_login, args.logins, args.concurrency))
+
+async def bench_http(args):
+    import aiohttp
+
+    async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=args.concurrency)) as session:
+        failures = 0
+
+        async def http_login():
+            nonlocal failures
+            async with session.post(
+                f"{args.url}/auth/login",
+                json={"email": args.email, "password": args.password}
+            ) as response:
+                await response.read()
+                if response.status != 200:
+                    failures += 1
+
+        print(f"POST {args.url}/auth/login logins={args.logins} concurrency={args.concurrency}")
+        report("http", await run_load(http_login, args.logins, args.concurrency))
+        if failures:
+            print(f"{failures} logins failed (401/503)")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark login throughput")
+    parser.add_argument("--logins", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--rounds", type=int, default=int(os.getenv("BCRYPT_ROUNDS", "12")))
+    parser.add_argument("--url", help="Benchmark a running server instead of in-process hashing")
+    parser.add_argument("--email", default="test@client.com")
+    parser.add_argument("--password", default="password123")
+    args = parser.parse_args()
+
+    asyncio.run(bench_http(args) if args.url else bench_in_process(args))
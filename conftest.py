@@ -0,0 +1 @@
+# conftest.py - Marks the repository root for pytest, so tests import the top-level modules (python -m pytest)
@@ -0,0 +1,239 @@
+# consumer.py - Event consumers (run separately from the API: python consumer.py)
+import argparse
+import asyncio
+import json
+import os
+import signal
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+import aio_pika
+from aiohttp import web
+from dotenv import load_dotenv
+
+from amqp_publisher import EXCHANGE
+from metrics import percentile
+from services import rabbitmq_url, message_broker, notification_service
+
+load_dotenv()
+
+Handler = Callable[[Dict[str, Any]], Awaitable[None]]
+
+class QueueConsumer:
+    """Consumes one queue on its own channel with a fixed pool of async handlers
+
+    The broker keeps at most ``prefetch`` unacknowledged messages in flight
+    to this consumer, and ``concurrency`` handler tasks work through them.
+    A message is acked only after its handler succeeds; a failed message is
+    requeued once and rejected if it fails again on redelivery.
+    """
+
+    def __init__(
+        self,
+        queue: str,
+        handler: Handler,
+        concurrency: int,
+        prefetch: Optional[int] = None,
+        handler_timeout: float = float(os.getenv("CONSUMER_HANDLER_TIMEOUT", "30"))
+    ):
+        self.queue_name = queue
+        self.handler = handler
+        self.concurrency = concurrency
+        self.prefetch = max(prefetch or concurrency * 2, concurrency)
+        self.handler_timeout = handler_timeout
+        self._inbox: asyncio.Queue = asyncio.Queue()
+        self._workers: List[asyncio.Task] = []
+        self._channel = None
+        self._queue = None
+        self._consumer_tag = None
+        self.received = 0
+        self.acked = 0
+        self.failed = 0
+        self.in_flight = 0
+        self._completed_at = deque(maxlen=100000)
+        self._latencies = deque(maxlen=1024)
+
+    async def start(self, connection):
+        self._channel = await connection.channel()
+        await self._channel.set_qos(prefetch_count=self.prefetch)
+        exchange = await self._channel.declare_exchange(EXCHANGE, aio_pika.ExchangeType.TOPIC, durable=True)
+        self._queue = await self._channel.declare_queue(self.queue_name, durable=True)
+        await self._queue.bind(exchange, routing_key=self.queue_name)
+        self._workers = [asyncio.create_task(self._work()) for _ in range(self.concurrency)]
+        self._consumer_tag = await self._queue.consume(self._on_message)
+        print(f"Consuming {self.queue_name} with {self.concurrency} handlers, prefetch {self.prefetch}")
+
+    async def _on_message(self, message: aio_pika.abc.AbstractIncomingMessage):
+        self.received += 1
+        await self._inbox.put(message)
+
+    async def _work(self):
+        while True:
+            message = await self._inbox.get()
+            self.in_flight += 1
+            try:
+                await self._handle(message)
+            finally:
+                self.in_flight -= 1
+                self._inbox.task_done()
+
+    async def _handle(self, message: aio_pika.abc.AbstractIncomingMessage):
+        started = time.monotonic()
+        try:
+            payload = json.loads(message.body)
+        except ValueError as e:
+            self.failed += 1
+            print(f"Discarding malformed message on {self.queue_name}: {e}")
+            await message.reject(requeue=False)
+            return
+
+        try:
+            await asyncio.wait_for(self.handler(payload), self.handler_timeout)
+        except Exception as e:
+            self.failed += 1
+            requeue = not message.redelivered
+            print(f"Error processing message on {self.queue_name} (requeue={requeue}): {e!r}")
+            await message.nack(requeue=requeue)
+            return
+
+        await message.ack()
+        finished = time.monotonic()
+        self.acked += 1
+        self._completed_at.append(finished)
+        self._latencies.append(finished - started)
+
+    async def drain(self, timeout: float):
+        """Stop taking deliveries and finish the ones already prefetched"""
+        if self._consumer_tag is not None:
+            await self._queue.cancel(self._consumer_tag)
+        try:
+            await asyncio.wait_for(self._inbox.join(), timeout)
+        except asyncio.TimeoutError:
+            # Unacked messages go back to the queue when the channel closes
+            print(f"{self.queue_name}: {self._inbox.qsize() + self.in_flight} messages left undrained")
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        await self._channel.close()
+
+    def stats(self, window: float = 60.0):
+        now = time.monotonic()
+        recent = sum(1 for completed in self._completed_at if completed > now - window)
+        return {
+            "received": self.received,
+            "acked": self.acked,
+            "failed": self.failed,
+            "in_flight": self.in_flight,
+            "backlog": self._inbox.qsize(),
+            "throughput_per_s": recent / window,
+            "handler_p50_ms": percentile(self._latencies, 0.50) * 1000,
+            "handler_p99_ms": percentile(self._latencies, 0.99) * 1000
+        }
+
+class ConsumerRuntime:
+    """Runs a set of queue consumers over one robust connection until stopped"""
+
+    def __init__(
+        self,
+        drain_timeout: float = float(os.getenv("CONSUMER_DRAIN_TIMEOUT", "30")),
+        metrics_interval: float = float(os.getenv("CONSUMER_METRICS_INTERVAL", "60")),
+        metrics_port: Optional[int] = None
+    ):
+        self.drain_timeout = drain_timeout
+        self.metrics_interval = metrics_interval
+        self.metrics_port = metrics_port
+        self.consumers: Dict[str, QueueConsumer] = {}
+        self._stopping = asyncio.Event()
+
+    def register(self, queue: str, handler: Handler, concurrency: int, prefetch: Optional[int] = None):
+        self.consumers[queue] = QueueConsumer(queue, handler, concurrency, prefetch)
+
+    def stop(self):
+        self._stopping.set()
+
+    def stats(self):
+        return {queue: consumer.stats() for queue, consumer in self.consumers.items()}
+
+    async def run(self):
+        connection = await aio_pika.connect_robust(rabbitmq_url())
+        metrics_runner = await self._serve_metrics() if self.metrics_port else None
+        reporter = asyncio.create_task(self._report_loop())
+        try:
+            for consumer in self.consumers.values():
+                await consumer.start(connection)
+            await self._stopping.wait()
+
+            # Graceful drain: stop deliveries, let prefetched messages finish
+            await asyncio.gather(*(consumer.drain(self.drain_timeout) for consumer in self.consumers.values()))
+        finally:
+            reporter.cancel()
+            if metrics_runner is not None:
+                await metrics_runner.cleanup()
+            await message_broker.close_publisher()
+            await connection.close()
+        print(f"Consumers stopped: {json.dumps(self.stats())}")
+
+    async def _report_loop(self):
+        while True:
+            await asyncio.sleep(self.metrics_interval)
+            for queue, stats in self.stats().items():
+                print(
+                    f"{queue}: {stats['throughput_per_s']:.1f} msg/s, acked {stats['acked']}, "
+                    f"failed {stats['failed']}, in flight {stats['in_flight']}, backlog {stats['backlog']}, "
+                    f"p99 {stats['handler_p99_ms']:.1f}ms"
+                )
+
+    async def _serve_metrics(self):
+        """Expose per-queue statistics as JSON on GET /metrics"""
+        async def metrics(request):
+            return web.json_response(self.stats())
+
+        app = web.Application()
+        app.router.add_get("/metrics", metrics)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        await web.TCPSite(runner, "0.0.0.0", self.metrics_port).start()
+        return runner
+
+# Message handlers
+async def handle_order_processed(message: Dict[str, Any]):
+    """Handle order processed event"""
+    print(f"Order processed: {message}")
+    # Send notification to client
+    await notification_service.send_email(
+        "client@example.com",
+        "Order Processed",
+        f"Your order {message['order_id']} is being processed."
+    )
+
+async def handle_delivery_updated(message: Dict[str, Any]):
+    """Handle delivery update event"""
+    print(f"Delivery updated: {message}")
+    # Send real-time update to client
+
+HANDLERS: Dict[str, Handler] = {
+    "order.processed": handle_order_processed,
+    "delivery.updated": handle_delivery_updated
+}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run event consumers")
+    parser.add_argument("--queues", nargs="+", choices=sorted(HANDLERS), default=sorted(HANDLERS))
+    parser.add_argument("--concurrency", type=int, default=int(os.getenv("CONSUMER_CONCURRENCY", "20")),
+                        help="Handlers running at once per queue")
+    parser.add_argument("--prefetch", type=int, default=int(os.getenv("CONSUMER_PREFETCH", "0")) or None,
+                        help="Unacked messages per queue (default: twice the concurrency)")
+    parser.add_argument("--metrics-port", type=int, default=int(os.getenv("CONSUMER_METRICS_PORT", "0")) or None)
+    args = parser.parse_args()
+
+    async def main():
+        runtime = ConsumerRuntime(metrics_port=args.metrics_port)
+        for queue in args.queues:
+            runtime.register(queue, HANDLERS[queue], args.concurrency, args.prefetch)
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, runtime.stop)
+        await runtime.run()
+
+    asyncio.run(main())
@@ -1,5 +1,7 @@
 # database.py - Database configuration
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, text
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 import os
@@ -12,34 +14,104 @@ logger = logging.getLogger(__name__)
 
 load_dotenv()
 
-try:
-    SQLALCHEMY_DATABASE_URL = os.getenv("DATABASE_URL")
-    if not SQLALCHEMY_DATABASE_URL:
+def to_async_url(url: str):
+    """Point a PostgreSQL URL at the asyncpg driver"""
+    url = make_url(url)
+    if url.get_backend_name() == "postgresql":
+        url = url.set(drivername="postgresql+asyncpg")
+    return url
+
+def database_url() -> str:
+    url = os.getenv("DATABASE_URL")
+    if not url:
         raise ValueError("DATABASE_URL environment variable is not set")
+    return url
+
+Base = declarative_base()
+
+# Engines are created on first use so importing this module never touches the database
+_engine = None
+_async_engine = None
+
+def get_engine():
+    """Synchronous engine for scripts and schema management (init_db.py, setup.sh)"""
+    global _engine
+    if _engine is None:
+        _engine = create_engine(
+            database_url(),
+            pool_pre_ping=True,  # Enable connection health checks
+            pool_size=5,         # Set connection pool size
+            max_overflow=10      # Maximum number of connections to create beyond pool_size
+        )
+    return _engine
+
+def get_async_engine():
+    """Asyncio engine used by the API so queries never block the event loop"""
+    global _async_engine
+    if _async_engine is None:
+        url = to_async_url(database_url())
+        connect_args = {}
+        if url.get_driver_name() == "asyncpg":
+            connect_args["timeout"] = float(os.getenv("DB_CONNECT_TIMEOUT", "10"))
+        _async_engine = create_async_engine(
+            url,
+            pool_pre_ping=True,
+            pool_size=int(os.getenv("DB_POOL_SIZE", "20")),
+            max_overflow=int(os.getenv("DB_MAX_OVERFLOW", "30")),
+            connect_args=connect_args
+        )
+    return _async_engine
+
+class LazySessionmaker(sessionmaker):
+    """sessionmaker that binds to its engine when the first session is created"""
+
+    def __init__(self, engine_factory, **kw):
+        super().__init__(**kw)
+        self._engine_factory = engine_factory
 
-    engine = create_engine(
-        SQLALCHEMY_DATABASE_URL,
-        pool_pre_ping=True,  # Enable connection health checks
-        pool_size=5,         # Set connection pool size
-        max_overflow=10      # Maximum number of connections to create beyond pool_size
-    )
-    
-    SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
-    Base = declarative_base()
-
-    # Test the connection
-    with engine.connect() as conn:
-        conn.execute("SELECT 1")
+    def __call__(self, **local_kw):
+        if self.kw.get("bind") is None:
+            self.configure(bind=self._engine_factory())
+        return super().__call__(**local_kw)
+
+SessionLocal = LazySessionmaker(get_engine, autocommit=False, autoflush=False)
+
+AsyncSessionLocal = LazySessionmaker(
+    get_async_engine,
+    class_=AsyncSession,
+    autoflush=False,
+    expire_on_commit=False  # Attributes stay readable after commit without a lazy reload
+)
+
+def __getattr__(name: str):
+    # Keep `from database import engine` working for scripts
+    if name == "engine":
+        return get_engine()
+    if name == "async_engine":
+        return get_async_engine()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+async def check_database():
+    """Test the connection; run at application startup"""
+    try:
+        async with get_async_engine().connect() as conn:
+            await conn.execute(text("SELECT 1"))
         logger.info("Database connection successful")
+    except Exception as e:
+        logger.error(f"Database connection failed: {str(e)}")
+        raise
+
+async def create_tables():
+    """Create missing tables (init_db.py does the same from a script)"""
+    async with get_async_engine().begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
 
-except Exception as e:
-    logger.error(f"Database connection failed: {str(e)}")
-    raise
+async def dispose_engines():
+    """Close pooled connections on shutdown"""
+    if _async_engine is not None:
+        await _async_engine.dispose()
 
 # Dependency to get database session
-def get_db():
-    db = SessionLocal()
-    try:
+async def get_db():
+    async with AsyncSessionLocal() as db:
         yield db
-    finally:
-        db.close()
\ No newline at end of file
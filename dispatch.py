@@ -0,0 +1,299 @@
+# dispatch.py - Assigns orders to the nearest available driver (run continuously with: python dispatch.py)
+import argparse
+import asyncio
+import heapq
+import math
+import os
+import signal
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Sequence, Set, Tuple
+
+from dotenv import load_dotenv
+from sqlalchemy import Integer, String, case, column, func, select, text, update, values
+
+from database import AsyncSessionLocal
+from geo import KM_PER_DEGREE, haversine_km
+from models import Order
+from redis_client import get_redis
+from response_cache import response_cache, order_cache_key
+from tracking import location_ingestor
+from travel_matrix import travel_times
+
+load_dotenv()
+
+DISPATCH_DRIVER_CAPACITY = int(os.getenv("DISPATCH_DRIVER_CAPACITY", "3"))  # Open orders per driver
+DISPATCH_MAX_KM = float(os.getenv("DISPATCH_MAX_KM", "30"))
+DISPATCH_POSITION_MAX_AGE = timedelta(minutes=float(os.getenv("DISPATCH_POSITION_MAX_AGE_MINUTES", "10")))
+DISPATCH_CELL_DEGREES = float(os.getenv("DISPATCH_CELL_DEGREES", "0.01"))  # ~1.1km
+DISPATCH_BATCH_SIZE = int(os.getenv("DISPATCH_BATCH_SIZE", "1000"))
+# pg_try_advisory_xact_lock key so one dispatcher at a time counts driver loads
+DISPATCH_LOCK_KEY = 0x646973
+
+# Orders are assigned most urgent first, then oldest first
+PRIORITY_RANK = {"urgent": 0, "high": 1, "normal": 2, "low": 3}
+DISPATCHABLE_STATUSES = ("submitted", "processing")
+OPEN_STATUSES_EXCLUDED = ("delivered", "failed")
+
+Cell = Tuple[int, int]
+
+class DriverGrid:
+    """Uniform latitude/longitude grid of driver positions for nearest-driver lookups
+
+    nearest() scans rings of cells outwards from the query point and stops
+    once no unscanned cell can hold anything closer, so results are exact
+    while a lookup touches only the cells around the point. Longitudes are
+    not wrapped at the antimeridian.
+    """
+
+    def __init__(self, cell_degrees: float = DISPATCH_CELL_DEGREES):
+        self.cell_degrees = cell_degrees
+        self._cells: Dict[Cell, Set[int]] = {}
+        self._positions: Dict[int, Tuple[float, float, Cell]] = {}
+        # Rows and columns spanned by drivers so far; bounds how far a search can usefully go
+        self._bounds: Optional[Tuple[int, int, int, int]] = None
+
+    def __len__(self) -> int:
+        return len(self._positions)
+
+    def __contains__(self, driver_id: int) -> bool:
+        return driver_id in self._positions
+
+    def cell(self, latitude: float, longitude: float) -> Cell:
+        return math.floor(latitude / self.cell_degrees), math.floor(longitude / self.cell_degrees)
+
+    def update(self, driver_id: int, latitude: float, longitude: float):
+        self.remove(driver_id)
+        cell = self.cell(latitude, longitude)
+        self._cells.setdefault(cell, set()).add(driver_id)
+        self._positions[driver_id] = (latitude, longitude, cell)
+        if self._bounds is None:
+            self._bounds = (cell[0], cell[0], cell[1], cell[1])
+        else:
+            min_row, max_row, min_column, max_column = self._bounds
+            self._bounds = (
+                min(min_row, cell[0]), max(max_row, cell[0]), min(min_column, cell[1]), max(max_column, cell[1])
+            )
+
+    def remove(self, driver_id: int):
+        position = self._positions.pop(driver_id, None)
+        if position is None:
+            return
+        drivers = self._cells[position[2]]
+        drivers.discard(driver_id)
+        if not drivers:
+            del self._cells[position[2]]
+
+    def position(self, driver_id: int) -> Optional[Tuple[float, float]]:
+        position = self._positions.get(driver_id)
+        return position[:2] if position else None
+
+    def nearest(self, latitude: float, longitude: float, k: int = 1, max_km: float = DISPATCH_MAX_KM) -> List[Tuple[float, int]]:
+        """Up to k (distance_km, driver_id) pairs within max_km, closest first"""
+        if not self._cells:
+            return []
+        row, column = self.cell(latitude, longitude)
+        best: List[Tuple[float, int]] = []  # Max-heap of the k closest, as (-distance, driver_id)
+        min_row, max_row, min_column, max_column = self._bounds
+        max_ring = max(abs(row - min_row), abs(row - max_row), abs(column - min_column), abs(column - max_column))
+        ring = 0
+        while ring <= max_ring:
+            for cell in self._ring(row, column, ring):
+                for driver_id in self._cells.get(cell, ()):
+                    driver_latitude, driver_longitude, _ = self._positions[driver_id]
+                    distance = haversine_km(latitude, longitude, driver_latitude, driver_longitude)
+                    if distance > max_km:
+                        continue
+                    if len(best) < k:
+                        heapq.heappush(best, (-distance, driver_id))
+                    elif distance < -best[0][0]:
+                        heapq.heapreplace(best, (-distance, driver_id))
+            # Anything outside the scanned rings is at least as far as the nearest edge of the scanned box
+            south, north = (row - ring) * self.cell_degrees, (row + ring + 1) * self.cell_degrees
+            west, east = (column - ring) * self.cell_degrees, (column + ring + 1) * self.cell_degrees
+            widest = math.cos(math.radians(min(89.9, max(abs(south), abs(north)))))
+            reach = min(
+                min(latitude - south, north - latitude) * KM_PER_DEGREE,
+                min(longitude - west, east - longitude) * KM_PER_DEGREE * widest
+            )
+            if reach > max_km or (len(best) == k and -best[0][0] <= reach):
+                break
+            ring += 1
+        return sorted((-distance, driver_id) for distance, driver_id in best)
+
+    @staticmethod
+    def _ring(row: int, column: int, ring: int):
+        if ring == 0:
+            yield row, column
+            return
+        for offset in range(-ring, ring + 1):
+            yield row - ring, column + offset
+            yield row + ring, column + offset
+        for offset in range(-ring + 1, ring):
+            yield row + offset, column - ring
+            yield row + offset, column + ring
+
+class Dispatcher:
+    """Greedy batch assignment of orders to the nearest driver with spare capacity"""
+
+    def __init__(
+        self,
+        capacity: int = DISPATCH_DRIVER_CAPACITY,
+        max_km: float = DISPATCH_MAX_KM,
+        cell_degrees: float = DISPATCH_CELL_DEGREES
+    ):
+        self.capacity = capacity
+        self.max_km = max_km
+        self.grid = DriverGrid(cell_degrees)
+        self.loads: Dict[int, int] = {}
+
+    def load(self, positions: Dict[int, Tuple[float, float]], loads: Dict[int, int]):
+        """Index the drivers that can take another order"""
+        self.loads = dict(loads)
+        for driver_id, (latitude, longitude) in positions.items():
+            if self.loads.get(driver_id, 0) < self.capacity:
+                self.grid.update(driver_id, latitude, longitude)
+
+    def assign(self, orders: Sequence[Tuple[Any, float, float]]) -> Dict[Any, Tuple[int, float]]:
+        """Map each (order_id, latitude, longitude), in the given order, to (driver_id, distance_km)"""
+        assignments = {}
+        for order_id, latitude, longitude in orders:
+            found = self.grid.nearest(latitude, longitude, 1, self.max_km)
+            if not found:
+                continue
+            distance, driver_id = found[0]
+            assignments[order_id] = (driver_id, distance)
+            self.loads[driver_id] = self.loads.get(driver_id, 0) + 1
+            if self.loads[driver_id] >= self.capacity:
+                self.grid.remove(driver_id)
+        return assignments
+
+async def available_positions(db, max_age: timedelta = DISPATCH_POSITION_MAX_AGE) -> Dict[int, Tuple[float, float]]:
+    """Latest position of each driver reported within max_age"""
+    since = datetime.utcnow() - max_age
+    if get_redis() is not None:
+        positions = await location_ingestor.get_all_latest()
+        return {
+            driver_id: (position["latitude"], position["longitude"])
+            for driver_id, position in positions.items()
+            if datetime.fromisoformat(position["recorded_at"]) >= since
+        }
+    # Without Redis other workers' positions are only in the table
+    result = await db.execute(text(
+        "SELECT DISTINCT ON (driver_id) driver_id, latitude, longitude FROM driver_locations "
+        "WHERE recorded_at >= :since ORDER BY driver_id, recorded_at DESC"
+    ), {"since": since})
+    return {driver_id: (latitude, longitude) for driver_id, latitude, longitude in result.all()}
+
+async def driver_loads(db) -> Dict[int, int]:
+    """Open (not delivered or failed) orders per assigned driver"""
+    result = await db.execute(
+        select(Order.assigned_driver_id, func.count())
+        .where(Order.assigned_driver_id.isnot(None), Order.status.notin_(OPEN_STATUSES_EXCLUDED))
+        .group_by(Order.assigned_driver_id)
+    )
+    return dict(result.all())
+
+async def dispatch_orders(limit: int = DISPATCH_BATCH_SIZE, dispatcher: Optional[Dispatcher] = None) -> List[Dict[str, Any]]:
+    """Assign up to limit unassigned orders that have pickup coordinates; returns the assignments"""
+    dispatcher = dispatcher or Dispatcher()
+    async with AsyncSessionLocal() as db:
+        if not await db.scalar(select(func.pg_try_advisory_xact_lock(DISPATCH_LOCK_KEY))):
+            return []  # Another dispatcher is running; loads would be counted twice
+        result = await db.execute(
+            select(Order.id, Order.client_id, Order.pickup_latitude, Order.pickup_longitude)
+            .where(
+                Order.assigned_driver_id.is_(None),
+                Order.status.in_(DISPATCHABLE_STATUSES),
+                Order.pickup_latitude.isnot(None),
+                Order.pickup_longitude.isnot(None)
+            )
+            .order_by(case(PRIORITY_RANK, value=Order.priority, else_=PRIORITY_RANK["normal"]), Order.created_at)
+            .limit(limit)
+        )
+        orders = result.all()
+        if not orders:
+            return []
+
+        positions = await available_positions(db)
+        dispatcher.load(positions, await driver_loads(db))
+        assigned = dispatcher.assign([(order.id, order.pickup_latitude, order.pickup_longitude) for order in orders])
+        if assigned:
+            # The orders were read without row locks, so order processing is never held up by a
+            # dispatch round; the update only takes orders that are still unassigned
+            rows = values(column("order_id", String), column("driver_id", Integer), name="assignment").data(
+                [(order_id, driver_id) for order_id, (driver_id, _) in assigned.items()]
+            )
+            orders_table = Order.__table__
+            result = await db.execute(
+                update(orders_table)
+                .where(orders_table.c.id == rows.c.order_id, orders_table.c.assigned_driver_id.is_(None))
+                .values(assigned_driver_id=rows.c.driver_id, updated_at=datetime.utcnow())
+                .returning(orders_table.c.id)
+            )
+            updated = set(result.scalars())
+            assigned = {order_id: assignment for order_id, assignment in assigned.items() if order_id in updated}
+        await db.commit()
+
+    await response_cache.invalidate(*(order_cache_key(order_id) for order_id in assigned))
+    clients = {order.id: order.client_id for order in orders}
+    pickups = {order.id: (order.pickup_latitude, order.pickup_longitude) for order in orders}
+    # Drivers are ranked by straight-line distance, which orders them the same as road time under the
+    # default travel backend; the cached matrix only supplies the ETA of the chosen driver
+    _, eta = travel_times.pairs(
+        [positions[driver_id][0] for driver_id, _ in assigned.values()],
+        [positions[driver_id][1] for driver_id, _ in assigned.values()],
+        [pickups[order_id][0] for order_id in assigned],
+        [pickups[order_id][1] for order_id in assigned]
+    )
+    return [
+        {
+            "order_id": order_id,
+            "driver_id": driver_id,
+            "client_id": clients[order_id],
+            "distance_km": round(distance, 3),
+            "eta_minutes": round(float(minutes), 1)
+        }
+        for (order_id, (driver_id, distance)), minutes in zip(assigned.items(), eta.tolist())
+    ]
+
+async def notify_assignments(manager, assignments: List[Dict[str, Any]]):
+    """Tell each driver and client about new assignments over the WebSocket hub"""
+    for assignment in assignments:
+        await manager.deliver(
+            {"type": "order_assigned", **assignment, "timestamp": datetime.utcnow().isoformat()},
+            client_ids=[str(assignment["client_id"]), str(assignment["driver_id"])],
+            topics=[f"driver:{assignment['driver_id']}", f"order:{assignment['order_id']}"]
+        )
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Assign unassigned orders to the nearest available drivers")
+    parser.add_argument("--interval", type=float, default=5.0, help="Seconds between dispatch rounds")
+    parser.add_argument("--batch-size", type=int, default=DISPATCH_BATCH_SIZE)
+    args = parser.parse_args()
+
+    async def main():
+        from realtime import ConnectionManager  # Reaches API workers' sockets through the Redis backplane
+
+        manager = ConnectionManager()
+        await manager.start()
+        stopping = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, stopping.set)
+        try:
+            while not stopping.is_set():
+                try:
+                    assignments = await dispatch_orders(args.batch_size)
+                    await notify_assignments(manager, assignments)
+                    if assignments:
+                        print(f"Assigned {len(assignments)} orders")
+                except Exception as e:
+                    print(f"Dispatch round failed: {e!r}")
+                try:
+                    await asyncio.wait_for(stopping.wait(), args.interval)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            await manager.close()
+
+    asyncio.run(main())
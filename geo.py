@@ -0,0 +1,76 @@
+# geo.py - Great-circle distances and geohash cells on latitude/longitude in degrees
+import math
+
+import numpy as np
+
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180  # Along a meridian
+
+def haversine_km(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    """Distance in km between two points"""
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    a = (
+        math.sin((phi2 - phi1) / 2) ** 2
+        + math.cos(phi1) * math.cos(phi2) * math.sin(math.radians(lon2 - lon1) / 2) ** 2
+    )
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+def haversine_km_array(lat1, lon1, lat2, lon2) -> np.ndarray:
+    """Vectorized haversine_km; arguments broadcast, so lat1[:, None] against lat2 gives a matrix"""
+    phi1, phi2 = np.radians(lat1), np.radians(lat2)
+    a = (
+        np.sin((phi2 - phi1) / 2) ** 2
+        + np.cos(phi1) * np.cos(phi2) * np.sin(np.radians(np.subtract(lon2, lon1)) / 2) ** 2
+    )
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+GEOHASH_BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+
+_SPREAD_MASKS = (
+    (16, 0x0000FFFF0000FFFF), (8, 0x00FF00FF00FF00FF), (4, 0x0F0F0F0F0F0F0F0F),
+    (2, 0x3333333333333333), (1, 0x5555555555555555)
+)
+_COMPACT_MASKS = (
+    (1, 0x3333333333333333), (2, 0x0F0F0F0F0F0F0F0F), (4, 0x00FF00FF00FF00FF),
+    (8, 0x0000FFFF0000FFFF), (16, 0x00000000FFFFFFFF)
+)
+
+def _spread_bits(values: np.ndarray) -> np.ndarray:
+    """Move bit i of each value (up to 32 bits) to bit 2i"""
+    values = values & 0xFFFFFFFF
+    for shift, mask in _SPREAD_MASKS:
+        values = (values | (values << shift)) & mask
+    return values
+
+def _compact_bits(values: np.ndarray) -> np.ndarray:
+    """Inverse of _spread_bits: bit 2i back to bit i"""
+    values = values & 0x5555555555555555
+    for shift, mask in _COMPACT_MASKS:
+        values = (values | (values >> shift)) & mask
+    return values
+
+def geohash_cells(latitudes, longitudes, precision: int) -> np.ndarray:
+    """Geohash cells of points as integers (the bits of the base-32 string), vectorized; precision up to 12"""
+    bits = 5 * precision
+    lon_bits, lat_bits = (bits + 1) // 2, bits // 2
+    lat_index = np.clip(((np.asarray(latitudes) + 90) / 180 * (1 << lat_bits)).astype(np.int64), 0, (1 << lat_bits) - 1)
+    lon_index = np.clip(((np.asarray(longitudes) + 180) / 360 * (1 << lon_bits)).astype(np.int64), 0, (1 << lon_bits) - 1)
+    # Bits alternate from the most significant, starting with longitude
+    if bits % 2:
+        return _spread_bits(lon_index) | (_spread_bits(lat_index) << 1)
+    return (_spread_bits(lon_index) << 1) | _spread_bits(lat_index)
+
+def geohash_centers(cells, precision: int):
+    """Latitudes and longitudes of the centres of integer geohash cells"""
+    bits = 5 * precision
+    lon_bits, lat_bits = (bits + 1) // 2, bits // 2
+    cells = np.asarray(cells, dtype=np.int64)
+    if bits % 2:
+        lon_index, lat_index = _compact_bits(cells), _compact_bits(cells >> 1)
+    else:
+        lon_index, lat_index = _compact_bits(cells >> 1), _compact_bits(cells)
+    return (lat_index + 0.5) / (1 << lat_bits) * 180 - 90, (lon_index + 0.5) / (1 << lon_bits) * 360 - 180
+
+def geohash_encode(latitude: float, longitude: float, precision: int = 7) -> str:
+    cell = int(geohash_cells(latitude, longitude, precision))
+    return "".join(GEOHASH_BASE32[(cell >> (5 * (precision - 1 - i))) & 31] for i in range(precision))
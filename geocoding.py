@@ -0,0 +1,361 @@
+# geocoding.py - Address geocoding with in-process and database caches (backfill with: python geocoding.py)
+import argparse
+import asyncio
+import hashlib
+import os
+import re
+import time
+import unicodedata
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from dotenv import load_dotenv
+from sqlalchemy import or_, select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from database import AsyncSessionLocal
+from models import GeocodeCache, Order
+from services import HTTPConnectionPool
+from tracking import parse_location
+
+load_dotenv()
+
+Coordinates = Tuple[float, float]
+
+# Abbreviations expanded by normalize_address(); an empty expansion drops the word
+ABBREVIATIONS = {
+    "st": "street", "rd": "road", "ave": "avenue", "av": "avenue", "ln": "lane", "pl": "place",
+    "dr": "drive", "blvd": "boulevard", "hwy": "highway", "mw": "mawatha", "mawata": "mawatha",
+    "apt": "apartment", "flr": "floor", "no": "", "number": ""
+}
+
+def normalize_address(address: str) -> str:
+    """Cache key for an address: case, punctuation, spacing, abbreviations and country folded"""
+    text = unicodedata.normalize("NFKC", address).casefold()
+    words = [ABBREVIATIONS.get(word, word) for word in re.sub(r"[\W_]+", " ", text).split()]
+    words = [word for word in words if word]
+    if words[-2:] == ["sri", "lanka"]:
+        words = words[:-2]
+    return " ".join(words)[:500]
+
+class OfflineBackend:
+    """Local stand-in for development and tests: resolves the last known place named in an address
+
+    Positions within a place are synthetic, a stable offset of up to
+    GEOCODE_OFFLINE_SPREAD_KM derived from the whole address.
+    """
+
+    name = "offline"
+
+    PLACES = {
+        "colombo": (6.9271, 79.8612), "dehiwala": (6.8511, 79.8659), "mount lavinia": (6.8390, 79.8653),
+        "moratuwa": (6.7730, 79.8816), "nugegoda": (6.8649, 79.8997), "maharagama": (6.8480, 79.9265),
+        "kotte": (6.8868, 79.9187), "battaramulla": (6.9000, 79.9180), "rajagiriya": (6.9094, 79.8970),
+        "kaduwela": (6.9354, 79.9845), "kelaniya": (6.9553, 79.9220), "wattala": (6.9897, 79.8917),
+        "panadura": (6.7133, 79.9026), "kalutara": (6.5854, 79.9607), "gampaha": (7.0840, 80.0098),
+        "negombo": (7.2083, 79.8358), "chilaw": (7.5758, 79.7953), "puttalam": (8.0362, 79.8283),
+        "kandy": (7.2906, 80.6337), "matale": (7.4675, 80.6234), "kegalle": (7.2513, 80.3464),
+        "kurunegala": (7.4863, 80.3647), "nuwara eliya": (6.9497, 80.7891), "badulla": (6.9934, 81.0550),
+        "ratnapura": (6.6828, 80.3992), "galle": (6.0535, 80.2210), "matara": (5.9549, 80.5550),
+        "hambantota": (6.1241, 81.1185), "anuradhapura": (8.3114, 80.4037), "polonnaruwa": (7.9403, 81.0188),
+        "trincomalee": (8.5874, 81.2152), "batticaloa": (7.7310, 81.6747), "ampara": (7.2975, 81.6820),
+        "vavuniya": (8.7514, 80.4971), "mannar": (8.9810, 79.9044), "jaffna": (9.6615, 80.0255)
+    }
+
+    def __init__(self, spread_km: float = float(os.getenv("GEOCODE_OFFLINE_SPREAD_KM", "2"))):
+        self.spread_degrees = spread_km / 111.2
+        self._pattern = re.compile(r"\b(" + "|".join(sorted(self.PLACES, key=len, reverse=True)) + r")\b")
+
+    async def geocode(self, address: str) -> Optional[Coordinates]:
+        matches = self._pattern.findall(address)
+        if not matches:
+            return None
+        latitude, longitude = self.PLACES[matches[-1]]
+        digest = hashlib.sha256(address.encode()).digest()
+        offsets = (int.from_bytes(digest[:4], "big") / 2 ** 32 * 2 - 1, int.from_bytes(digest[4:8], "big") / 2 ** 32 * 2 - 1)
+        return round(latitude + offsets[0] * self.spread_degrees, 6), round(longitude + offsets[1] * self.spread_degrees, 6)
+
+    async def close(self):
+        pass
+
+class NominatimBackend:
+    """OpenStreetMap Nominatim search API; the public instance allows one request a second (GEOCODE_WORKERS=1)"""
+
+    name = "nominatim"
+
+    def __init__(
+        self,
+        base_url: str = os.getenv("NOMINATIM_URL", "https://nominatim.openstreetmap.org"),
+        user_agent: str = os.getenv("GEOCODER_USER_AGENT", "swiftlogistics-backend"),
+        country_codes: str = os.getenv("GEOCODER_COUNTRY_CODES", "lk")
+    ):
+        self.base_url = base_url
+        self.user_agent = user_agent
+        self.country_codes = country_codes
+        self.pool = HTTPConnectionPool("geocoder", timeout=10)
+
+    async def geocode(self, address: str) -> Optional[Coordinates]:
+        async with self.pool.request(
+            "GET",
+            f"{self.base_url}/search",
+            params={"q": address, "format": "jsonv2", "limit": 1, "countrycodes": self.country_codes},
+            headers={"User-Agent": self.user_agent}
+        ) as response:
+            if response.status != 200:
+                raise Exception(f"Geocoder error: {response.status}")
+            results = await response.json()
+        if not results:
+            return None
+        return float(results[0]["lat"]), float(results[0]["lon"])
+
+    async def close(self):
+        await self.pool.close()
+
+# Backends selectable with GEOCODER; any object with name, geocode() and close() can be passed to Geocoder.
+# Unset, there is no backend: only literal "lat,lon" addresses resolve and other coordinates stay NULL
+GEOCODING_BACKENDS = {"offline": OfflineBackend, "nominatim": NominatimBackend}
+
+class Geocoder:
+    """Address to coordinates through an in-process LRU, the geocode_cache table and a backend
+
+    Entries are keyed by normalize_address(). Addresses the backend could not
+    resolve are cached too, for negative_ttl, so they are retried later but
+    not on every order. Backend errors are not cached. Backend lookups run on
+    at most `workers` at a time, and concurrent lookups of one address share
+    a single request. Cached rows are only used if the current backend wrote
+    them, so switching GEOCODER never serves another provider's answers.
+    """
+
+    def __init__(
+        self,
+        backend=None,
+        max_entries: int = int(os.getenv("GEOCODE_CACHE_SIZE", "50000")),
+        workers: int = int(os.getenv("GEOCODE_WORKERS", "8")),
+        negative_ttl: timedelta = timedelta(hours=float(os.getenv("GEOCODE_NEGATIVE_TTL_HOURS", "24")))
+    ):
+        if backend is None and os.getenv("GEOCODER"):
+            backend = GEOCODING_BACKENDS[os.getenv("GEOCODER")]()
+        self.backend = backend
+        self.max_entries = max_entries
+        self.workers = workers
+        self.negative_ttl = negative_ttl
+        self._entries: "OrderedDict[str, Tuple[float, Optional[Coordinates]]]" = OrderedDict()
+        self._pending: Dict[str, asyncio.Future] = {}
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self.hits = 0
+        self.db_hits = 0
+        self.lookups = 0
+        self.failures = 0
+
+    async def geocode(self, address: str) -> Optional[Coordinates]:
+        return (await self.geocode_many([address])).get(address)
+
+    async def geocode_many(self, addresses: Iterable[str]) -> Dict[str, Optional[Coordinates]]:
+        """Coordinates for each address (None when unknown), keyed by the address as given"""
+        results: Dict[str, Optional[Coordinates]] = {}
+        keys: Dict[str, str] = {}
+        for address in addresses:
+            if not address:
+                continue
+            literal = parse_location(address)
+            if literal is not None:
+                results[address] = literal
+            else:
+                keys[address] = normalize_address(address)
+
+        found: Dict[str, Optional[Coordinates]] = {}
+        now = time.monotonic()
+        for key in set(keys.values()):
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                found[key] = entry[1]
+
+        if self.backend is None:
+            return results
+        missing = [key for key in set(keys.values()) if key not in found]
+        if missing:
+            found.update(await self._load(missing))
+            missing = [key for key in missing if key not in found]
+        if missing:
+            found.update(await self._resolve(missing))
+
+        for address, key in keys.items():
+            results[address] = found.get(key)
+        return results
+
+    def _store(self, key: str, coordinates: Optional[Coordinates], expires_at: float = float("inf")):
+        self._entries[key] = (expires_at, coordinates)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    async def _load(self, keys: List[str]) -> Dict[str, Optional[Coordinates]]:
+        """Entries from geocode_cache, skipping expired negative ones"""
+        found = {}
+        now = datetime.utcnow()
+        async with AsyncSessionLocal() as db:
+            for offset in range(0, len(keys), 1000):
+                result = await db.execute(
+                    select(GeocodeCache.address, GeocodeCache.latitude, GeocodeCache.longitude, GeocodeCache.created_at)
+                    .where(
+                        GeocodeCache.address.in_(keys[offset:offset + 1000]),
+                        GeocodeCache.provider == self.backend.name
+                    )
+                )
+                for address, latitude, longitude, created_at in result.all():
+                    if latitude is None:
+                        remaining = (created_at + self.negative_ttl - now).total_seconds()
+                        if remaining <= 0:
+                            continue
+                        self._store(address, None, time.monotonic() + remaining)
+                        found[address] = None
+                    else:
+                        self._store(address, (latitude, longitude))
+                        found[address] = (latitude, longitude)
+                    self.db_hits += 1
+        return found
+
+    async def _resolve(self, keys: List[str]) -> Dict[str, Optional[Coordinates]]:
+        """Look addresses up with the backend and persist what it answers"""
+        loop = asyncio.get_running_loop()
+        owned = [key for key in keys if key not in self._pending]
+        waiting = {key: self._pending[key] for key in keys if key in self._pending}
+        for key in owned:
+            self._pending[key] = loop.create_future()
+
+        answered: Dict[str, Optional[Coordinates]] = {}
+        try:
+            if self._semaphore is None:
+                self._semaphore = asyncio.Semaphore(self.workers)
+            for key, coordinates, ok in await asyncio.gather(*(self._lookup(key) for key in owned)):
+                if ok:
+                    answered[key] = coordinates
+            await self._save(answered)
+        finally:
+            for key in owned:
+                future = self._pending.pop(key)
+                if not future.done():
+                    future.set_result(answered.get(key))
+
+        found = dict(answered)
+        for key, future in waiting.items():
+            found[key] = await future
+        return found
+
+    async def _lookup(self, key: str) -> Tuple[str, Optional[Coordinates], bool]:
+        async with self._semaphore:
+            self.lookups += 1
+            try:
+                return key, await self.backend.geocode(key), True
+            except Exception as e:
+                self.failures += 1
+                print(f"Geocoding failed for {key!r}: {e}")
+                return key, None, False
+
+    async def _save(self, answered: Dict[str, Optional[Coordinates]]):
+        if not answered:
+            return
+        now = datetime.utcnow()
+        negative_expiry = time.monotonic() + self.negative_ttl.total_seconds()
+        rows = []
+        for key, coordinates in answered.items():
+            self._store(key, coordinates, negative_expiry if coordinates is None else float("inf"))
+            rows.append({
+                "address": key,
+                "latitude": coordinates[0] if coordinates else None,
+                "longitude": coordinates[1] if coordinates else None,
+                "provider": self.backend.name,
+                "created_at": now
+            })
+        try:
+            async with AsyncSessionLocal() as db:
+                for offset in range(0, len(rows), 1000):
+                    statement = pg_insert(GeocodeCache).values(rows[offset:offset + 1000])
+                    await db.execute(statement.on_conflict_do_update(
+                        index_elements=[GeocodeCache.address],
+                        set_={
+                            "latitude": statement.excluded.latitude,
+                            "longitude": statement.excluded.longitude,
+                            "provider": statement.excluded.provider,
+                            "created_at": statement.excluded.created_at
+                        }
+                    ))
+                await db.commit()
+        except Exception as e:
+            # Still cached in process; the next worker to miss looks it up again
+            print(f"Geocode cache write failed: {e!r}")
+
+    async def close(self):
+        if self.backend is not None:
+            await self.backend.close()
+
+    def stats(self):
+        return {
+            "backend": self.backend.name if self.backend is not None else None,
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "db_hits": self.db_hits,
+            "lookups": self.lookups,
+            "failures": self.failures
+        }
+
+geocoder = Geocoder()
+
+async def geocode_orders(orders: List[Order]):
+    """Fill missing pickup and delivery coordinates of orders from their addresses"""
+    addresses = []
+    for order in orders:
+        if order.pickup_latitude is None:
+            addresses.append(order.pickup_address)
+        if order.delivery_latitude is None:
+            addresses.append(order.delivery_address)
+    if not addresses:
+        return
+    found = await geocoder.geocode_many(addresses)
+    for order in orders:
+        if order.pickup_latitude is None and found.get(order.pickup_address):
+            order.pickup_latitude, order.pickup_longitude = found[order.pickup_address]
+        if order.delivery_latitude is None and found.get(order.delivery_address):
+            order.delivery_latitude, order.delivery_longitude = found[order.delivery_address]
+
+async def backfill_orders(batch_size: int) -> int:
+    """Geocode existing orders that have no coordinates; returns how many were updated"""
+    updated, after = 0, ""
+    while True:
+        async with AsyncSessionLocal() as db:
+            result = await db.execute(
+                select(Order)
+                .where(Order.id > after, or_(Order.pickup_latitude.is_(None), Order.delivery_latitude.is_(None)))
+                .order_by(Order.id)
+                .limit(batch_size)
+            )
+            orders = result.scalars().all()
+            if not orders:
+                return updated
+            before = [(order.pickup_latitude, order.delivery_latitude) for order in orders]
+            await geocode_orders(orders)
+            updated += sum(
+                (order.pickup_latitude, order.delivery_latitude) != previous for order, previous in zip(orders, before)
+            )
+            await db.commit()
+            after = orders[-1].id
+        print(f"Geocoded {updated} orders")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Geocode orders that have no coordinates")
+    parser.add_argument("--batch-size", type=int, default=1000)
+    args = parser.parse_args()
+    if geocoder.backend is None:
+        parser.error(f"set GEOCODER to one of: {', '.join(GEOCODING_BACKENDS)}")
+
+    async def main():
+        try:
+            print(f"Updated {await backfill_orders(args.batch_size)} orders")
+            print(geocoder.stats())
+        finally:
+            await geocoder.close()
+
+    asyncio.run(main())
@@ -0,0 +1,99 @@
+# jobs.py - Durable order-processing jobs carried by RabbitMQ
+import uuid
+from datetime import datetime, timedelta
+from typing import List, Optional
+
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database import AsyncSessionLocal
+from models import OrderJob
+from services import message_broker
+
+ORDER_QUEUE = "order.submitted"
+DEAD_LETTER_QUEUE = "order.submitted.dlq"
+RETRY_QUEUE_PREFIX = "order.submitted.retry"
+
+def new_order_job(order_id: str) -> OrderJob:
+    """Build the job row that tracks processing of an order"""
+    return OrderJob(id=str(uuid.uuid4()), order_id=order_id, status="pending", attempts=0)
+
+def job_message(job_id: str, order_id: str, attempt: int = 1) -> dict:
+    return {"job_id": job_id, "order_id": order_id, "attempt": attempt}
+
+def batch_job_message(entries: List[dict], attempt: int = 1) -> dict:
+    """One message carrying several jobs, processed with batched upstream calls"""
+    return {
+        "batch": [{"job_id": entry["job_id"], "order_id": entry["order_id"]} for entry in entries],
+        "attempt": attempt
+    }
+
+async def publish_order_job(db: AsyncSession, job: OrderJob) -> bool:
+    """Hand a committed job to the broker; unpublished jobs stay pending for the sweeper"""
+    published = await message_broker.publish_message(ORDER_QUEUE, job_message(job.id, job.order_id), confirm=True)
+    if published:
+        await _mark_queued(db, [job.id])
+    return published
+
+async def publish_order_jobs(db: AsyncSession, jobs: List[dict]) -> bool:
+    """Hand committed jobs (dicts with job_id and order_id) to the broker as one batch"""
+    published = await message_broker.publish_message(ORDER_QUEUE, batch_job_message(jobs), confirm=True)
+    if published:
+        await _mark_queued(db, [job["job_id"] for job in jobs])
+    return published
+
+async def _mark_queued(db: AsyncSession, job_ids: List[str]):
+    # Only promote pending jobs: a fast worker may already have picked them up
+    await db.execute(
+        update(OrderJob)
+        .where(OrderJob.id.in_(job_ids), OrderJob.status == "pending")
+        .values(status="queued", updated_at=datetime.utcnow())
+    )
+    await db.commit()
+
+async def set_job_status(
+    job_id: Optional[str],
+    status: str,
+    attempts: Optional[int] = None,
+    error: Optional[str] = None
+):
+    """Record a job state transition"""
+    await set_jobs_status([job_id], status, attempts=attempts, error=error)
+
+async def set_jobs_status(
+    job_ids: List[Optional[str]],
+    status: str,
+    attempts: Optional[int] = None,
+    error: Optional[str] = None
+):
+    """Record the same state transition for several jobs"""
+    job_ids = [job_id for job_id in job_ids if job_id]
+    if not job_ids:
+        return
+    values = {"status": status, "updated_at": datetime.utcnow()}
+    if attempts is not None:
+        values["attempts"] = attempts
+    if error is not None:
+        values["last_error"] = error
+    if status in ("succeeded", "dead"):
+        values["finished_at"] = datetime.utcnow()
+    async with AsyncSessionLocal() as db:
+        await db.execute(update(OrderJob).where(OrderJob.id.in_(job_ids)).values(**values))
+        await db.commit()
+
+async def requeue_pending_jobs(older_than: timedelta = timedelta(seconds=30), limit: int = 500) -> int:
+    """Publish jobs whose original enqueue never reached the broker"""
+    cutoff = datetime.utcnow() - older_than
+    async with AsyncSessionLocal() as db:
+        result = await db.execute(
+            select(OrderJob)
+            .where(OrderJob.status == "pending", OrderJob.created_at < cutoff)
+            .order_by(OrderJob.created_at)
+            .limit(limit)
+        )
+        requeued = 0
+        for job in result.scalars().all():
+            if not await publish_order_job(db, job):
+                break
+            requeued += 1
+    return requeued
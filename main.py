@@ -1,10 +1,15 @@
 # main.py - Main FastAPI application
-from fastapi import FastAPI, HTTPException, Depends, BackgroundTasks, WebSocket, WebSocketDisconnect
+# Imported first so the startup profiler's import phase covers loading the app
+from startup import startup_profiler
+from fastapi import FastAPI, HTTPException, Depends, Query, Request, Response, WebSocket, WebSocketDisconnect
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from fastapi.middleware.cors import CORSMiddleware
-from sqlalchemy.orm import Session
+from sqlalchemy import select, insert, tuple_, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from pydantic import ValidationError
 from typing import List, Optional, Dict, Any
 import json
+import base64
 import asyncio
 from datetime import datetime, timedelta
 import uuid
@@ -12,24 +17,36 @@ import os
 from dotenv import load_dotenv
 
 # Import our modules
-from database import get_db, engine
-from models import Base, User, Order, Package, Route, DeliveryUpdate
+from analytics import get_delivery_analytics
+from dispatch import DISPATCH_BATCH_SIZE, dispatch_orders, notify_assignments
+from database import AsyncSessionLocal, get_db, check_database, create_tables, dispose_engines
+from jobs import new_order_job, publish_order_job, publish_order_jobs
+from models import Base, User, Order, OrderStatus, OrderJob, Package, Route, DeliveryUpdate
 from schemas import (
     OrderCreate, OrderResponse, UserCreate, UserResponse, 
     PackageResponse, RouteResponse, DeliveryUpdateCreate,
-    LoginRequest, TokenResponse
+    LoginRequest, TokenResponse, OrderJobResponse, OrderListItem,
+    OrderBatchItemResult, OrderBatchResponse, LocationPoint, LocationBatch, DriverPosition
 )
-from auth import create_access_token, verify_token, get_current_user, hash_password, verify_password
+from auth import (
+    create_access_token, verify_token, get_current_user, get_current_principal,
+    hash_password_async, verify_password_async, password_hasher_stats
+)
+from order_stats import ensure_order_stats, record_status_changes, get_status_counts, get_stats_timeseries, delivery_rate
+from principal_cache import Principal, principal_cache
+from realtime import ConnectionManager
+from redis_client import close_redis
+from response_cache import response_cache, order_cache_key, driver_routes_cache_key
 from services import (
     cms_service, ros_service, wms_service, 
-    message_broker, notification_service
+    message_broker, notification_service,
+    start_connection_pools, close_connection_pools, connection_pool_stats
 )
+from tracking import location_ingestor, parse_location
+from travel_matrix import travel_times
 
 load_dotenv()
 
-# Create database tables
-Base.metadata.create_all(bind=engine)
-
 app = FastAPI(
     title="SwiftLogistics Middleware API",
     description="Backend middleware for SwiftLogistics delivery platform",
@@ -47,26 +64,34 @@ app.add_middleware(
 
 security = HTTPBearer()
 
-# WebSocket connection manager for real-time updates
-class ConnectionManager:
-    def __init__(self):
-        self.active_connections: Dict[str, WebSocket] = {}
-    
-    async def connect(self, websocket: WebSocket, client_id: str):
-        await websocket.accept()
-        self.active_connections[client_id] = websocket
-    
-    def disconnect(self, client_id: str):
-        if client_id in self.active_connections:
-            del self.active_connections[client_id]
-    
-    async def send_message(self, client_id: str, message: dict):
-        if client_id in self.active_connections:
-            await self.active_connections[client_id].send_text(json.dumps(message))
-    
-    async def broadcast(self, message: dict):
-        for connection in self.active_connections.values():
-            await connection.send_text(json.dumps(message))
+# Create missing tables at startup (disable once the schema is managed by migrations)
+DB_CREATE_TABLES = os.getenv("DB_CREATE_TABLES", "true").lower() == "true"
+
+@app.on_event("startup")
+async def startup_event():
+    with startup_profiler.phase("database"):
+        await check_database()
+        if DB_CREATE_TABLES:
+            await create_tables()
+    with startup_profiler.phase("order_stats"):
+        await ensure_order_stats()
+    with startup_profiler.phase("connection_pools"):
+        await start_connection_pools()
+    with startup_profiler.phase("websocket_backplane"):
+        await manager.start()
+    # Connects in the background; publishing buffers until then
+    message_broker.publisher.start()
+    location_ingestor.start()
+    startup_profiler.finish()
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    await manager.close()
+    await location_ingestor.close()
+    await message_broker.close_publisher()
+    await close_connection_pools()
+    await close_redis()
+    await dispose_engines()
 
 manager = ConnectionManager()
 
@@ -75,16 +100,32 @@ manager = ConnectionManager()
 async def health_check():
     return {"status": "healthy", "timestamp": datetime.utcnow()}
 
+# Monitoring endpoint
+@app.get("/metrics")
+async def get_metrics():
+    return {
+        "connection_pools": connection_pool_stats(),
+        "principal_cache": principal_cache.stats(),
+        "password_hasher": password_hasher_stats(),
+        "websockets": manager.stats(),
+        "amqp_publisher": message_broker.publisher.stats(),
+        "response_cache": response_cache.stats(),
+        "location_ingest": location_ingestor.stats(),
+        "travel_times": travel_times.stats(),
+        "startup": startup_profiler.report()
+    }
+
 # Authentication endpoints
 @app.post("/auth/register", response_model=UserResponse)
-async def register(user_data: UserCreate, db: Session = Depends(get_db)):
+async def register(user_data: UserCreate, db: AsyncSession = Depends(get_db)):
     # Check if user already exists
-    existing_user = db.query(User).filter(User.email == user_data.email).first()
+    result = await db.execute(select(User).where(User.email == user_data.email))
+    existing_user = result.scalars().first()
     if existing_user:
         raise HTTPException(status_code=400, detail="Email already registered")
     
     # Create new user
-    hashed_password = hash_password(user_data.password)
+    hashed_password = await hash_password_async(user_data.password)
     user = User(
         email=user_data.email,
         username=user_data.username,
@@ -92,8 +133,8 @@ async def register(user_data: UserCreate, db: Session = Depends(get_db)):
         user_type=user_data.user_type
     )
     db.add(user)
-    db.commit()
-    db.refresh(user)
+    await db.commit()
+    await db.refresh(user)
     
     return UserResponse(
         id=user.id,
@@ -103,10 +144,19 @@ async def register(user_data: UserCreate, db: Session = Depends(get_db)):
     )
 
 @app.post("/auth/login", response_model=TokenResponse)
-async def login(login_data: LoginRequest, db: Session = Depends(get_db)):
-    user = db.query(User).filter(User.email == login_data.email).first()
-    if not user or not verify_password(login_data.password, user.hashed_password):
+async def login(login_data: LoginRequest, db: AsyncSession = Depends(get_db)):
+    result = await db.execute(select(User).where(User.email == login_data.email))
+    user = result.scalars().first()
+    if not user:
+        raise HTTPException(status_code=401, detail="Invalid credentials")
+    
+    valid, new_hash = await verify_password_async(login_data.password, user.hashed_password)
+    if not valid:
         raise HTTPException(status_code=401, detail="Invalid credentials")
+    if new_hash:
+        # Stored hash predates the current BCRYPT_ROUNDS; upgrade it transparently
+        user.hashed_password = new_hash
+        await db.commit()
     
     access_token = create_access_token(data={"sub": user.email, "user_id": user.id})
     return TokenResponse(access_token=access_token, token_type="bearer")
@@ -115,9 +165,8 @@ async def login(login_data: LoginRequest, db: Session = Depends(get_db)):
 @app.post("/orders", response_model=OrderResponse)
 async def create_order(
     order_data: OrderCreate,
-    background_tasks: BackgroundTasks,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: Principal = Depends(get_current_principal),
+    db: AsyncSession = Depends(get_db)
 ):
     # Create order in database
     order = Order(
@@ -125,16 +174,23 @@ async def create_order(
         client_id=current_user.id,
         pickup_address=order_data.pickup_address,
         delivery_address=order_data.delivery_address,
-        package_details=json.dumps(order_data.package_details),
+        pickup_latitude=order_data.pickup_latitude,
+        pickup_longitude=order_data.pickup_longitude,
+        delivery_latitude=order_data.delivery_latitude,
+        delivery_longitude=order_data.delivery_longitude,
+        package_details=order_data.package_details,
         priority=order_data.priority,
         status="submitted"
     )
+    job = new_order_job(order.id)
     db.add(order)
-    db.commit()
-    db.refresh(order)
+    db.add(job)
+    await record_status_changes(db, [(None, order.status)])
+    await db.commit()
+    await db.refresh(order)
     
-    # Process order asynchronously
-    background_tasks.add_task(process_order, order.id, db)
+    # Hand the order to the processing workers (see worker.py)
+    await publish_order_job(db, job)
     
     return OrderResponse(
         id=order.id,
@@ -144,33 +200,242 @@ async def create_order(
         created_at=order.created_at
     )
 
-@app.get("/orders", response_model=List[OrderResponse])
+ORDER_BATCH_MAX_SIZE = int(os.getenv("ORDER_BATCH_MAX_SIZE", "1000"))
+
+async def read_order_batch(request: Request) -> List[Any]:
+    """Read a JSON array or an NDJSON stream of orders from the request body
+
+    Lines that are not valid JSON are kept as ValueError items so they can be
+    reported per item instead of failing the whole batch.
+    """
+    content_type = request.headers.get("content-type", "")
+    if "ndjson" not in content_type and "jsonlines" not in content_type:
+        try:
+            items = await request.json()
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Body must be a JSON array of orders")
+        if not isinstance(items, list):
+            raise HTTPException(status_code=400, detail="Body must be a JSON array of orders")
+        if len(items) > ORDER_BATCH_MAX_SIZE:
+            raise HTTPException(status_code=413, detail=f"At most {ORDER_BATCH_MAX_SIZE} orders per batch")
+        return items
+    
+    items = []
+    
+    def add_line(line: bytes):
+        if not line.strip():
+            return
+        try:
+            items.append(json.loads(line))
+        except ValueError as e:
+            items.append(ValueError(f"Invalid JSON: {e}"))
+        if len(items) > ORDER_BATCH_MAX_SIZE:
+            raise HTTPException(status_code=413, detail=f"At most {ORDER_BATCH_MAX_SIZE} orders per batch")
+    
+    # Parse line by line as the body streams in
+    buffer = b""
+    async for chunk in request.stream():
+        *lines, buffer = (buffer + chunk).split(b"\n")
+        for line in lines:
+            add_line(line)
+    add_line(buffer)
+    return items
+
+@app.post("/orders/batch", response_model=OrderBatchResponse)
+async def create_orders_batch(
+    request: Request,
+    current_user: Principal = Depends(get_current_principal),
+    db: AsyncSession = Depends(get_db)
+):
+    items = await read_order_batch(request)
+    
+    results = []
+    order_rows = []
+    job_rows = []
+    now = datetime.utcnow()
+    for index, item in enumerate(items):
+        try:
+            if isinstance(item, ValueError):
+                raise item
+            order_data = OrderCreate.model_validate(item)
+        except ValidationError as e:
+            error = "; ".join(f"{'.'.join(map(str, err['loc']))}: {err['msg']}" for err in e.errors())
+            results.append(OrderBatchItemResult(index=index, status="rejected", error=error))
+            continue
+        except ValueError as e:
+            results.append(OrderBatchItemResult(index=index, status="rejected", error=str(e)))
+            continue
+        
+        order_id = str(uuid.uuid4())
+        order_rows.append({
+            "id": order_id,
+            "client_id": current_user.id,
+            "pickup_address": order_data.pickup_address,
+            "delivery_address": order_data.delivery_address,
+            "pickup_latitude": order_data.pickup_latitude,
+            "pickup_longitude": order_data.pickup_longitude,
+            "delivery_latitude": order_data.delivery_latitude,
+            "delivery_longitude": order_data.delivery_longitude,
+            "package_details": order_data.package_details,
+            "priority": order_data.priority,
+            "status": "submitted",
+            "created_at": now,
+            "updated_at": now
+        })
+        job_rows.append({
+            "id": str(uuid.uuid4()),
+            "order_id": order_id,
+            "status": "pending",
+            "attempts": 0,
+            "created_at": now,
+            "updated_at": now
+        })
+        results.append(OrderBatchItemResult(index=index, status="accepted", order_id=order_id))
+    
+    if order_rows:
+        # One multi-row INSERT per table instead of a round trip per order
+        await db.execute(insert(Order).values(order_rows))
+        await db.execute(insert(OrderJob).values(job_rows))
+        await record_status_changes(db, [(None, "submitted")] * len(order_rows), at=now)
+        await db.commit()
+        
+        # One job message for the whole batch so workers can call upstream systems in bulk
+        await publish_order_jobs(db, [
+            {"job_id": job["id"], "order_id": job["order_id"]} for job in job_rows
+        ])
+    
+    return OrderBatchResponse(
+        accepted=len(order_rows),
+        rejected=len(results) - len(order_rows),
+        results=results
+    )
+
+ORDER_LIST_FIELDS = {"id", "status", "pickup_address", "delivery_address", "package_details", "priority", "created_at", "updated_at"}
+ORDER_LIST_DEFAULT_FIELDS = ["id", "status", "pickup_address", "delivery_address", "created_at"]
+
+def encode_order_cursor(created_at: datetime, order_id: str) -> str:
+    """Opaque keyset cursor pointing just after the given row"""
+    raw = json.dumps([created_at.isoformat(), order_id]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def decode_order_cursor(cursor: str):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        created_at, order_id = json.loads(raw)
+        return datetime.fromisoformat(created_at), str(order_id)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+@app.get(
+    "/orders",
+    response_model=List[OrderListItem],
+    response_model_exclude_unset=True
+)
 async def get_orders(
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    request: Request,
+    response: Response,
+    limit: int = Query(100, ge=1, le=500),
+    cursor: Optional[str] = None,
+    status: Optional[List[str]] = Query(None),
+    priority: Optional[str] = None,
+    created_from: Optional[datetime] = None,
+    created_to: Optional[datetime] = None,
+    fragile: Optional[bool] = None,
+    min_weight: Optional[float] = Query(None, description="Package weight in kg"),
+    max_weight: Optional[float] = Query(None, description="Package weight in kg"),
+    fields: Optional[str] = Query(None, description="Comma-separated columns to return"),
+    current_user: Principal = Depends(get_current_principal),
+    db: AsyncSession = Depends(get_db)
 ):
+    selected = [field.strip() for field in fields.split(",") if field.strip()] if fields else ORDER_LIST_DEFAULT_FIELDS
+    unknown = set(selected) - ORDER_LIST_FIELDS
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(sorted(unknown))}")
+    
+    # created_at and id are always read because the next cursor is built from them
+    columns = list(dict.fromkeys(selected + ["created_at", "id"]))
+    query = select(*(getattr(Order, column) for column in columns))
+    
     if current_user.user_type == "client":
-        orders = db.query(Order).filter(Order.client_id == current_user.id).all()
-    else:  # driver can see assigned orders
-        orders = db.query(Order).filter(Order.assigned_driver_id == current_user.id).all()
+        query = query.where(Order.client_id == current_user.id)
+    elif current_user.user_type == "driver":  # driver can see assigned orders
+        query = query.where(Order.assigned_driver_id == current_user.id)
+    # admins see every order, e.g. ?status=in_warehouse&fragile=true
+    
+    if status:
+        invalid = set(status) - {item.value for item in OrderStatus}
+        if invalid:
+            raise HTTPException(status_code=400, detail=f"Unknown status: {', '.join(sorted(invalid))}")
+        query = query.where(Order.status.in_(status))
+    if priority:
+        query = query.where(Order.priority == priority)
+    if created_from:
+        query = query.where(Order.created_at >= created_from)
+    if created_to:
+        query = query.where(Order.created_at < created_to)
+    # Package filters run in the database on the JSONB column
+    if fragile is not None:
+        query = query.where(Order.package_fragile if fragile else Order.package_fragile.is_not(True))
+    if min_weight is not None:
+        query = query.where(Order.package_weight >= min_weight)
+    if max_weight is not None:
+        query = query.where(Order.package_weight <= max_weight)
+    if cursor:
+        cursor_created_at, cursor_id = decode_order_cursor(cursor)
+        query = query.where(tuple_(Order.created_at, Order.id) < tuple_(cursor_created_at, cursor_id))
     
-    return [
-        OrderResponse(
+    # Newest first; one extra row tells whether another page exists
+    query = query.order_by(Order.created_at.desc(), Order.id.desc()).limit(limit + 1)
+    rows = (await db.execute(query)).all()
+    
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_order_cursor(rows[-1].created_at, rows[-1].id)
+        response.headers["X-Next-Cursor"] = next_cursor
+        response.headers["Link"] = f'<{request.url.include_query_params(cursor=next_cursor)}>; rel="next"'
+    
+    return [OrderListItem(**{field: row._mapping[field] for field in selected}) for row in rows]
+
+@app.get("/orders/{order_id}", response_model=OrderResponse)
+async def get_order(
+    order_id: str,
+    request: Request,
+    current_user: Principal = Depends(get_current_principal),
+    db: AsyncSession = Depends(get_db)
+):
+    async def load():
+        result = await db.execute(select(Order).where(Order.id == order_id))
+        order = result.scalars().first()
+        if not order:
+            return None
+        body = OrderResponse(
             id=order.id,
             status=order.status,
             pickup_address=order.pickup_address,
             delivery_address=order.delivery_address,
             created_at=order.created_at
-        ) for order in orders
-    ]
+        ).model_dump_json()
+        return body, order.client_id
+    
+    # Cached with its owner so a hit, or a 304, needs no database access
+    entry = await response_cache.get_or_load(order_cache_key(order_id), load)
+    if entry is None:
+        raise HTTPException(status_code=404, detail="Order not found")
+    
+    # Check permission
+    if current_user.user_type == "client" and entry.owner_id != current_user.id:
+        raise HTTPException(status_code=403, detail="Access denied")
+    
+    return response_cache.respond(entry, request)
 
-@app.get("/orders/{order_id}", response_model=OrderResponse)
-async def get_order(
+@app.get("/orders/{order_id}/job", response_model=OrderJobResponse)
+async def get_order_job(
     order_id: str,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: Principal = Depends(get_current_principal),
+    db: AsyncSession = Depends(get_db)
 ):
-    order = db.query(Order).filter(Order.id == order_id).first()
+    result = await db.execute(select(Order).where(Order.id == order_id))
+    order = result.scalars().first()
     if not order:
         raise HTTPException(status_code=404, detail="Order not found")
     
@@ -178,30 +443,34 @@ async def get_order(
     if current_user.user_type == "client" and order.client_id != current_user.id:
         raise HTTPException(status_code=403, detail="Access denied")
     
-    return OrderResponse(
-        id=order.id,
-        status=order.status,
-        pickup_address=order.pickup_address,
-        delivery_address=order.delivery_address,
-        created_at=order.created_at
+    result = await db.execute(
+        select(OrderJob).where(OrderJob.order_id == order_id).order_by(OrderJob.created_at.desc())
     )
+    job = result.scalars().first()
+    if not job:
+        raise HTTPException(status_code=404, detail="No processing job for this order")
+    
+    return OrderJobResponse.model_validate(job)
 
 # Driver endpoints
 @app.post("/orders/{order_id}/update-status")
 async def update_delivery_status(
     order_id: str,
     update_data: DeliveryUpdateCreate,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: Principal = Depends(get_current_principal),
+    db: AsyncSession = Depends(get_db)
 ):
     if current_user.user_type != "driver":
         raise HTTPException(status_code=403, detail="Only drivers can update delivery status")
     
-    order = db.query(Order).filter(Order.id == order_id).first()
+    # Row lock so concurrent updates move the status counters from the right status
+    result = await db.execute(select(Order).where(Order.id == order_id).with_for_update())
+    order = result.scalars().first()
     if not order:
         raise HTTPException(status_code=404, detail="Order not found")
     
     # Update order status
+    previous_status = order.status
     order.status = update_data.status
     order.updated_at = datetime.utcnow()
     
@@ -216,17 +485,28 @@ async def update_delivery_status(
     )
     
     db.add(delivery_update)
-    db.commit()
+    # A "lat,lon" location also goes on the driver's GPS track
+    coordinates = parse_location(update_data.location)
+    if coordinates:
+        location_ingestor.add(current_user.id, [LocationPoint(latitude=coordinates[0], longitude=coordinates[1])])
+    await record_status_changes(db, [(previous_status, update_data.status)])
+    await db.commit()
+    await response_cache.invalidate(order_cache_key(order_id))
     
-    # Send real-time notification to client
-    await manager.send_message(
-        str(order.client_id),
+    # Send real-time notification to the client and to sockets following the order, driver or route
+    result = await db.execute(
+        select(Route.id).where(Route.driver_id == current_user.id, Route.status == "active")
+    )
+    await manager.deliver(
         {
             "type": "delivery_update",
             "order_id": order_id,
+            "driver_id": current_user.id,
             "status": update_data.status,
             "timestamp": datetime.utcnow().isoformat()
-        }
+        },
+        client_ids=[str(order.client_id)],
+        topics=[f"order:{order_id}", f"driver:{current_user.id}"] + [f"route:{route_id}" for route_id in result.scalars()]
     )
     
     # Notify WMS about status change
@@ -236,110 +516,247 @@ async def update_delivery_status(
 
 @app.get("/driver/routes", response_model=List[RouteResponse])
 async def get_driver_routes(
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    request: Request,
+    current_user: Principal = Depends(get_current_principal),
+    db: AsyncSession = Depends(get_db)
 ):
     if current_user.user_type != "driver":
         raise HTTPException(status_code=403, detail="Access denied")
     
-    routes = db.query(Route).filter(Route.driver_id == current_user.id).all()
-    return [
-        RouteResponse(
-            id=route.id,
-            driver_id=route.driver_id,
-            route_data=json.loads(route.route_data),
-            status=route.status,
-            created_at=route.created_at
-        ) for route in routes
-    ]
+    async def load():
+        result = await db.execute(select(Route).where(Route.driver_id == current_user.id))
+        routes = result.scalars().all()
+        body = "[" + ",".join(
+            RouteResponse(
+                id=route.id,
+                driver_id=route.driver_id,
+                route_data=route.route_data,
+                status=route.status,
+                created_at=route.created_at
+            ).model_dump_json() for route in routes
+        ) + "]"
+        return body, current_user.id
+    
+    entry = await response_cache.get_or_load(driver_routes_cache_key(current_user.id), load)
+    return response_cache.respond(entry, request)
 
-# WebSocket endpoint for real-time updates
-@app.websocket("/ws/{client_id}")
-async def websocket_endpoint(websocket: WebSocket, client_id: str):
-    await manager.connect(websocket, client_id)
+@app.post("/driver/routes/optimize", response_model=RouteResponse)
+async def optimize_driver_routes(
+    driver_id: Optional[int] = None,
+    current_user: Principal = Depends(get_current_principal),
+    db: AsyncSession = Depends(get_db)
+):
+    if current_user.user_type == "driver":
+        driver_id = current_user.id
+    elif current_user.user_type != "admin":
+        raise HTTPException(status_code=403, detail="Access denied")
+    elif driver_id is None:
+        raise HTTPException(status_code=400, detail="driver_id is required")
+    
+    # From ROS, or computed in process when ROS is down or ROUTE_OPTIMIZER=local
+    route_data = await ros_service.get_optimized_route(driver_id)
+    await db.execute(
+        update(Route).where(Route.driver_id == driver_id, Route.status == "active").values(status="superseded")
+    )
+    route = Route(id=str(uuid.uuid4()), driver_id=driver_id, route_data=route_data, status="active")
+    db.add(route)
+    await db.commit()
+    await db.refresh(route)
+    await response_cache.invalidate(driver_routes_cache_key(driver_id))
+    
+    await manager.deliver(
+        {
+            "type": "route_updated",
+            "route_id": route.id,
+            "driver_id": driver_id,
+            "stops": len(route.stops),
+            "total_distance": route.total_distance,
+            "timestamp": datetime.utcnow().isoformat()
+        },
+        client_ids=[str(driver_id)],
+        topics=[f"driver:{driver_id}", f"route:{route.id}"]
+    )
+    
+    return RouteResponse(
+        id=route.id,
+        driver_id=route.driver_id,
+        route_data=route.route_data,
+        status=route.status,
+        created_at=route.created_at
+    )
+
+# Driver location tracking
+@app.post("/driver/locations", status_code=202)
+async def ingest_driver_locations(
+    batch: LocationBatch,
+    response: Response,
+    current_user: Principal = Depends(get_current_principal)
+):
+    if current_user.user_type != "driver":
+        raise HTTPException(status_code=403, detail="Only drivers can report locations")
+    
+    # Buffered in memory and written in bulk (see tracking.py)
+    accepted = location_ingestor.add(current_user.id, batch.points)
+    if accepted < len(batch.points):
+        # Points are deduplicated by (driver, recorded_at), so resending the batch is safe
+        raise HTTPException(status_code=503, detail="Location buffer full", headers={"Retry-After": "1"})
+    return {"accepted": accepted}
+
+@app.get("/drivers/{driver_id}/location", response_model=DriverPosition)
+async def get_driver_location(
+    driver_id: int,
+    current_user: Principal = Depends(get_current_principal)
+):
+    if current_user.user_type != "admin" and current_user.id != driver_id:
+        raise HTTPException(status_code=403, detail="Access denied")
+    
+    position = await location_ingestor.get_latest(driver_id)
+    if position is None:
+        raise HTTPException(status_code=404, detail="No location reported for this driver")
+    return position
+
+@app.websocket("/ws/driver/locations")
+async def driver_locations_websocket(websocket: WebSocket, token: str = Query(...)):
+    """Stream of points from one driver: each message is a point or {"points": [...]}"""
+    try:
+        principal = await get_current_principal(HTTPAuthorizationCredentials(scheme="Bearer", credentials=token))
+    except HTTPException:
+        await websocket.close(code=1008)
+        return
+    if principal.user_type != "driver":
+        await websocket.close(code=1008)
+        return
+    
+    await websocket.accept()
     try:
         while True:
             data = await websocket.receive_text()
-            # Handle incoming WebSocket messages if needed
-            await manager.send_message(client_id, {"echo": data})
+            try:
+                message = json.loads(data)
+                if isinstance(message, dict) and "points" in message:
+                    points = LocationBatch.model_validate(message).points
+                else:
+                    points = [LocationPoint.model_validate(message)]
+            except (ValueError, ValidationError) as e:
+                await websocket.send_text(json.dumps({"type": "error", "detail": str(e)}))
+                continue
+            if location_ingestor.add(principal.id, points) < len(points):
+                await websocket.send_text(json.dumps({"type": "error", "detail": "Location buffer full"}))
     except WebSocketDisconnect:
-        manager.disconnect(client_id)
+        pass
 
-# Background task for order processing
-async def process_order(order_id: str, db: Session):
-    """Process order through CMS, WMS, and ROS systems"""
-    order = db.query(Order).filter(Order.id == order_id).first()
-    if not order:
+async def can_follow_topic(principal: Principal, topic: str) -> bool:
+    """Admins follow anything; others only their own driver feed and their own orders and routes"""
+    if principal.user_type == "admin":
+        return True
+    kind, _, key = topic.partition(":")
+    if kind == "driver":
+        return key == str(principal.id)
+    async with AsyncSessionLocal() as db:
+        if kind == "order":
+            result = await db.execute(select(Order.client_id, Order.assigned_driver_id).where(Order.id == key))
+            order = result.first()
+            return order is not None and principal.id in (order.client_id, order.assigned_driver_id)
+        if kind == "route":
+            return await db.scalar(select(Route.driver_id).where(Route.id == key)) == principal.id
+    return False
+
+# WebSocket endpoint for real-time updates
+@app.websocket("/ws/{client_id}")
+async def websocket_endpoint(websocket: WebSocket, client_id: str, token: str = Query(...)):
+    """Messages for client_id, plus subscriptions to topics it has access to
+
+    ?token= must belong to client_id itself, or to an admin; any other
+    socket is closed with 1008 before it receives anything.
+    """
+    try:
+        principal = await get_current_principal(HTTPAuthorizationCredentials(scheme="Bearer", credentials=token))
+    except HTTPException:
+        await websocket.close(code=1008)
         return
+    if principal.user_type != "admin" and client_id != str(principal.id):
+        await websocket.close(code=1008)
+        return
+    authorize = lambda topic: can_follow_topic(principal, topic)
     
+    connection = await manager.connect(websocket, client_id)
     try:
-        # 1. Submit to CMS (Client Management System)
-        cms_response = await cms_service.submit_order({
-            "order_id": order_id,
-            "client_id": order.client_id,
-            "pickup_address": order.pickup_address,
-            "delivery_address": order.delivery_address
-        })
-        
-        # 2. Add to WMS (Warehouse Management System)
-        wms_response = await wms_service.add_package({
-            "order_id": order_id,
-            "package_details": json.loads(order.package_details)
-        })
-        
-        # 3. Add to ROS (Route Optimization System)
-        ros_response = await ros_service.add_delivery_point({
-            "order_id": order_id,
-            "delivery_address": order.delivery_address,
-            "priority": order.priority
-        })
-        
-        # Update order status
-        order.status = "processing"
-        order.cms_reference = cms_response.get("reference_id")
-        order.wms_reference = wms_response.get("package_id")
-        order.ros_reference = ros_response.get("route_point_id")
-        
-        db.commit()
-        
-        # Send notification via message broker
-        await message_broker.publish_message("order.processed", {
-            "order_id": order_id,
-            "status": "processing"
-        })
-        
-    except Exception as e:
-        # Handle transaction failure
-        order.status = "failed"
-        order.error_message = str(e)
-        db.commit()
-        
-        # Send failure notification
-        await message_broker.publish_message("order.failed", {
-            "order_id": order_id,
-            "error": str(e)
-        })
+        while True:
+            data = await websocket.receive_text()
+            # {"action": "subscribe", "topic": "order:<id>"}; other messages are echoed
+            await manager.handle_client_message(connection, data, authorize)
+    except WebSocketDisconnect:
+        pass
+    finally:
+        await manager.disconnect(connection)
 
 # Admin endpoints
 @app.get("/admin/stats")
 async def get_admin_stats(
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: Principal = Depends(get_current_principal),
+    db: AsyncSession = Depends(get_db)
 ):
     if current_user.user_type != "admin":
         raise HTTPException(status_code=403, detail="Admin access required")
     
-    total_orders = db.query(Order).count()
-    pending_orders = db.query(Order).filter(Order.status == "submitted").count()
-    delivered_orders = db.query(Order).filter(Order.status == "delivered").count()
+    # Served from counters kept up to date on every status change (see order_stats.py)
+    counts, source = await get_status_counts(db)
+    total_orders = sum(counts.values())
+    delivered_orders = counts.get("delivered", 0)
     
     return {
         "total_orders": total_orders,
-        "pending_orders": pending_orders,
+        "pending_orders": counts.get("submitted", 0),
         "delivered_orders": delivered_orders,
-        "delivery_rate": (delivered_orders / total_orders * 100) if total_orders > 0 else 0
+        "delivery_rate": delivery_rate(delivered_orders, total_orders),
+        "by_status": counts,
+        "source": source
     }
 
+@app.get("/admin/stats/timeseries")
+async def get_admin_stats_timeseries(
+    granularity: str = Query("hour", pattern="^(hour|day)$"),
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    current_user: Principal = Depends(get_current_principal),
+    db: AsyncSession = Depends(get_db)
+):
+    if current_user.user_type != "admin":
+        raise HTTPException(status_code=403, detail="Admin access required")
+    
+    return {
+        "granularity": granularity,
+        "buckets": await get_stats_timeseries(db, granularity, since, until)
+    }
+
+@app.get("/admin/analytics")
+async def get_admin_analytics(
+    days: int = Query(90, ge=1, le=366),
+    driver_id: Optional[int] = None,
+    current_user: Principal = Depends(get_current_principal),
+    db: AsyncSession = Depends(get_db)
+):
+    if current_user.user_type != "admin":
+        raise HTTPException(status_code=403, detail="Admin access required")
+    
+    # Read from the daily rollups written by analytics.py, never from raw updates
+    return await get_delivery_analytics(db, days, driver_id)
+
+@app.post("/admin/dispatch")
+async def run_dispatch(
+    limit: int = Query(DISPATCH_BATCH_SIZE, ge=1, le=10000),
+    current_user: Principal = Depends(get_current_principal)
+):
+    if current_user.user_type != "admin":
+        raise HTTPException(status_code=403, detail="Admin access required")
+    
+    # One dispatch round on demand; dispatch.py runs them continuously
+    assignments = await dispatch_orders(limit)
+    await notify_assignments(manager, assignments)
+    return {"assigned": len(assignments), "assignments": assignments}
+
+startup_profiler.record("import", startup_profiler.started)
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
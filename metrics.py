@@ -0,0 +1,9 @@
+# metrics.py - Helpers for the latency figures reported by /metrics, the consumers and the benchmarks
+from typing import Iterable
+
+def percentile(values: Iterable[float], fraction: float) -> float:
+    """Nearest-rank percentile of values, with fraction in [0, 1]; 0.0 when there are none"""
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
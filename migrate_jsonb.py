@@ -0,0 +1,117 @@
+# migrate_jsonb.py - Converts the JSON text columns of orders and routes to JSONB
+#
+# Run the backfill while the previous release is still serving; it adds a
+# JSONB shadow column and fills it in batches. Then run the swap when
+# deploying the release that reads JSONB: it converts rows written since,
+# replaces the text column under a short table lock and builds the GIN index
+# without blocking writes.
+#
+#   python migrate_jsonb.py backfill --batch-size 1000
+#   python migrate_jsonb.py swap
+import argparse
+import asyncio
+import json
+from typing import Any, List, Optional, Tuple
+
+from dotenv import load_dotenv
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+from database import get_async_engine
+
+load_dotenv()
+
+# (table, column, GIN index to build after the swap)
+JSONB_COLUMNS: List[Tuple[str, str, Optional[str]]] = [
+    ("orders", "package_details", "ix_orders_package_details"),
+    ("orders", "processing_latency", None),
+    ("routes", "route_data", None)
+]
+
+def to_jsonb(value: str) -> Any:
+    """Parse stored JSON text; text that is not valid JSON is kept under "raw" """
+    try:
+        return json.loads(value)
+    except ValueError:
+        return {"raw": value}
+
+async def column_type(conn: AsyncConnection, table: str, column: str) -> Optional[str]:
+    return await conn.scalar(text(
+        "SELECT data_type FROM information_schema.columns WHERE table_name = :table AND column_name = :column"
+    ), {"table": table, "column": column})
+
+async def convert_batch(conn: AsyncConnection, table: str, column: str, after: str, batch_size: int) -> Tuple[Optional[str], int]:
+    """Fill the shadow column for the next rows by id; returns the last id (None when done) and the row count"""
+    rows = (await conn.execute(text(
+        f"SELECT id, {column} FROM {table} "
+        f"WHERE id > :after AND {column}_jsonb IS NULL AND {column} IS NOT NULL "
+        f"ORDER BY id LIMIT :limit"
+    ), {"after": after, "limit": batch_size})).all()
+    if not rows:
+        return None, 0
+    await conn.execute(
+        text(f"UPDATE {table} SET {column}_jsonb = CAST(:value AS jsonb) WHERE id = :id"),
+        [{"id": row_id, "value": json.dumps(to_jsonb(value))} for row_id, value in rows]
+    )
+    return rows[-1][0], len(rows)
+
+async def backfill(table: str, column: str, batch_size: int, pause: float):
+    async with get_async_engine().connect() as conn:
+        if await column_type(conn, table, column) == "jsonb":
+            print(f"{table}.{column} is already JSONB")
+            return
+        await conn.execute(text(f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS {column}_jsonb jsonb"))
+        await conn.commit()
+
+        # One short transaction per batch so row locks are held briefly
+        after, converted = "", 0
+        while True:
+            last, count = await convert_batch(conn, table, column, after, batch_size)
+            await conn.commit()
+            if last is None:
+                break
+            after = last
+            converted += count
+            print(f"{table}.{column}: {converted} rows converted")
+            await asyncio.sleep(pause)
+    print(f"{table}.{column}: backfill complete")
+
+async def swap(table: str, column: str, index: Optional[str], batch_size: int):
+    async with get_async_engine().connect() as conn:
+        if await column_type(conn, table, column) != "jsonb":
+            if await column_type(conn, table, f"{column}_jsonb") is None:
+                raise SystemExit(f"Run the backfill for {table}.{column} first")
+            await conn.execute(text(f"LOCK TABLE {table} IN ACCESS EXCLUSIVE MODE"))
+            # Rows created since the backfill
+            after = ""
+            while after is not None:
+                after, _ = await convert_batch(conn, table, column, after, batch_size)
+            await conn.execute(text(f"ALTER TABLE {table} DROP COLUMN {column}"))
+            await conn.execute(text(f"ALTER TABLE {table} RENAME COLUMN {column}_jsonb TO {column}"))
+            await conn.commit()
+            print(f"{table}.{column} is now JSONB")
+
+    if index:
+        # CONCURRENTLY cannot run inside a transaction
+        async with get_async_engine().connect() as conn:
+            autocommit = await conn.execution_options(isolation_level="AUTOCOMMIT")
+            await autocommit.execute(text(
+                f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {index} ON {table} USING gin ({column} jsonb_path_ops)"
+            ))
+            print(f"Index {index} ready")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Migrate JSON text columns to JSONB")
+    parser.add_argument("command", choices=["backfill", "swap"])
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--pause", type=float, default=0.05, help="Seconds between backfill batches")
+    args = parser.parse_args()
+
+    async def main():
+        for table, column, index in JSONB_COLUMNS:
+            if args.command == "backfill":
+                await backfill(table, column, args.batch_size, args.pause)
+            else:
+                await swap(table, column, index, args.batch_size)
+
+    asyncio.run(main())
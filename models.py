@@ -1,15 +1,19 @@
 # models.py - SQLAlchemy models
-from sqlalchemy import Column, Integer, String, DateTime, Text, ForeignKey, Enum
-from sqlalchemy.relationship import relationship
+from sqlalchemy import Column, Integer, SmallInteger, BigInteger, Float, String, Date, DateTime, Text, LargeBinary, ForeignKey, Enum, Index, and_, case, func
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.ext.hybrid import hybrid_property
+from sqlalchemy.orm import relationship
 from datetime import datetime
 import enum
 
-class UserType(enum.Enum):
+from database import Base
+
+class UserType(str, enum.Enum):
     client = "client"
     driver = "driver"
     admin = "admin"
 
-class OrderStatus(enum.Enum):
+class OrderStatus(str, enum.Enum):
     submitted = "submitted"
     processing = "processing"
     in_warehouse = "in_warehouse"
@@ -29,7 +33,7 @@ class User(Base):
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
     # Relationships
-    orders = relationship("Order", back_populates="client")
+    orders = relationship("Order", foreign_keys="Order.client_id", back_populates="client")
     assigned_orders = relationship("Order", foreign_keys="Order.assigned_driver_id", back_populates="driver")
 
 class Order(Base):
@@ -40,7 +44,12 @@ class Order(Base):
     assigned_driver_id = Column(Integer, ForeignKey("users.id"), nullable=True)
     pickup_address = Column(Text)
     delivery_address = Column(Text)
-    package_details = Column(Text)  # JSON string
+    # Coordinates of the addresses, when known; dispatch matches drivers to the pickup point
+    pickup_latitude = Column(Float, nullable=True)
+    pickup_longitude = Column(Float, nullable=True)
+    delivery_latitude = Column(Float, nullable=True)
+    delivery_longitude = Column(Float, nullable=True)
+    package_details = Column(JSONB)  # {"weight": kg, "fragile": bool, "dimensions": ..., ...}
     priority = Column(String(20), default="normal")
     status = Column(Enum(OrderStatus), default=OrderStatus.submitted)
     
@@ -50,6 +59,9 @@ class Order(Base):
     ros_reference = Column(String(100), nullable=True)
     
     error_message = Column(Text, nullable=True)
+    processing_latency = Column(JSONB, nullable=True)  # {"cms": ms, "wms": ms, "ros": ms, "total": ms, "mode": ...}
+    # Set while a worker has the order out at CMS/WMS/ROS; see order_processing.claim_orders
+    claimed_at = Column(DateTime, nullable=True)
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
@@ -58,6 +70,98 @@ class Order(Base):
     driver = relationship("User", foreign_keys=[assigned_driver_id], back_populates="assigned_orders")
     packages = relationship("Package", back_populates="order")
     delivery_updates = relationship("DeliveryUpdate", back_populates="order")
+    jobs = relationship("OrderJob", back_populates="order")
+    
+    @hybrid_property
+    def package_weight(self):
+        """Package weight in kg, or None when missing or not a number"""
+        weight = (self.package_details or {}).get("weight")
+        return float(weight) if isinstance(weight, (int, float)) and not isinstance(weight, bool) else None
+    
+    @package_weight.expression
+    def package_weight(cls):
+        weight = cls.package_details["weight"]
+        return case((func.jsonb_typeof(weight) == "number", weight.as_float()), else_=None)
+    
+    @hybrid_property
+    def package_fragile(self):
+        return (self.package_details or {}).get("fragile") is True
+    
+    @package_fragile.expression
+    def package_fragile(cls):
+        # Containment, so the GIN index on package_details answers it
+        return cls.package_details.contains({"fragile": True})
+    
+    __table_args__ = (
+        # Back keyset pagination of GET /orders on (created_at, id) per client and per driver
+        Index("ix_orders_client_id_created_at", "client_id", "created_at", "id"),
+        Index("ix_orders_assigned_driver_id_created_at", "assigned_driver_id", "created_at", "id"),
+        # Dispatch: open orders per driver, and the queue of orders waiting for one
+        Index(
+            "ix_orders_open_assignments", "assigned_driver_id",
+            postgresql_where=and_(assigned_driver_id.isnot(None), status.notin_(["delivered", "failed"]))
+        ),
+        Index(
+            "ix_orders_dispatch_queue", "created_at",
+            postgresql_where=and_(assigned_driver_id.is_(None), pickup_latitude.isnot(None))
+        ),
+        # Containment (@>) filters on package fields
+        Index(
+            "ix_orders_package_details", "package_details",
+            postgresql_using="gin", postgresql_ops={"package_details": "jsonb_path_ops"}
+        ),
+    )
+
+class OrderJob(Base):
+    __tablename__ = "order_jobs"
+    
+    id = Column(String(36), primary_key=True, index=True)
+    order_id = Column(String(36), ForeignKey("orders.id"), index=True)
+    status = Column(String(20), default="pending")  # pending, queued, running, retrying, succeeded, dead
+    attempts = Column(Integer, default=0)
+    last_error = Column(Text, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    finished_at = Column(DateTime, nullable=True)
+    
+    # Relationships
+    order = relationship("Order", back_populates="jobs")
+
+# Events written in the same transaction as the change they announce, relayed to RabbitMQ by outbox_relay.py
+class OutboxEvent(Base):
+    __tablename__ = "outbox_events"
+    
+    id = Column(BigInteger, primary_key=True, autoincrement=True)  # Relay order within an aggregate
+    aggregate_id = Column(String(36), nullable=False, index=True)  # Order id; events of one order stay in order
+    routing_key = Column(String(100), nullable=False)
+    payload = Column(Text, nullable=False)  # JSON message body
+    attempts = Column(Integer, default=0)
+    last_error = Column(Text, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    published_at = Column(DateTime, nullable=True)
+    
+    __table_args__ = (
+        # The relay only ever scans unpublished events
+        Index("ix_outbox_events_unpublished", "id", postgresql_where=published_at.is_(None)),
+    )
+
+# Order counts per status, maintained by order_stats.py in the transaction that changes a status.
+# Each status is spread over several shard rows so concurrent writers rarely wait on one row.
+class OrderStatusCount(Base):
+    __tablename__ = "order_status_counts"
+    
+    status = Column(String(50), primary_key=True)
+    shard = Column(Integer, primary_key=True)
+    total = Column(BigInteger, nullable=False, default=0)
+
+# Orders entering each status per hour, for throughput and delivery-rate time series
+class OrderStatsHourly(Base):
+    __tablename__ = "order_stats_hourly"
+    
+    bucket = Column(DateTime, primary_key=True)  # Start of the hour (UTC)
+    status = Column(String(50), primary_key=True)
+    shard = Column(Integer, primary_key=True)
+    entered = Column(BigInteger, nullable=False, default=0)
 
 class Package(Base):
     __tablename__ = "packages"
@@ -80,10 +184,25 @@ class Route(Base):
     
     id = Column(String(36), primary_key=True, index=True)
     driver_id = Column(Integer, ForeignKey("users.id"))
-    route_data = Column(Text)  # JSON string containing route information
+    route_data = Column(JSONB)  # {"route": [{"sequence", "address", "estimated_time", "order_id"}], "total_distance", ...}
     status = Column(String(50), default="active")
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    @property
+    def stops(self):
+        """Stops in visiting order"""
+        return sorted((self.route_data or {}).get("route", []), key=lambda stop: stop.get("sequence") or 0)
+    
+    @hybrid_property
+    def total_distance(self):
+        distance = (self.route_data or {}).get("total_distance")
+        return float(distance) if isinstance(distance, (int, float)) and not isinstance(distance, bool) else None
+    
+    @total_distance.expression
+    def total_distance(cls):
+        distance = cls.route_data["total_distance"]
+        return case((func.jsonb_typeof(distance) == "number", distance.as_float()), else_=None)
 
 class DeliveryUpdate(Base):
     __tablename__ = "delivery_updates"
@@ -98,4 +217,58 @@ class DeliveryUpdate(Base):
     created_at = Column(DateTime, default=datetime.utcnow)
     
     # Relationships
-    order = relationship("Order", back_populates="delivery_updates")
\ No newline at end of file
+    order = relationship("Order", back_populates="delivery_updates")
+    
+    # Daily analytics rollups read one day of updates at a time
+    __table_args__ = (
+        Index("ix_delivery_updates_created_at", "created_at"),
+    )
+
+# Driver GPS track, written in bulk by tracking.py; one row per driver per timestamp
+class DriverLocation(Base):
+    __tablename__ = "driver_locations"
+    
+    driver_id = Column(Integer, primary_key=True)
+    recorded_at = Column(DateTime, primary_key=True)
+    latitude = Column(Float(precision=24), nullable=False)  # 4-byte real, ~1m resolution
+    longitude = Column(Float(precision=24), nullable=False)
+    accuracy_m = Column(Float(precision=24), nullable=True)
+    speed_mps = Column(Float(precision=24), nullable=True)
+    heading = Column(SmallInteger, nullable=True)  # Degrees from north
+    
+    # Time-range scans and retention deletes; BRIN stays tiny on append-only data
+    __table_args__ = (
+        Index("ix_driver_locations_recorded_at", "recorded_at", postgresql_using="brin"),
+    )
+
+# Per-driver daily delivery summary, rolled up by analytics.py
+class DriverDailyStats(Base):
+    __tablename__ = "driver_daily_stats"
+    
+    day = Column(Date, primary_key=True)
+    driver_id = Column(Integer, primary_key=True)
+    deliveries = Column(Integer, nullable=False, default=0)
+    failures = Column(Integer, nullable=False, default=0)
+    latency_sum_s = Column(Float, nullable=False, default=0)  # Order created to delivered
+    latency_histogram = Column(LargeBinary, nullable=False)  # int32 counts per analytics.LATENCY_EDGES bin
+    rolled_up_at = Column(DateTime, default=datetime.utcnow)
+    
+    # One driver's days, for per-driver histograms and GET /admin/analytics?driver_id=
+    __table_args__ = (
+        Index("ix_driver_daily_stats_driver_id_day", "driver_id", "day"),
+        # Covers the driver ranking so it reads the index instead of the histogram rows
+        Index(
+            "ix_driver_daily_stats_day_totals", "day",
+            postgresql_include=["driver_id", "deliveries", "failures", "latency_sum_s"]
+        ),
+    )
+
+# Geocoded addresses, keyed by geocoding.normalize_address(); see geocoding.py
+class GeocodeCache(Base):
+    __tablename__ = "geocode_cache"
+    
+    address = Column(Text, primary_key=True)
+    latitude = Column(Float, nullable=True)  # NULL when the backend found nothing
+    longitude = Column(Float, nullable=True)
+    provider = Column(String(50))
+    created_at = Column(DateTime, default=datetime.utcnow)
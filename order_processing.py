@@ -0,0 +1,343 @@
+# order_processing.py - Order integration with CMS, WMS and ROS
+import asyncio
+import os
+import time
+from datetime import datetime, timedelta
+from typing import List, Dict, Any, Optional, Tuple
+
+from sqlalchemy import or_, select, update
+
+from database import AsyncSessionLocal
+from geocoding import geocode_orders
+from models import Order
+from order_stats import record_status_changes
+from outbox import add_outbox_event
+from response_cache import response_cache, order_cache_key
+from services import cms_service, ros_service, wms_service
+
+ORDER_PROCESSING_MODE = os.getenv("ORDER_PROCESSING_MODE", "fanout")  # "fanout" or "sequential"
+ORDER_BATCH_UPSTREAM_SIZE = int(os.getenv("ORDER_BATCH_UPSTREAM_SIZE", "100"))  # orders per batched upstream call
+UPSTREAM_TIMEOUTS = {
+    "cms": float(os.getenv("CMS_TIMEOUT", "10")),
+    "wms": float(os.getenv("WMS_TIMEOUT", "10")),
+    "ros": float(os.getenv("ROS_TIMEOUT", "10"))
+}
+# How long a claim keeps other workers off an order; well above the upstream timeouts
+ORDER_CLAIM_TIMEOUT = timedelta(seconds=float(os.getenv("ORDER_CLAIM_TIMEOUT", "300")))
+
+class OrderProcessingError(Exception):
+    """An upstream system rejected or did not answer; the order can be retried"""
+
+async def run_upstream_call(system: str, call) -> Dict[str, Any]:
+    """Await one upstream call under its timeout, recording result, error and latency"""
+    started = time.perf_counter()
+    result, error, timed_out = None, None, False
+    try:
+        result = await asyncio.wait_for(call, UPSTREAM_TIMEOUTS[system])
+    except asyncio.TimeoutError:
+        error = f"{system.upper()} timed out after {UPSTREAM_TIMEOUTS[system]}s"
+        timed_out = True
+    except Exception as e:
+        error = f"{system.upper()} failed: {e}"
+    return {
+        "system": system,
+        "result": result,
+        "error": error,
+        "timed_out": timed_out,
+        "latency_ms": round((time.perf_counter() - started) * 1000, 1)
+    }
+
+async def fill_coordinates(orders: List[Order]):
+    """Geocode orders without coordinates; processing goes on without them if geocoding fails"""
+    try:
+        await geocode_orders(orders)
+    except Exception as e:
+        print(f"Geocoding failed: {e!r}")
+
+async def dispatch_order(order: Order) -> List[Dict[str, Any]]:
+    """Submit an order to CMS, WMS and ROS, concurrently in fan-out mode"""
+    calls = {
+        # 1. Submit to CMS (Client Management System)
+        "cms": lambda: cms_service.submit_order({
+            "order_id": order.id,
+            "client_id": order.client_id,
+            "pickup_address": order.pickup_address,
+            "delivery_address": order.delivery_address
+        }),
+        # 2. Add to WMS (Warehouse Management System)
+        "wms": lambda: wms_service.add_package({
+            "order_id": order.id,
+            "package_details": order.package_details
+        }),
+        # 3. Add to ROS (Route Optimization System)
+        "ros": lambda: ros_service.add_delivery_point({
+            "order_id": order.id,
+            "delivery_address": order.delivery_address,
+            "latitude": order.delivery_latitude,
+            "longitude": order.delivery_longitude,
+            "priority": order.priority
+        })
+    }
+    return await run_legs(calls)
+
+async def dispatch_order_batch(orders: List[Order]) -> List[Dict[str, Any]]:
+    """Submit many orders with one batched call per upstream system
+
+    Each leg's result maps order id to that order's upstream response.
+    """
+    calls = {
+        "cms": lambda: cms_service.submit_orders([{
+            "order_id": order.id,
+            "client_id": order.client_id,
+            "pickup_address": order.pickup_address,
+            "delivery_address": order.delivery_address
+        } for order in orders]),
+        "wms": lambda: wms_service.add_packages([{
+            "order_id": order.id,
+            "package_details": order.package_details
+        } for order in orders]),
+        "ros": lambda: ros_service.add_delivery_points([{
+            "order_id": order.id,
+            "delivery_address": order.delivery_address,
+            "latitude": order.delivery_latitude,
+            "longitude": order.delivery_longitude,
+            "priority": order.priority
+        } for order in orders])
+    }
+    return await run_legs(calls)
+
+async def run_legs(calls: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Run the upstream calls concurrently in fan-out mode, otherwise stop at the first failure"""
+    if ORDER_PROCESSING_MODE == "fanout":
+        return list(await asyncio.gather(
+            *(run_upstream_call(system, call()) for system, call in calls.items())
+        ))
+
+    legs = []
+    for system, call in calls.items():
+        leg = await run_upstream_call(system, call())
+        legs.append(leg)
+        if leg["error"]:
+            break
+    return legs
+
+async def compensate_order(order_id: str, legs: List[Dict[str, Any]]):
+    """Undo the upstream legs that succeeded or timed out when another leg failed
+
+    A leg that timed out may still have been applied upstream. It has no
+    response, so it is undone by the reference the system assigns when it
+    returns none (see services.py); a leg that was rejected is left alone.
+    """
+    undo = []
+    for leg in legs:
+        if leg["error"] and not leg.get("timed_out"):
+            continue
+        result = leg["result"] or {}
+        if leg["system"] == "cms":
+            undo.append(cms_service.cancel_order(result.get("reference_id") or f"CMS_{order_id}"))
+        elif leg["system"] == "wms":
+            undo.append(wms_service.remove_package(order_id))
+        elif leg["system"] == "ros":
+            undo.append(ros_service.remove_delivery_point(result.get("route_point_id") or f"ROS_{order_id}"))
+
+    for outcome in await asyncio.gather(*undo, return_exceptions=True):
+        if isinstance(outcome, Exception):
+            print(f"Compensation failed for order {order_id}: {outcome}")
+
+async def settle_legs(order_id: str, legs: List[Dict[str, Any]]) -> Optional[str]:
+    """Compensate the order's legs if any of them failed; returns the combined error"""
+    errors = [leg["error"] for leg in legs if leg["error"]]
+    if not errors:
+        return None
+    await compensate_order(order_id, legs)
+    return "; ".join(errors)
+
+def record_legs(order: Order, legs: List[Dict[str, Any]], latency_ms: float, error: Optional[str]):
+    """Record upstream outcomes on the order and release its claim"""
+    latency = {leg["system"]: leg["latency_ms"] for leg in legs}
+    latency["total"] = latency_ms
+    latency["mode"] = ORDER_PROCESSING_MODE
+    order.processing_latency = latency
+    order.claimed_at = None
+
+    if error:
+        order.error_message = error
+        return
+
+    responses = {leg["system"]: leg["result"] for leg in legs}
+
+    # Update order status
+    order.status = "processing"
+    order.error_message = None
+    order.cms_reference = responses["cms"].get("reference_id")
+    order.wms_reference = responses["wms"].get("package_id")
+    order.ros_reference = responses["ros"].get("route_point_id")
+
+async def claim_orders(db, order_ids: List[str], claimed_at: datetime) -> Tuple[List[Order], List[str]]:
+    """Take submitted orders for this worker and commit
+
+    The upstream calls then run with no row lock or open transaction; the
+    claim alone keeps other workers off the orders until it is released or
+    ORDER_CLAIM_TIMEOUT passes. Returns the claimed orders and the ids of
+    orders another worker holds.
+    """
+    await db.execute(
+        update(Order)
+        .where(
+            Order.id.in_(order_ids),
+            Order.status == "submitted",
+            or_(Order.claimed_at.is_(None), Order.claimed_at < claimed_at - ORDER_CLAIM_TIMEOUT)
+        )
+        # Keep updated_at: a claim changes nothing clients can see
+        .values(claimed_at=claimed_at, updated_at=Order.updated_at)
+        .execution_options(synchronize_session=False)
+    )
+    result = await db.execute(select(Order).where(Order.id.in_(order_ids)))
+    orders = result.scalars().all()
+    await db.commit()
+    claimed = [order for order in orders if order.claimed_at == claimed_at]
+    busy = [order.id for order in orders if order.status == "submitted" and order.claimed_at != claimed_at]
+    return claimed, busy
+
+async def lock_claimed(db, orders: List[Order], claimed_at: datetime) -> List[Order]:
+    """Lock the orders whose claim is still ours for writing results; the rest are dropped from the session"""
+    result = await db.execute(
+        select(Order.id)
+        .where(Order.id.in_([order.id for order in orders]), Order.claimed_at == claimed_at)
+        .with_for_update()
+    )
+    held = set(result.scalars())
+    for order in orders:
+        if order.id not in held:
+            # Another worker took over after the claim timed out; its results win
+            print(f"Claim on order {order.id} expired during processing")
+            db.expunge(order)
+    return [order for order in orders if order.id in held]
+
+async def release_claims(order_ids: List[str], claimed_at: datetime):
+    """Give up claims after an unexpected error so a retry can take the orders at once"""
+    async with AsyncSessionLocal() as db:
+        await db.execute(
+            update(Order)
+            .where(Order.id.in_(order_ids), Order.claimed_at == claimed_at)
+            .values(claimed_at=None, updated_at=Order.updated_at)
+            .execution_options(synchronize_session=False)
+        )
+        await db.commit()
+
+async def process_order(order_id: str):
+    """Process order through CMS, WMS, and ROS systems
+
+    Raises OrderProcessingError when an upstream leg fails or another worker
+    holds the order, so the caller can retry; the order keeps its status
+    until fail_order gives up on it.
+    """
+    claimed_at = datetime.utcnow()
+    async with AsyncSessionLocal() as db:
+        orders, busy = await claim_orders(db, [order_id], claimed_at)
+        if busy:
+            raise OrderProcessingError(f"Order {order_id} is being processed by another worker")
+        if not orders:
+            # Unknown order, or a redelivered job for an order that already went through
+            return
+        order = orders[0]
+
+        try:
+            await fill_coordinates(orders)
+            started = time.perf_counter()
+            legs = await dispatch_order(order)
+            latency_ms = round((time.perf_counter() - started) * 1000, 1)
+            error = await settle_legs(order_id, legs)
+        except Exception:
+            await release_claims([order_id], claimed_at)
+            raise
+
+        if not await lock_claimed(db, orders, claimed_at):
+            raise OrderProcessingError(f"Claim on order {order_id} expired during processing")
+        record_legs(order, legs, latency_ms, error)
+        if not error:
+            await record_status_changes(db, [("submitted", order.status)])
+            # Announce the order in the same transaction as its new status
+            add_outbox_event(db, "order.processed", order_id, {
+                "order_id": order_id,
+                "status": "processing"
+            })
+        await db.commit()
+    await response_cache.invalidate(order_cache_key(order_id))
+
+    if error:
+        raise OrderProcessingError(error)
+
+async def process_order_batch(order_ids: List[str]) -> Dict[str, Optional[str]]:
+    """Process many orders with batched upstream calls
+
+    Returns the error for each order id, or None for orders that went through
+    (or had already been processed). Results are written one chunk at a
+    time, each in its own short transaction.
+    """
+    outcomes: Dict[str, Optional[str]] = {order_id: None for order_id in order_ids}
+    claimed_at = datetime.utcnow()
+    async with AsyncSessionLocal() as db:
+        orders, busy = await claim_orders(db, order_ids, claimed_at)
+        for order_id in busy:
+            outcomes[order_id] = "Order is being processed by another worker"
+        await fill_coordinates(orders)
+
+        for offset in range(0, len(orders), ORDER_BATCH_UPSTREAM_SIZE):
+            chunk = orders[offset:offset + ORDER_BATCH_UPSTREAM_SIZE]
+            try:
+                started = time.perf_counter()
+                legs = await dispatch_order_batch(chunk)
+                latency_ms = round((time.perf_counter() - started) * 1000, 1)
+
+                results = {}
+                for order in chunk:
+                    order_legs = []
+                    for leg in legs:
+                        order_result = (leg["result"] or {}).get(order.id)
+                        error = leg["error"]
+                        if error is None and order_result is None:
+                            error = f"{leg['system'].upper()} returned no result for the order"
+                        order_legs.append({**leg, "result": order_result, "error": error})
+                    results[order.id] = (order_legs, await settle_legs(order.id, order_legs))
+            except Exception:
+                await release_claims([order.id for order in orders[offset:]], claimed_at)
+                raise
+
+            held = await lock_claimed(db, chunk, claimed_at)
+            for order in chunk:
+                outcomes[order.id] = "Claim on the order expired during processing"
+            processed = 0
+            for order in held:
+                order_legs, error = results[order.id]
+                record_legs(order, order_legs, latency_ms, error)
+                outcomes[order.id] = error
+                if error is None:
+                    processed += 1
+                    add_outbox_event(db, "order.processed", order.id, {
+                        "order_id": order.id,
+                        "status": "processing"
+                    })
+            await record_status_changes(db, [("submitted", "processing")] * processed)
+            await db.commit()
+
+    await response_cache.invalidate(*(order_cache_key(order.id) for order in orders))
+    return outcomes
+
+async def fail_order(order_id: str, error: str):
+    """Mark an order as failed once processing has been given up"""
+    async with AsyncSessionLocal() as db:
+        result = await db.execute(select(Order).where(Order.id == order_id).with_for_update())
+        order = result.scalars().first()
+        if not order:
+            return
+        await record_status_changes(db, [(order.status, "failed")])
+        order.status = "failed"
+        order.error_message = error
+        # Failure notification, committed with the status
+        add_outbox_event(db, "order.failed", order_id, {
+            "order_id": order_id,
+            "error": error
+        })
+        await db.commit()
+    await response_cache.invalidate(order_cache_key(order_id))
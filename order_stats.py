@@ -0,0 +1,236 @@
+# order_stats.py - Order counts per status and per hour, maintained as statuses change
+import argparse
+import asyncio
+import os
+import random
+from collections import Counter
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from dotenv import load_dotenv
+from sqlalchemy import String, cast, delete, func, literal, literal_column, select, text, union_all
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database import AsyncSessionLocal, get_async_engine
+from models import Order, OrderStatsHourly, OrderStatusCount
+
+load_dotenv()
+
+# Rows per status that writers spread their increments over
+STATS_COUNTER_SHARDS = int(os.getenv("STATS_COUNTER_SHARDS", "8"))
+# "counters" reads the maintained tables, "live" counts the orders table with one GROUP BY
+ORDER_STATS_SOURCE = os.getenv("ORDER_STATS_SOURCE", "counters")
+# Counter row present once the tables have been seeded from the orders table
+INITIALIZED_MARKER = "*"
+
+StatusChange = Tuple[Optional[str], str]
+
+def truncate(granularity: str, column):
+    """date_trunc with the unit inlined, so GROUP BY matches the selected expression"""
+    if granularity not in ("hour", "day"):
+        raise ValueError(f"Unknown granularity: {granularity}")
+    return func.date_trunc(literal_column(f"'{granularity}'"), column)
+
+def status_value(status) -> Optional[str]:
+    """Plain string for an OrderStatus member or string"""
+    return getattr(status, "value", status)
+
+async def record_status_changes(db: AsyncSession, changes: Iterable[StatusChange], at: Optional[datetime] = None):
+    """Add (old_status, new_status) transitions to the counters in the caller's transaction
+
+    Use None as the old status for a new order. Call before the commit that
+    changes the orders so counts and orders never disagree.
+    """
+    totals: Counter = Counter()
+    entered: Counter = Counter()
+    for old, new in changes:
+        old, new = status_value(old), status_value(new)
+        if old == new:
+            continue
+        if old is not None:
+            totals[old] -= 1
+        totals[new] += 1
+        entered[new] += 1
+    if not entered:
+        return
+
+    shard = random.randrange(STATS_COUNTER_SHARDS)
+    bucket = (at or datetime.utcnow()).replace(minute=0, second=0, microsecond=0)
+    # Rows in a fixed order so concurrent transactions lock them in the same order
+    count_rows = [
+        {"status": status, "shard": shard, "total": delta}
+        for status, delta in sorted(totals.items()) if delta
+    ]
+    hourly_rows = [
+        {"bucket": bucket, "status": status, "shard": shard, "entered": n}
+        for status, n in sorted(entered.items())
+    ]
+
+    if count_rows:
+        statement = insert(OrderStatusCount).values(count_rows)
+        await db.execute(statement.on_conflict_do_update(
+            index_elements=[OrderStatusCount.status, OrderStatusCount.shard],
+            set_={"total": OrderStatusCount.total + statement.excluded.total}
+        ))
+    statement = insert(OrderStatsHourly).values(hourly_rows)
+    await db.execute(statement.on_conflict_do_update(
+        index_elements=[OrderStatsHourly.bucket, OrderStatsHourly.status, OrderStatsHourly.shard],
+        set_={"entered": OrderStatsHourly.entered + statement.excluded.entered}
+    ))
+
+async def stats_initialized(db: AsyncSession) -> bool:
+    marker = await db.scalar(
+        select(OrderStatusCount.total).where(OrderStatusCount.status == INITIALIZED_MARKER)
+    )
+    return marker is not None
+
+async def rebuild_order_stats(db: AsyncSession):
+    """Recompute the counters from the orders table and commit
+
+    Counts per status are exact. Hourly history before the rebuild is
+    approximate: each order counts as submitted in the hour it was created
+    and as entering its current status in the hour it was last updated.
+    """
+    # Blocks writers' counter updates (and other rebuilds) until the commit, so
+    # a transition either is visible to the counts below or is added after them
+    await db.execute(text("LOCK TABLE order_status_counts, order_stats_hourly IN SHARE ROW EXCLUSIVE MODE"))
+    await db.execute(delete(OrderStatusCount))
+    await db.execute(delete(OrderStatsHourly))
+
+    await db.execute(insert(OrderStatusCount).from_select(
+        ["status", "shard", "total"],
+        select(cast(Order.status, String), literal(0), func.count())
+        .where(Order.status.isnot(None))
+        .group_by(Order.status)
+    ))
+    created = (
+        select(
+            truncate("hour", Order.created_at).label("bucket"),
+            literal("submitted").label("status"),
+            literal(0).label("shard"),
+            func.count().label("entered")
+        )
+        .where(Order.created_at.isnot(None))
+        .group_by(truncate("hour", Order.created_at))
+    )
+    current = (
+        select(
+            truncate("hour", Order.updated_at),
+            cast(Order.status, String),
+            literal(0),
+            func.count()
+        )
+        .where(Order.status != "submitted", Order.updated_at.isnot(None))
+        .group_by(truncate("hour", Order.updated_at), Order.status)
+    )
+    await db.execute(insert(OrderStatsHourly).from_select(
+        ["bucket", "status", "shard", "entered"], union_all(created, current)
+    ))
+    db.add(OrderStatusCount(status=INITIALIZED_MARKER, shard=0, total=1))
+    await db.commit()
+
+async def ensure_order_stats():
+    """Seed the counters from the orders table if that has never been done; run at startup"""
+    async with AsyncSessionLocal() as db:
+        if await stats_initialized(db):
+            return
+        await db.execute(text("LOCK TABLE order_status_counts, order_stats_hourly IN SHARE ROW EXCLUSIVE MODE"))
+        # Another process may have finished seeding while we waited for the lock
+        if await stats_initialized(db):
+            await db.rollback()
+            return
+        await rebuild_order_stats(db)
+
+async def live_status_counts(db: AsyncSession) -> Dict[str, int]:
+    """Orders per status with a single GROUP BY over the orders table"""
+    result = await db.execute(select(Order.status, func.count()).group_by(Order.status))
+    return {status_value(status): count for status, count in result.all() if status is not None}
+
+async def get_status_counts(db: AsyncSession) -> Tuple[Dict[str, int], str]:
+    """Orders per status and where they came from ("counters" or "live")"""
+    if ORDER_STATS_SOURCE == "counters":
+        result = await db.execute(
+            select(OrderStatusCount.status, func.sum(OrderStatusCount.total))
+            .group_by(OrderStatusCount.status)
+        )
+        counts = {status: int(total) for status, total in result.all()}
+        if counts.pop(INITIALIZED_MARKER, None) is not None:
+            return {status: total for status, total in counts.items() if total}, "counters"
+    return await live_status_counts(db), "live"
+
+def delivery_rate(delivered: int, total: int) -> float:
+    return (delivered / total * 100) if total > 0 else 0
+
+async def get_stats_timeseries(
+    db: AsyncSession,
+    granularity: str = "hour",
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None
+) -> List[Dict[str, Any]]:
+    """Orders entering each status per hour or day, oldest bucket first
+
+    delivery_rate is the share of orders that reached a final status in the
+    bucket (delivered or failed) which were delivered.
+    """
+    until = until or datetime.utcnow()
+    since = since or until - (timedelta(days=2) if granularity == "hour" else timedelta(days=30))
+    bucket = truncate(granularity, OrderStatsHourly.bucket)
+    result = await db.execute(
+        select(bucket, OrderStatsHourly.status, func.sum(OrderStatsHourly.entered))
+        .where(OrderStatsHourly.bucket >= since, OrderStatsHourly.bucket < until)
+        .group_by(bucket, OrderStatsHourly.status)
+        .order_by(bucket)
+    )
+
+    buckets: Dict[datetime, Dict[str, int]] = {}
+    for start, status, entered in result.all():
+        buckets.setdefault(start, {})[status] = int(entered)
+    series = []
+    for start, entered in buckets.items():
+        delivered = entered.get("delivered", 0)
+        failed = entered.get("failed", 0)
+        series.append({
+            "bucket": start,
+            "created": entered.get("submitted", 0),
+            "processed": entered.get("processing", 0),
+            "delivered": delivered,
+            "failed": failed,
+            "delivery_rate": delivery_rate(delivered, delivered + failed)
+        })
+    return series
+
+async def check_order_stats() -> Dict[str, Tuple[int, int]]:
+    """Statuses whose maintained count differs from the orders table, as (counter, live)"""
+    # One snapshot for both reads
+    async with AsyncSessionLocal(bind=get_async_engine().execution_options(isolation_level="REPEATABLE READ")) as db:
+        counted, source = await get_status_counts(db)
+        live = await live_status_counts(db)
+    if source != "counters":
+        raise RuntimeError("Order stats have not been initialized")
+    return {
+        status: (counted.get(status, 0), live.get(status, 0))
+        for status in set(counted) | set(live)
+        if counted.get(status, 0) != live.get(status, 0)
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Maintain the materialized order statistics")
+    parser.add_argument("command", choices=["check", "rebuild"],
+                        help="check: compare counters with the orders table; rebuild: recompute them")
+    args = parser.parse_args()
+
+    async def main():
+        if args.command == "rebuild":
+            async with AsyncSessionLocal() as db:
+                await rebuild_order_stats(db)
+            print("Order stats rebuilt")
+            return
+        mismatches = await check_order_stats()
+        for status, (counted, live) in sorted(mismatches.items()):
+            print(f"{status}: counters {counted}, orders {live}")
+        if mismatches:
+            raise SystemExit(1)
+        print("Order stats match the orders table")
+
+    asyncio.run(main())
@@ -0,0 +1,31 @@
+# outbox.py - Transactional outbox for events published to RabbitMQ
+import json
+from datetime import datetime
+from typing import Any, Dict
+
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from models import OutboxEvent
+
+def add_outbox_event(db: AsyncSession, routing_key: str, aggregate_id: str, payload: Dict[str, Any]) -> OutboxEvent:
+    """Stage an event in the caller's transaction; it is published only if that transaction commits"""
+    event = OutboxEvent(
+        aggregate_id=aggregate_id,
+        routing_key=routing_key,
+        payload=json.dumps(payload),
+        attempts=0
+    )
+    db.add(event)
+    return event
+
+async def outbox_lag(db: AsyncSession) -> Dict[str, Any]:
+    """Backlog of unpublished events and the age of the oldest one"""
+    result = await db.execute(
+        select(func.count(), func.min(OutboxEvent.created_at)).where(OutboxEvent.published_at.is_(None))
+    )
+    backlog, oldest = result.one()
+    return {
+        "backlog": backlog,
+        "oldest_age_s": (datetime.utcnow() - oldest).total_seconds() if oldest else 0.0
+    }
@@ -0,0 +1,189 @@
+# outbox_relay.py - Relays outbox events to RabbitMQ (run separately from the API: python outbox_relay.py)
+import argparse
+import asyncio
+import json
+import os
+import signal
+import time
+from collections import deque
+from datetime import datetime, timedelta
+from typing import Dict, List, Set, Tuple
+
+from dotenv import load_dotenv
+from sqlalchemy import delete, func, select
+
+from database import AsyncSessionLocal
+from metrics import percentile
+from models import OutboxEvent
+from outbox import outbox_lag
+from services import message_broker
+
+load_dotenv()
+
+# First key of the pg_try_advisory_xact_lock(key, partition) pair that gives one relay a partition
+OUTBOX_LOCK_KEY = 0x6f7574
+
+class OutboxRelay:
+    """Streams unpublished outbox events to RabbitMQ in batches
+
+    Events are split into partitions by a hash of their order id. A relay
+    takes a partition under a transaction-scoped advisory lock, so any
+    number of relay processes can run while each partition, and with it
+    each order, is drained by one of them at a time in id order. An event
+    is marked published in the same transaction only after the broker
+    confirms it, so delivery is at-least-once.
+    """
+
+    def __init__(
+        self,
+        batch_size: int = int(os.getenv("OUTBOX_BATCH_SIZE", "500")),
+        partitions: int = int(os.getenv("OUTBOX_PARTITIONS", "8")),
+        poll_interval: float = float(os.getenv("OUTBOX_POLL_INTERVAL", "0.5")),
+        metrics_interval: float = float(os.getenv("OUTBOX_METRICS_INTERVAL", "60")),
+        retention: timedelta = timedelta(hours=float(os.getenv("OUTBOX_RETENTION_HOURS", "24")))
+    ):
+        self.batch_size = batch_size
+        self.partitions = partitions
+        self.poll_interval = poll_interval
+        self.metrics_interval = metrics_interval
+        self.retention = retention
+        self._stopping = asyncio.Event()
+        self.published = 0
+        self.failed = 0
+        self._lags = deque(maxlen=1024)
+
+    def stop(self):
+        self._stopping.set()
+
+    async def run(self):
+        reporter = asyncio.create_task(self._report_loop())
+        message_broker.publisher.start()
+        last_cleanup = 0.0
+        try:
+            while not self._stopping.is_set():
+                relayed = 0
+                # Leave events untouched while the broker is unreachable
+                if message_broker.publisher.connected:
+                    for partition in range(self.partitions):
+                        relayed += await self._relay_partition(partition)
+                if time.monotonic() - last_cleanup > 3600:
+                    await self._delete_published()
+                    last_cleanup = time.monotonic()
+                if relayed == 0:
+                    try:
+                        await asyncio.wait_for(self._stopping.wait(), self.poll_interval)
+                    except asyncio.TimeoutError:
+                        pass
+        finally:
+            reporter.cancel()
+            await message_broker.close_publisher()
+
+    async def _relay_partition(self, partition: int) -> int:
+        """Publish one batch of a partition; returns how many events were published"""
+        try:
+            async with AsyncSessionLocal() as db:
+                locked = await db.scalar(select(func.pg_try_advisory_xact_lock(OUTBOX_LOCK_KEY, partition)))
+                if not locked:
+                    return 0  # Another relay holds this partition
+                result = await db.execute(
+                    select(OutboxEvent)
+                    .where(
+                        OutboxEvent.published_at.is_(None),
+                        func.abs(func.hashtext(OutboxEvent.aggregate_id)) % self.partitions == partition
+                    )
+                    .order_by(OutboxEvent.id)
+                    .limit(self.batch_size)
+                    .with_for_update(skip_locked=True)
+                )
+                events = result.scalars().all()
+                if not events:
+                    return 0
+
+                published, errors = await self._publish(events)
+                now = datetime.utcnow()
+                for event in events:
+                    if event.id in published:
+                        event.published_at = now
+                        self._lags.append((now - event.created_at).total_seconds())
+                    elif event.id in errors:
+                        event.attempts = (event.attempts or 0) + 1
+                        event.last_error = errors[event.id]
+                await db.commit()
+        except Exception as e:
+            print(f"Outbox relay failed on partition {partition}: {e!r}")
+            return 0
+
+        self.published += len(published)
+        self.failed += len(errors)
+        return len(published)
+
+    async def _publish(self, events: List[OutboxEvent]) -> Tuple[Set[int], Dict[int, str]]:
+        """Publish events, in order within each order and concurrently across orders
+
+        After a failure the rest of that order's events wait for the next
+        round, so they are never delivered ahead of the failed one.
+        """
+        by_aggregate: Dict[str, List[OutboxEvent]] = {}
+        for event in events:
+            by_aggregate.setdefault(event.aggregate_id, []).append(event)
+
+        published: Set[int] = set()
+        errors: Dict[int, str] = {}
+
+        async def publish_in_order(aggregate_events: List[OutboxEvent]):
+            for event in aggregate_events:
+                message = {**json.loads(event.payload), "event_id": event.id}
+                if not await message_broker.publish_message(event.routing_key, message, confirm=True):
+                    errors[event.id] = "broker did not confirm"
+                    return
+                published.add(event.id)
+
+        await asyncio.gather(*(publish_in_order(group) for group in by_aggregate.values()))
+        return published, errors
+
+    async def _delete_published(self):
+        try:
+            async with AsyncSessionLocal() as db:
+                result = await db.execute(
+                    delete(OutboxEvent).where(OutboxEvent.published_at < datetime.utcnow() - self.retention)
+                )
+                await db.commit()
+                if result.rowcount:
+                    print(f"Deleted {result.rowcount} published outbox events")
+        except Exception as e:
+            print(f"Outbox cleanup failed: {e!r}")
+
+    async def stats(self):
+        async with AsyncSessionLocal() as db:
+            lag = await outbox_lag(db)
+        return {
+            **lag,
+            "published": self.published,
+            "failed": self.failed,
+            "publish_lag_p50_s": percentile(self._lags, 0.50),
+            "publish_lag_p99_s": percentile(self._lags, 0.99)
+        }
+
+    async def _report_loop(self):
+        while True:
+            await asyncio.sleep(self.metrics_interval)
+            try:
+                print(f"Outbox relay: {json.dumps(await self.stats())}")
+            except Exception as e:
+                print(f"Outbox stats failed: {e!r}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Relay outbox events to RabbitMQ")
+    parser.add_argument("--batch-size", type=int, default=int(os.getenv("OUTBOX_BATCH_SIZE", "500")))
+    parser.add_argument("--partitions", type=int, default=int(os.getenv("OUTBOX_PARTITIONS", "8")),
+                        help="Must be the same for every relay process")
+    args = parser.parse_args()
+
+    async def main():
+        relay = OutboxRelay(batch_size=args.batch_size, partitions=args.partitions)
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, relay.stop)
+        await relay.run()
+
+    asyncio.run(main())
@@ -0,0 +1,139 @@
+# principal_cache.py - Cache of authenticated principals so auth skips the users table
+import asyncio
+import hashlib
+import os
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Set, Tuple
+
+from pydantic import BaseModel
+
+from redis_client import get_redis
+
+class Principal(BaseModel):
+    """Lightweight authenticated identity, detached from any database session"""
+    id: int
+    email: str
+    username: str
+    user_type: str
+
+    @classmethod
+    def from_user(cls, user) -> "Principal":
+        user_type = getattr(user.user_type, "value", user.user_type)
+        return cls(id=user.id, email=user.email, username=user.username, user_type=user_type)
+
+class PrincipalCache:
+    """In-process TTL/LRU tier keyed by user id and token, backed by an optional Redis tier keyed by user id
+
+    Other workers only see an invalidation through Redis, so the in-process
+    TTL bounds how long they can serve a stale principal.
+    """
+
+    def __init__(
+        self,
+        ttl: float = float(os.getenv("PRINCIPAL_CACHE_TTL", "30")),
+        max_entries: int = int(os.getenv("PRINCIPAL_CACHE_SIZE", "10000")),
+        redis_ttl: int = int(os.getenv("PRINCIPAL_REDIS_TTL", "300"))
+    ):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.redis_ttl = redis_ttl
+        self._entries: "OrderedDict[Tuple[int, str], Tuple[float, Principal]]" = OrderedDict()
+        self._keys_by_user: Dict[int, Set[Tuple[int, str]]] = {}
+        self.hits = 0
+        self.redis_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _key(user_id: int, token: str) -> Tuple[int, str]:
+        # Keep a digest rather than the bearer token itself
+        return user_id, hashlib.sha256(token.encode()).hexdigest()[:32]
+
+    @staticmethod
+    def _redis_key(user_id: int) -> str:
+        return f"principal:{user_id}"
+
+    async def get(self, user_id: int, token: str) -> Optional[Principal]:
+        key = self._key(user_id, token)
+        entry = self._entries.get(key)
+        if entry is not None:
+            expires_at, principal = entry
+            if expires_at > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return principal
+            self._drop(key)
+
+        client = get_redis()
+        if client is not None:
+            try:
+                data = await client.get(self._redis_key(user_id))
+            except Exception as e:
+                print(f"Principal cache Redis error: {e}")
+                data = None
+            if data is not None:
+                principal = Principal.model_validate_json(data)
+                self._store(key, principal)
+                self.redis_hits += 1
+                return principal
+
+        self.misses += 1
+        return None
+
+    async def set(self, user_id: int, token: str, principal: Principal):
+        self._store(self._key(user_id, token), principal)
+        client = get_redis()
+        if client is not None:
+            try:
+                await client.set(self._redis_key(user_id), principal.model_dump_json(), ex=self.redis_ttl)
+            except Exception as e:
+                print(f"Principal cache Redis error: {e}")
+
+    def _store(self, key: Tuple[int, str], principal: Principal):
+        self._entries[key] = (time.monotonic() + self.ttl, principal)
+        self._entries.move_to_end(key)
+        self._keys_by_user.setdefault(key[0], set()).add(key)
+        while len(self._entries) > self.max_entries:
+            self._drop(next(iter(self._entries)))
+
+    def _drop(self, key: Tuple[int, str]):
+        self._entries.pop(key, None)
+        keys = self._keys_by_user.get(key[0])
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._keys_by_user[key[0]]
+
+    def invalidate_local(self, user_id: int):
+        """Forget every cached token of a user in this process"""
+        for key in list(self._keys_by_user.get(user_id, ())):
+            self._drop(key)
+
+    async def invalidate(self, user_id: int):
+        """Forget a user in this process and in Redis"""
+        self.invalidate_local(user_id)
+        client = get_redis()
+        if client is not None:
+            try:
+                await client.delete(self._redis_key(user_id))
+            except Exception as e:
+                print(f"Principal cache Redis error: {e}")
+
+    def schedule_invalidate(self, user_id: int):
+        """Invalidate from synchronous code such as ORM event hooks"""
+        self.invalidate_local(user_id)
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        loop.create_task(self.invalidate(user_id))
+
+    def stats(self):
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "redis_hits": self.redis_hits,
+            "misses": self.misses
+        }
+
+principal_cache = PrincipalCache()
@@ -0,0 +1,61 @@
+# profile_startup.py - Startup time report for the API
+#
+# Lists the slowest imports (python -X importtime), then imports main.py and
+# runs its startup hooks, reporting each phase against STARTUP_BUDGET_MS.
+# Exits non-zero when startup is over budget, so it can gate CI.
+#
+#   python profile_startup.py --top 15
+import argparse
+import asyncio
+import os
+import subprocess
+import sys
+
+def import_profile(module: str):
+    """Self and cumulative import time in ms per module, from a fresh interpreter"""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__))
+    )
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        rows.append((name.strip(), int(self_us) / 1000, int(cumulative_us) / 1000, len(name) - len(name.lstrip())))
+    return rows
+
+def print_import_profile(rows, top: int):
+    top_level = [row for row in rows if row[3] == 1]
+    print(f"Imports: {sum(row[2] for row in top_level):.0f}ms in {len(rows)} modules")
+    print(f"  {'cumulative':>10} {'self':>8}  module")
+    for name, self_ms, cumulative_ms, _ in sorted(rows, key=lambda row: row[2], reverse=True)[:top]:
+        print(f"  {cumulative_ms:8.1f}ms {self_ms:6.1f}ms  {name}")
+    print(f"  Slowest by self time: " + ", ".join(
+        f"{name} {self_ms:.0f}ms" for name, self_ms, _, _ in sorted(rows, key=lambda row: row[1], reverse=True)[:5]
+    ))
+
+async def run_startup():
+    """Import main.py and run its startup hooks; the report's "import" phase times the import"""
+    import main
+    await main.app.router.startup()
+    report = main.startup_profiler.report()
+    await main.app.router.shutdown()
+    return report
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Profile API startup")
+    parser.add_argument("--top", type=int, default=15, help="Slowest imports to list")
+    parser.add_argument("--skip-imports", action="store_true", help="Only run the startup hooks")
+    args = parser.parse_args()
+
+    if not args.skip_imports:
+        print_import_profile(import_profile("main"), args.top)
+
+    report = asyncio.run(run_startup())
+    print(f"Startup: {report['total_ms']:.0f}ms (budget {report['budget_ms']:.0f}ms)")
+    for name, ms in report["phases"].items():
+        print(f"  {name:<20} {ms:8.1f}ms")
+    if not report["within_budget"]:
+        print("Over budget")
+        sys.exit(1)
@@ -0,0 +1,414 @@
+# realtime.py - WebSocket connection management with cross-worker fan-out over Redis
+import asyncio
+import json
+import os
+import time
+import uuid
+from collections import OrderedDict, deque
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional, Set
+
+from fastapi import WebSocket
+
+from metrics import percentile
+from redis_client import get_redis
+
+# Topics a socket may subscribe to, e.g. "order:<order_id>", "driver:<user_id>", "route:<route_id>"
+TOPIC_PREFIXES = ("order:", "driver:", "route:")
+
+class RedisBackplane:
+    """Relays WebSocket messages between API workers through Redis pub/sub
+
+    Each worker subscribes only to the channels of the clients and topics
+    its own sockets use, so a message reaches just the workers holding an
+    interested socket. A message aimed at several channels carries all of
+    them plus an id, so a worker that hears it on more than one channel
+    still delivers it once.
+    """
+
+    CLIENT_CHANNEL_PREFIX = "ws:client:"
+    TOPIC_CHANNEL_PREFIX = "ws:topic:"
+    BROADCAST_CHANNEL = "ws:broadcast"
+
+    def __init__(self, on_message: Callable, dedupe_size: int = 4096):
+        self.node_id = uuid.uuid4().hex
+        self._on_message = on_message
+        self._channels = set()
+        self._seen: "OrderedDict[str, None]" = OrderedDict()
+        self._dedupe_size = dedupe_size
+        self._pubsub = None
+        self._listener = None
+        self.published = 0
+        self.received = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self._pubsub is not None
+
+    def client_channel(self, client_id: str) -> str:
+        return f"{self.CLIENT_CHANNEL_PREFIX}{client_id}"
+
+    def topic_channel(self, topic: str) -> str:
+        return f"{self.TOPIC_CHANNEL_PREFIX}{topic}"
+
+    async def start(self):
+        """Subscribe to the broadcast channel; a no-op when Redis is not configured"""
+        client = get_redis()
+        if client is None or self._listener is not None:
+            return
+        self._channels.add(self.BROADCAST_CHANNEL)
+        try:
+            await self._open(client)
+        except Exception as e:
+            print(f"WebSocket backplane unavailable: {e}")
+            await self._reset()
+        self._listener = asyncio.create_task(self._listen())
+
+    async def _open(self, client):
+        self._pubsub = client.pubsub(ignore_subscribe_messages=True)
+        await self._pubsub.subscribe(*self._channels)
+
+    async def _reset(self):
+        """Drop a failed PubSub so the listener reconnects from scratch"""
+        if self._pubsub is not None:
+            try:
+                await self._pubsub.close()
+            except Exception:
+                pass
+            self._pubsub = None
+
+    async def close(self):
+        if self._listener is not None:
+            self._listener.cancel()
+            try:
+                await self._listener
+            except asyncio.CancelledError:
+                pass
+            self._listener = None
+        if self._pubsub is not None:
+            await self._pubsub.close()
+            self._pubsub = None
+
+    async def subscribe(self, channel: str):
+        self._channels.add(channel)
+        if self._pubsub is not None:
+            try:
+                await self._pubsub.subscribe(channel)
+            except Exception as e:
+                print(f"WebSocket backplane subscribe failed: {e}")
+
+    async def unsubscribe(self, channel: str):
+        self._channels.discard(channel)
+        if self._pubsub is not None:
+            try:
+                await self._pubsub.unsubscribe(channel)
+            except Exception as e:
+                print(f"WebSocket backplane unsubscribe failed: {e}")
+
+    async def publish(self, channels: List[str], text: str) -> bool:
+        """Publish a serialized message to the other workers; returns False when the backplane is down"""
+        client = get_redis()
+        if client is None or self._listener is None or not channels:
+            return False
+        envelope = json.dumps({
+            "origin": self.node_id,
+            "id": uuid.uuid4().hex,
+            "channels": channels,
+            "payload": text
+        })
+        try:
+            async with client.pipeline(transaction=False) as pipe:
+                for channel in channels:
+                    pipe.publish(channel, envelope)
+                await pipe.execute()
+            self.published += 1
+            return True
+        except Exception as e:
+            print(f"WebSocket backplane publish failed: {e}")
+            return False
+
+    def _first_sighting(self, message_id: str) -> bool:
+        if message_id in self._seen:
+            return False
+        self._seen[message_id] = None
+        if len(self._seen) > self._dedupe_size:
+            self._seen.popitem(last=False)
+        return True
+
+    async def _listen(self):
+        """Deliver relayed messages, resubscribing after Redis connection loss"""
+        while True:
+            try:
+                if self._pubsub is None:
+                    await self._open(get_redis())
+                async for item in self._pubsub.listen():
+                    if item.get("type") != "message":
+                        continue
+                    envelope = json.loads(item["data"])
+                    if envelope.get("origin") == self.node_id:
+                        continue  # Already delivered locally
+                    if not self._first_sighting(envelope["id"]):
+                        continue  # Heard on another of its channels
+                    self.received += 1
+                    await self._on_message(envelope["channels"], envelope["payload"])
+                # listen() returns without raising once the PubSub has no subscriptions left
+                print("WebSocket backplane subscription ended")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"WebSocket backplane connection lost: {e}")
+            await self._reset()
+            await asyncio.sleep(1)
+
+    def stats(self):
+        return {
+            "enabled": self.enabled,
+            "node_id": self.node_id,
+            "channels": len(self._channels),
+            "published": self.published,
+            "received": self.received
+        }
+
+class ClientConnection:
+    """A WebSocket with a bounded outbound queue drained by its own writer task
+
+    Senders only enqueue, so a slow socket never blocks delivery to others.
+    When the queue is full the manager's slow-consumer policy either drops
+    the oldest queued message or disconnects the socket.
+    """
+
+    def __init__(self, manager: "ConnectionManager", websocket: WebSocket, client_id: str):
+        self.manager = manager
+        self.websocket = websocket
+        self.client_id = client_id
+        self.topics: Set[str] = set()
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=manager.queue_size)
+        self.closed = False
+        self.closing = False
+        self.writer = asyncio.create_task(self._write_loop())
+
+    def enqueue(self, text: str) -> bool:
+        """Queue an already serialized message without waiting on the socket"""
+        if self.closed or self.closing:
+            return False
+        if self.queue.full():
+            if self.manager.slow_consumer_policy == "disconnect":
+                self.closing = True
+                self.manager.slow_disconnects += 1
+                asyncio.create_task(self.close(code=1013))
+                return False
+            self.queue.get_nowait()
+            self.manager.dropped += 1
+        self.queue.put_nowait((time.monotonic(), text))
+        return True
+
+    def send(self, message: dict) -> bool:
+        return self.enqueue(json.dumps(message))
+
+    async def _write_loop(self):
+        while True:
+            enqueued_at, text = await self.queue.get()
+            started = time.monotonic()
+            try:
+                await asyncio.wait_for(self.websocket.send_text(text), self.manager.send_timeout)
+            except Exception as e:
+                self.manager.send_failures += 1
+                print(f"WebSocket send to {self.client_id} failed: {e!r}")
+                await self.close(code=1011)
+                return
+            self.manager.record_send(started - enqueued_at, time.monotonic() - started)
+
+    async def close(self, code: int = 1000):
+        """Stop the writer, close the socket and unregister; safe to call more than once"""
+        if self.closed:
+            return
+        self.closed = True
+        if self.writer is not asyncio.current_task():
+            self.writer.cancel()
+        try:
+            await self.websocket.close(code=code)
+        except Exception:
+            pass  # Already closed by the peer
+        await self.manager.remove(self)
+
+# WebSocket connection manager for real-time updates
+class ConnectionManager:
+    """Registry of sockets by client and by topic
+
+    A client may hold any number of sockets (tabs, devices). Sockets can
+    also subscribe to topics, and the topic index lets a publisher reach
+    exactly the interested sockets without scanning every connection.
+    """
+
+    def __init__(
+        self,
+        queue_size: int = int(os.getenv("WS_OUTBOUND_QUEUE_SIZE", "256")),
+        send_timeout: float = float(os.getenv("WS_SEND_TIMEOUT", "5")),
+        slow_consumer_policy: str = os.getenv("WS_SLOW_CONSUMER_POLICY", "drop"),
+        max_subscriptions: int = int(os.getenv("WS_MAX_SUBSCRIPTIONS", "100"))
+    ):
+        if slow_consumer_policy not in ("drop", "disconnect"):
+            raise ValueError(f"Unknown slow consumer policy: {slow_consumer_policy}")
+        self.queue_size = queue_size
+        self.send_timeout = send_timeout
+        self.slow_consumer_policy = slow_consumer_policy
+        self.max_subscriptions = max_subscriptions
+        self.active_connections: Dict[str, Set[ClientConnection]] = {}
+        self.topics: Dict[str, Set[ClientConnection]] = {}
+        self.backplane = RedisBackplane(self.deliver_local)
+        self.sent = 0
+        self.dropped = 0
+        self.slow_disconnects = 0
+        self.send_failures = 0
+        self._queue_delays = deque(maxlen=1024)
+        self._send_latencies = deque(maxlen=1024)
+
+    async def start(self):
+        await self.backplane.start()
+
+    async def close(self):
+        for connections in list(self.active_connections.values()):
+            for connection in list(connections):
+                await connection.close(code=1001)
+        await self.backplane.close()
+
+    async def connect(self, websocket: WebSocket, client_id: str) -> ClientConnection:
+        await websocket.accept()
+        connection = ClientConnection(self, websocket, client_id)
+        connections = self.active_connections.setdefault(client_id, set())
+        connections.add(connection)
+        if len(connections) == 1:
+            await self.backplane.subscribe(self.backplane.client_channel(client_id))
+        return connection
+
+    async def disconnect(self, connection: ClientConnection):
+        await connection.close()
+
+    async def remove(self, connection: ClientConnection):
+        """Unregister a closed connection from the client and topic indexes"""
+        for topic in list(connection.topics):
+            await self.unsubscribe(connection, topic)
+        connections = self.active_connections.get(connection.client_id)
+        if connections is not None and connection in connections:
+            connections.discard(connection)
+            if not connections:
+                del self.active_connections[connection.client_id]
+                await self.backplane.unsubscribe(self.backplane.client_channel(connection.client_id))
+
+    async def subscribe(self, connection: ClientConnection, topic: str):
+        if not topic.startswith(TOPIC_PREFIXES) or len(topic) > 128:
+            raise ValueError(f"Unknown topic: {topic}")
+        if topic in connection.topics:
+            return
+        if len(connection.topics) >= self.max_subscriptions:
+            raise ValueError("Too many subscriptions")
+        connection.topics.add(topic)
+        subscribers = self.topics.setdefault(topic, set())
+        subscribers.add(connection)
+        if len(subscribers) == 1:
+            await self.backplane.subscribe(self.backplane.topic_channel(topic))
+
+    async def unsubscribe(self, connection: ClientConnection, topic: str):
+        connection.topics.discard(topic)
+        subscribers = self.topics.get(topic)
+        if subscribers is not None and connection in subscribers:
+            subscribers.discard(connection)
+            if not subscribers:
+                del self.topics[topic]
+                await self.backplane.unsubscribe(self.backplane.topic_channel(topic))
+
+    async def handle_client_message(
+        self,
+        connection: ClientConnection,
+        data: str,
+        authorize: Optional[Callable[[str], Awaitable[bool]]] = None
+    ):
+        """Apply subscribe/unsubscribe requests; anything else is echoed back
+
+        authorize decides whether the socket may follow a topic; sockets
+        without one (unauthenticated) cannot subscribe.
+        """
+        try:
+            request = json.loads(data)
+        except ValueError:
+            request = None
+        if not isinstance(request, dict) or request.get("action") not in ("subscribe", "unsubscribe"):
+            connection.send({"echo": data})
+            return
+
+        topic = str(request.get("topic", ""))
+        try:
+            if request["action"] == "subscribe":
+                if authorize is None or not await authorize(topic):
+                    raise ValueError("Access denied")
+                await self.subscribe(connection, topic)
+                connection.send({"subscribed": topic})
+            else:
+                await self.unsubscribe(connection, topic)
+                connection.send({"unsubscribed": topic})
+        except ValueError as e:
+            connection.send({"error": str(e), "topic": topic})
+
+    async def send_message(self, client_id: str, message: dict):
+        """Deliver to every socket of the client wherever it is connected"""
+        await self.deliver(message, client_ids=[client_id])
+
+    async def publish(self, topic: str, message: dict):
+        """Deliver to every socket subscribed to the topic"""
+        await self.deliver(message, topics=[topic])
+
+    async def deliver(self, message: dict, client_ids: Iterable[str] = (), topics: Iterable[str] = ()):
+        """Deliver once to each socket that belongs to any of the clients or follows any of the topics"""
+        channels = [self.backplane.client_channel(str(client_id)) for client_id in client_ids]
+        channels += [self.backplane.topic_channel(topic) for topic in topics]
+        # Serialize once for every local socket and the other workers
+        text = json.dumps(message)
+        await self.deliver_local(channels, text)
+        await self.backplane.publish(channels, text)
+
+    async def deliver_local(self, channels: List[str], text: str):
+        targets: Set[ClientConnection] = set()
+        for channel in channels:
+            if channel == RedisBackplane.BROADCAST_CHANNEL:
+                for connections in self.active_connections.values():
+                    targets.update(connections)
+            elif channel.startswith(RedisBackplane.CLIENT_CHANNEL_PREFIX):
+                targets.update(self.active_connections.get(channel[len(RedisBackplane.CLIENT_CHANNEL_PREFIX):], ()))
+            elif channel.startswith(RedisBackplane.TOPIC_CHANNEL_PREFIX):
+                targets.update(self.topics.get(channel[len(RedisBackplane.TOPIC_CHANNEL_PREFIX):], ()))
+        for connection in targets:
+            connection.enqueue(text)
+
+    async def broadcast(self, message: dict):
+        text = json.dumps(message)
+        await self.deliver_local([RedisBackplane.BROADCAST_CHANNEL], text)
+        await self.backplane.publish([RedisBackplane.BROADCAST_CHANNEL], text)
+
+    def record_send(self, queue_delay: float, send_latency: float):
+        self.sent += 1
+        self._queue_delays.append(queue_delay)
+        self._send_latencies.append(send_latency)
+
+    def stats(self):
+        depths = [
+            connection.queue.qsize()
+            for connections in self.active_connections.values()
+            for connection in connections
+        ]
+        return {
+            "clients": len(self.active_connections),
+            "connections": len(depths),
+            "topics": len(self.topics),
+            "subscriptions": sum(len(subscribers) for subscribers in self.topics.values()),
+            "queued": sum(depths),
+            "max_queue_depth": max(depths, default=0),
+            "queue_size": self.queue_size,
+            "slow_consumer_policy": self.slow_consumer_policy,
+            "sent": self.sent,
+            "dropped": self.dropped,
+            "slow_disconnects": self.slow_disconnects,
+            "send_failures": self.send_failures,
+            "queue_delay_p99_ms": percentile(self._queue_delays, 0.99) * 1000,
+            "send_latency_p50_ms": percentile(self._send_latencies, 0.50) * 1000,
+            "send_latency_p99_ms": percentile(self._send_latencies, 0.99) * 1000,
+            "backplane": self.backplane.stats()
+        }
@@ -0,0 +1,34 @@
+# redis_client.py - Shared asyncio Redis connection
+import os
+from typing import Optional
+
+import redis.asyncio as redis
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# e.g. redis://localhost:6379/0 (see docker-compose.yml); Redis-backed tiers are disabled when unset
+REDIS_URL = os.getenv("REDIS_URL")
+
+_client: Optional[redis.Redis] = None
+
+def get_redis() -> Optional[redis.Redis]:
+    """Return the shared Redis client, or None when Redis is not configured"""
+    global _client
+    if not REDIS_URL:
+        return None
+    if _client is None:
+        _client = redis.Redis.from_url(
+            REDIS_URL,
+            socket_timeout=float(os.getenv("REDIS_SOCKET_TIMEOUT", "0.5")),
+            socket_connect_timeout=float(os.getenv("REDIS_SOCKET_TIMEOUT", "0.5")),
+            health_check_interval=30
+        )
+    return _client
+
+async def close_redis():
+    """Close the shared Redis connection pool"""
+    global _client
+    if _client is not None:
+        await _client.close()
+        _client = None
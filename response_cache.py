@@ -0,0 +1,203 @@
+# response_cache.py - Read-through cache of serialized API responses with ETags
+import asyncio
+import hashlib
+import json
+import os
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+
+from fastapi import Request, Response
+
+from redis_client import get_redis
+
+class CachedResponse:
+    """A serialized response body, its ETag and the user allowed to read it"""
+
+    __slots__ = ("body", "etag", "owner_id")
+
+    def __init__(self, body: str, owner_id: Optional[int], etag: Optional[str] = None):
+        self.body = body
+        self.owner_id = owner_id
+        self.etag = etag or '"{}"'.format(hashlib.sha1(body.encode()).hexdigest()[:20])
+
+    def dumps(self) -> str:
+        return json.dumps({"body": self.body, "owner_id": self.owner_id, "etag": self.etag})
+
+    @classmethod
+    def loads(cls, data) -> "CachedResponse":
+        fields = json.loads(data)
+        return cls(fields["body"], fields["owner_id"], fields["etag"])
+
+def order_cache_key(order_id: str) -> str:
+    return f"response:order:{order_id}"
+
+def driver_routes_cache_key(driver_id: int) -> str:
+    return f"response:routes:{driver_id}"
+
+# Store a loaded body only if the key's version is still the one read before the load
+SET_IF_VERSION = """
+if (redis.call('GET', KEYS[2]) or '0') == ARGV[1] then
+    redis.call('SET', KEYS[1], ARGV[2], 'EX', ARGV[3])
+    return 1
+end
+return 0
+"""
+
+class ResponseCache:
+    """In-process TTL/LRU tier in front of a shared Redis tier
+
+    Writers invalidate both tiers, but other workers only see the Redis
+    delete, so the short in-process TTL bounds how long they can serve a
+    stale body. Concurrent misses on a key share one load.
+
+    Each key has a version in Redis that invalidation increments. A worker
+    reads the version with the cached body and only stores what it loads if
+    the version is unchanged, so a body read before another worker's write
+    is never put back into Redis after that write's invalidation.
+    """
+
+    def __init__(
+        self,
+        ttl: float = float(os.getenv("RESPONSE_CACHE_LOCAL_TTL", "2")),
+        max_entries: int = int(os.getenv("RESPONSE_CACHE_SIZE", "10000")),
+        redis_ttl: int = int(os.getenv("RESPONSE_CACHE_REDIS_TTL", "300"))
+    ):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.redis_ttl = redis_ttl
+        self._entries: "OrderedDict[str, Tuple[float, CachedResponse]]" = OrderedDict()
+        self._loading: Dict[str, asyncio.Future] = {}
+        self._invalidated_at: Dict[str, float] = {}
+        self.hits = 0
+        self.redis_hits = 0
+        self.misses = 0
+        self.not_modified = 0
+        self.invalidations = 0
+
+    async def get_or_load(
+        self,
+        key: str,
+        load: Callable[[], Awaitable[Optional[Tuple[str, Optional[int]]]]]
+    ) -> Optional[CachedResponse]:
+        """Return the cached response, calling load() for (body, owner_id) on a miss; None if not found"""
+        entry, version = await self._get(key)
+        if entry is not None:
+            return entry
+
+        pending = self._loading.get(key)
+        if pending is not None:
+            return await asyncio.shield(pending)
+
+        future = asyncio.get_running_loop().create_future()
+        self._loading[key] = future
+        started = time.monotonic()
+        try:
+            self.misses += 1
+            loaded = await load()
+            entry = CachedResponse(*loaded) if loaded is not None else None
+            # Don't cache a body read before a concurrent invalidation
+            if entry is not None and self._invalidated_at.get(key, 0) < started:
+                await self._set(key, entry, version)
+            future.set_result(entry)
+            return entry
+        except BaseException as e:
+            future.set_exception(e)
+            future.exception()  # Waiters re-raise it; don't warn when there are none
+            raise
+        finally:
+            del self._loading[key]
+
+    @staticmethod
+    def _version_key(key: str) -> str:
+        return f"{key}:version"
+
+    async def _get(self, key: str) -> Tuple[Optional[CachedResponse], Optional[str]]:
+        """The cached entry, or None and the Redis version a load must be stored against"""
+        cached = self._entries.get(key)
+        if cached is not None:
+            expires_at, entry = cached
+            if expires_at > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry, None
+            del self._entries[key]
+
+        client = get_redis()
+        if client is None:
+            return None, None
+        try:
+            data, version = await client.mget(key, self._version_key(key))
+        except Exception as e:
+            print(f"Response cache Redis error: {e}")
+            return None, None  # Without a version the load is not written to Redis
+        if data is not None:
+            entry = CachedResponse.loads(data)
+            self._store(key, entry)
+            self.redis_hits += 1
+            return entry, None
+        return None, version.decode() if version is not None else "0"
+
+    async def _set(self, key: str, entry: CachedResponse, version: Optional[str]):
+        self._store(key, entry)
+        client = get_redis()
+        if client is not None and version is not None:
+            try:
+                await client.register_script(SET_IF_VERSION)(
+                    keys=[key, self._version_key(key)], args=[version, entry.dumps(), self.redis_ttl]
+                )
+            except Exception as e:
+                print(f"Response cache Redis error: {e}")
+
+    def _store(self, key: str, entry: CachedResponse):
+        self._entries[key] = (time.monotonic() + self.ttl, entry)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    async def invalidate(self, *keys: str):
+        """Drop keys from this process and from Redis after a write"""
+        now = time.monotonic()
+        for key in keys:
+            self._entries.pop(key, None)
+            self._invalidated_at[key] = now
+        self.invalidations += len(keys)
+        # Only loads that started before now consult this; keep it small
+        if len(self._invalidated_at) > self.max_entries:
+            cutoff = now - 60
+            self._invalidated_at = {key: at for key, at in self._invalidated_at.items() if at > cutoff}
+        client = get_redis()
+        if client is not None and keys:
+            try:
+                async with client.pipeline(transaction=True) as pipe:
+                    for key in keys:
+                        # A version only has to outlive the loads that read it
+                        pipe.incr(self._version_key(key))
+                        pipe.expire(self._version_key(key), self.redis_ttl)
+                    pipe.delete(*keys)
+                    await pipe.execute()
+            except Exception as e:
+                print(f"Response cache Redis error: {e}")
+
+    def respond(self, entry: CachedResponse, request: Request) -> Response:
+        """200 with the cached body, or 304 when the client already holds this ETag"""
+        headers = {"ETag": entry.etag, "Cache-Control": "private, no-cache"}
+        if_none_match = request.headers.get("if-none-match")
+        if if_none_match:
+            tags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+            if entry.etag in tags or "*" in tags:
+                self.not_modified += 1
+                return Response(status_code=304, headers=headers)
+        return Response(content=entry.body, media_type="application/json", headers=headers)
+
+    def stats(self):
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "redis_hits": self.redis_hits,
+            "misses": self.misses,
+            "not_modified": self.not_modified,
+            "invalidations": self.invalidations
+        }
+
+response_cache = ResponseCache()
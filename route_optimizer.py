@@ -0,0 +1,278 @@
+# route_optimizer.py - In-process route optimization, used when ROS is down or with ROUTE_OPTIMIZER=local
+import asyncio
+import os
+import time
+from collections import OrderedDict
+from datetime import date, datetime
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from sqlalchemy import select
+
+from database import AsyncSessionLocal
+from models import Order
+from tracking import location_ingestor
+from travel_matrix import TravelMatrix, travel_times
+
+# Delivery window and time spent at each stop, as sent to ROS
+DELIVERY_TIME_WINDOW = os.getenv("DELIVERY_TIME_WINDOW", "09:00-18:00")
+SERVICE_MINUTES = int(os.getenv("DELIVERY_SERVICE_MINUTES", "5"))
+ROUTE_TIME_BUDGET = float(os.getenv("ROUTE_TIME_BUDGET", "0.5"))  # Seconds of improvement per route
+
+# Objective, in km of driving: each minute a stop is served after its window
+# closes costs LATE_KM_PER_MINUTE, and each minute a stop above normal
+# priority waits costs PRIORITY_KM_PER_MINUTE; both scale with the weight
+PRIORITY_WEIGHTS = {"urgent": 4.0, "high": 2.0, "normal": 1.0, "low": 0.5}
+LATE_KM_PER_MINUTE = 1.0
+PRIORITY_KM_PER_MINUTE = 0.05
+# Improving moves evaluated against the full objective per iteration
+CANDIDATE_MOVES = 20
+# Drivers whose day of stops keeps a travel matrix in memory
+ROUTE_MATRIX_DRIVERS = int(os.getenv("ROUTE_MATRIX_DRIVERS", "1000"))
+
+def parse_time_window(window: str) -> Tuple[float, float]:
+    """Minutes after midnight from "HH:MM-HH:MM" """
+    opens, closes = (
+        int(part.split(":")[0]) * 60 + int(part.split(":")[1]) for part in window.split("-")
+    )
+    return float(opens), float(closes)
+
+def clock_time(minutes: float) -> str:
+    minutes = int(round(minutes)) % 1440
+    return f"{minutes // 60:02d}:{minutes % 60:02d}"
+
+class RouteProblem:
+    """Stops with coordinates, windows and priorities, as arrays over nodes
+
+    Node 0 is the start, 1..n the stops and n + 1 a virtual end at zero
+    distance from everything, so routes are open paths with both ends fixed.
+    km and minutes are the travel matrices among the start and the stops.
+    """
+
+    def __init__(
+        self,
+        km: np.ndarray,
+        minutes: np.ndarray,
+        stops: Sequence[Dict[str, Any]],
+        start_minute: float
+    ):
+        n = len(stops)
+        self.distance = np.zeros((n + 2, n + 2))
+        self.distance[:n + 1, :n + 1] = km
+        self.minutes = np.zeros((n + 2, n + 2))
+        self.minutes[:n + 1, :n + 1] = minutes
+        windows = [parse_time_window(stop.get("time_window") or DELIVERY_TIME_WINDOW) for stop in stops]
+        self.opens = [0.0] + [window[0] for window in windows] + [0.0]
+        self.closes = [float("inf")] + [window[1] for window in windows] + [float("inf")]
+        self.service = [0.0] + [stop.get("service_minutes", SERVICE_MINUTES) for stop in stops] + [0.0]
+        self.weights = [0.0] + [PRIORITY_WEIGHTS.get(stop.get("priority"), 1.0) for stop in stops] + [0.0]
+        self.start_minute = start_minute
+        self.size = n
+        self._minutes = self.minutes.tolist()
+        self._distance = self.distance.tolist()
+
+    def schedule(self, tour: Sequence[int]) -> Tuple[float, List[float]]:
+        """Objective of a tour and the arrival minute at each of its nodes"""
+        clock = self.start_minute
+        cost = 0.0
+        arrivals = [clock]
+        previous = tour[0]
+        for node in tour[1:-1]:
+            cost += self._distance[previous][node]
+            clock = max(clock + self._minutes[previous][node], self.opens[node])
+            arrivals.append(clock)
+            weight = self.weights[node]
+            if clock > self.closes[node]:
+                cost += weight * LATE_KM_PER_MINUTE * (clock - self.closes[node])
+            if weight > 1:
+                cost += (weight - 1) * PRIORITY_KM_PER_MINUTE * (clock - self.start_minute)
+            clock += self.service[node]
+            previous = node
+        arrivals.append(clock)
+        return cost, arrivals
+
+    def construct(self) -> np.ndarray:
+        """Nearest neighbour, with distances to heavier stops scaled down"""
+        weights = np.array(self.weights[1:-1])
+        unvisited = np.ones(self.size, dtype=bool)
+        tour = [0]
+        current = 0
+        for _ in range(self.size):
+            scores = np.where(unvisited, self.distance[current, 1:self.size + 1] / weights, np.inf)
+            index = int(scores.argmin())
+            unvisited[index] = False
+            current = index + 1
+            tour.append(current)
+        tour.append(self.size + 1)
+        return np.array(tour)
+
+    def candidate_moves(self, tour: np.ndarray) -> List[Tuple[float, str, int, int, int]]:
+        """Best 2-opt and Or-opt moves by change in distance: (delta, kind, i, j, segment length)"""
+        distance = self.distance
+        heads, tails = tour[:-1], tour[1:]
+        edges = distance[heads, tails]
+        moves = []
+
+        # 2-opt: reverse tour[i + 1..j] for edges i < j
+        delta = distance[heads[:, None], heads[None, :]] + distance[tails[:, None], tails[None, :]]
+        delta -= edges[:, None] + edges[None, :]
+        delta[np.tril_indices(len(edges))] = np.inf
+        moves.append((delta, "2opt", 0))
+
+        # Or-opt: move tour[s..s + length - 1] to after tour[k]
+        last = len(tour) - 1
+        for length in (1, 2, 3):
+            starts = np.arange(1, last - length + 1)
+            if not len(starts):
+                break
+            first, final = tour[starts], tour[starts + length - 1]
+            before, after = tour[starts - 1], tour[starts + length]
+            removal = distance[before, after] - distance[before, first] - distance[final, after]
+            delta = removal[:, None] + distance[heads[None, :], first[:, None]] + distance[final[:, None], tails[None, :]]
+            delta -= edges[None, :]
+            positions = np.arange(len(edges))
+            delta[(positions[None, :] >= starts[:, None] - 1) & (positions[None, :] <= starts[:, None] + length - 1)] = np.inf
+            moves.append((delta, "oropt", length))
+
+        found = []
+        for delta, kind, length in moves:
+            flat = delta.ravel()
+            count = min(CANDIDATE_MOVES, flat.size)
+            for index in np.argpartition(flat, count - 1)[:count]:
+                if np.isfinite(flat[index]):
+                    row, column = divmod(int(index), delta.shape[1])
+                    if kind == "oropt":
+                        row += 1  # Row 0 is the segment starting at position 1
+                    found.append((float(flat[index]), kind, row, column, length))
+        found.sort(key=lambda move: move[0])
+        return found[:CANDIDATE_MOVES]
+
+    @staticmethod
+    def apply(tour: np.ndarray, kind: str, i: int, j: int, length: int) -> np.ndarray:
+        if kind == "2opt":
+            return np.concatenate((tour[:i + 1], tour[i + 1:j + 1][::-1], tour[j + 1:]))
+        segment = tour[i:i + length]
+        rest = np.concatenate((tour[:i], tour[i + length:]))
+        position = j + 1 if j < i else j + 1 - length
+        return np.concatenate((rest[:position], segment, rest[position:]))
+
+    def improve(self, tour: np.ndarray, time_budget: float = ROUTE_TIME_BUDGET) -> np.ndarray:
+        """2-opt and Or-opt local search, accepting moves that lower the full objective"""
+        deadline = time.perf_counter() + time_budget
+        cost = self.schedule(tour.tolist())[0]
+        while time.perf_counter() < deadline:
+            for _, kind, i, j, length in self.candidate_moves(tour):
+                candidate = self.apply(tour, kind, i, j, length)
+                candidate_cost = self.schedule(candidate.tolist())[0]
+                if candidate_cost < cost - 1e-9:
+                    tour, cost = candidate, candidate_cost
+                    break
+            else:
+                break
+        return tour
+
+def optimize_route(
+    origin: Optional[Tuple[float, float]],
+    stops: Sequence[Dict[str, Any]],
+    start_minute: float,
+    time_budget: float = ROUTE_TIME_BUDGET,
+    day: Optional[TravelMatrix] = None
+) -> Dict[str, Any]:
+    """Order stops into a route starting at origin, in the shape ROS returns
+
+    Stops are dicts with order_id, address, latitude, longitude and
+    optionally priority, time_window and service_minutes. Stops without
+    coordinates cannot be placed and are appended in their given order.
+    Travel times come from travel_matrix.py; pass the day matrix of the
+    driver to reuse the rows of stops seen in earlier optimizations.
+    """
+    located = [stop for stop in stops if stop.get("latitude") is not None and stop.get("longitude") is not None]
+    unlocated = [stop for stop in stops if stop not in located]
+    route = []
+    total_distance = 0.0
+    finish = start_minute
+    late = 0
+    if located:
+        if origin is None:
+            origin = (located[0]["latitude"], located[0]["longitude"])
+        if day is None:
+            latitudes = [origin[0]] + [stop["latitude"] for stop in located]
+            longitudes = [origin[1]] + [stop["longitude"] for stop in located]
+            km, minutes = travel_times.matrix(latitudes, longitudes)
+        else:
+            keys = [(stop["order_id"], stop["latitude"], stop["longitude"]) for stop in located]
+            day.add([(key, key[1], key[2]) for key in keys])
+            km, minutes = day.with_origin(origin, keys)
+        problem = RouteProblem(km, minutes, located, start_minute)
+        tour = problem.improve(problem.construct(), time_budget).tolist()
+        _, arrivals = problem.schedule(tour)
+        finish = arrivals[-1]
+        total_distance = float(problem.distance[tour[:-2], tour[1:-1]].sum())
+        for sequence, (node, arrival) in enumerate(zip(tour[1:-1], arrivals[1:-1]), start=1):
+            stop = located[node - 1]
+            late += arrival > problem.closes[node]
+            route.append({
+                "sequence": sequence,
+                "order_id": stop["order_id"],
+                "address": stop.get("address"),
+                "latitude": stop["latitude"],
+                "longitude": stop["longitude"],
+                "estimated_time": clock_time(arrival)
+            })
+    for stop in unlocated:
+        route.append({
+            "sequence": len(route) + 1,
+            "order_id": stop["order_id"],
+            "address": stop.get("address"),
+            "estimated_time": None
+        })
+    return {
+        "route": route,
+        "total_distance": round(total_distance, 2),
+        "estimated_duration": round(finish - start_minute),
+        "late_stops": late,
+        "unlocated_stops": len(unlocated)
+    }
+
+_day_matrices: "OrderedDict[int, Tuple[date, TravelMatrix]]" = OrderedDict()
+
+def day_matrix(driver_id: int) -> TravelMatrix:
+    """Travel matrix among the stops a driver has been routed through today"""
+    today = date.today()
+    entry = _day_matrices.get(driver_id)
+    if entry is None or entry[0] != today:
+        entry = _day_matrices[driver_id] = (today, TravelMatrix())
+    _day_matrices.move_to_end(driver_id)
+    while len(_day_matrices) > ROUTE_MATRIX_DRIVERS:
+        _day_matrices.popitem(last=False)
+    return entry[1]
+
+async def optimize_driver_route(driver_id: int) -> Dict[str, Any]:
+    """Route over a driver's open orders, starting from their latest known position"""
+    async with AsyncSessionLocal() as db:
+        result = await db.execute(
+            select(
+                Order.id, Order.delivery_address, Order.delivery_latitude, Order.delivery_longitude, Order.priority
+            )
+            .where(Order.assigned_driver_id == driver_id, Order.status.notin_(("delivered", "failed")))
+            .order_by(Order.created_at)
+        )
+        stops = [
+            {
+                "order_id": order.id,
+                "address": order.delivery_address,
+                "latitude": order.delivery_latitude,
+                "longitude": order.delivery_longitude,
+                "priority": order.priority
+            }
+            for order in result.all()
+        ]
+    position = await location_ingestor.get_latest(driver_id)
+    origin = (position["latitude"], position["longitude"]) if position else None
+    now = datetime.now()  # Windows are local wall-clock times
+    # CPU-bound for up to ROUTE_TIME_BUDGET, so off the event loop
+    route = await asyncio.get_running_loop().run_in_executor(
+        None, optimize_route, origin, stops, now.hour * 60 + now.minute + now.second / 60, ROUTE_TIME_BUDGET,
+        day_matrix(driver_id)
+    )
+    return {"driver_id": driver_id, **route, "source": "local"}
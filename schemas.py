@@ -1,5 +1,5 @@
 # schemas.py - Pydantic schemas for API
-from pydantic import BaseModel, EmailStr
+from pydantic import BaseModel, EmailStr, Field
 from typing import Optional, Dict, Any, List
 from datetime import datetime
 
@@ -33,6 +33,11 @@ class OrderCreate(BaseModel):
     delivery_address: str
     package_details: Dict[str, Any]
     priority: str = "normal"
+    # Optional coordinates; orders with a pickup point are dispatched to the nearest driver
+    pickup_latitude: Optional[float] = Field(None, ge=-90, le=90)
+    pickup_longitude: Optional[float] = Field(None, ge=-180, le=180)
+    delivery_latitude: Optional[float] = Field(None, ge=-90, le=90)
+    delivery_longitude: Optional[float] = Field(None, ge=-180, le=180)
 
 class OrderResponse(BaseModel):
     id: str
@@ -44,6 +49,42 @@ class OrderResponse(BaseModel):
     class Config:
         from_attributes = True
 
+class OrderListItem(BaseModel):
+    """Row of GET /orders; only the fields requested with fields= are set"""
+    id: Optional[str] = None
+    status: Optional[str] = None
+    pickup_address: Optional[str] = None
+    delivery_address: Optional[str] = None
+    package_details: Optional[Dict[str, Any]] = None
+    priority: Optional[str] = None
+    created_at: Optional[datetime] = None
+    updated_at: Optional[datetime] = None
+
+class OrderBatchItemResult(BaseModel):
+    index: int
+    status: str  # "accepted" or "rejected"
+    order_id: Optional[str] = None
+    error: Optional[str] = None
+
+class OrderBatchResponse(BaseModel):
+    accepted: int
+    rejected: int
+    results: List[OrderBatchItemResult]
+
+# Job schemas
+class OrderJobResponse(BaseModel):
+    id: str
+    order_id: str
+    status: str
+    attempts: int
+    last_error: Optional[str]
+    created_at: datetime
+    updated_at: datetime
+    finished_at: Optional[datetime]
+    
+    class Config:
+        from_attributes = True
+
 # Package schemas
 class PackageResponse(BaseModel):
     id: str
@@ -66,6 +107,27 @@ class RouteResponse(BaseModel):
     class Config:
         from_attributes = True
 
+# Driver location schemas
+class LocationPoint(BaseModel):
+    latitude: float = Field(ge=-90, le=90)
+    longitude: float = Field(ge=-180, le=180)
+    recorded_at: Optional[datetime] = None  # UTC; time of receipt when omitted
+    accuracy_m: Optional[float] = Field(None, ge=0)
+    speed_mps: Optional[float] = Field(None, ge=0)
+    heading: Optional[int] = Field(None, ge=0, lt=360)
+
+class LocationBatch(BaseModel):
+    points: List[LocationPoint] = Field(max_length=1000)
+
+class DriverPosition(BaseModel):
+    driver_id: int
+    latitude: float
+    longitude: float
+    recorded_at: datetime
+    accuracy_m: Optional[float] = None
+    speed_mps: Optional[float] = None
+    heading: Optional[int] = None
+
 # Delivery update schemas
 class DeliveryUpdateCreate(BaseModel):
     status: str
@@ -2,23 +2,107 @@
 import aiohttp
 import json
 import xml.etree.ElementTree as ET
-from typing import Dict, Any
+from xml.sax.saxutils import escape
+from typing import Dict, Any, List
 import asyncio
 import socket
-import pika
-import threading
 from datetime import datetime
 import os
+from contextlib import asynccontextmanager
 from dotenv import load_dotenv
 
+from amqp_publisher import AMQPPublisher
+from route_optimizer import DELIVERY_TIME_WINDOW, SERVICE_MINUTES, optimize_driver_route
+from wms_pool import WMSConnectionPool
+
 # Load environment variables
 load_dotenv()
 
+# Answer with mock responses when CMS, WMS or ROS fail, for development without the upstream
+# systems; otherwise failures reach order processing, which retries and compensates
+UPSTREAM_MOCK_FALLBACK = os.getenv("UPSTREAM_MOCK_FALLBACK", "false").lower() == "true"
+
+class HTTPConnectionPool:
+    """Shared keep-alive aiohttp session for a single upstream system"""
+    
+    def __init__(
+        self,
+        name: str,
+        limit: int = int(os.getenv("HTTP_POOL_LIMIT", "100")),
+        limit_per_host: int = int(os.getenv("HTTP_POOL_LIMIT_PER_HOST", "20")),
+        keepalive_timeout: float = float(os.getenv("HTTP_KEEPALIVE_TIMEOUT", "30")),
+        dns_cache_ttl: int = int(os.getenv("HTTP_DNS_CACHE_TTL", "300")),
+        timeout: float = 30
+    ):
+        self.name = name
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.keepalive_timeout = keepalive_timeout
+        self.dns_cache_ttl = dns_cache_ttl
+        self.timeout = timeout
+        self._session = None
+        self._in_flight = 0
+        self._requests_total = 0
+    
+    async def start(self) -> aiohttp.ClientSession:
+        """Create the pooled session if it is not open yet"""
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.limit,
+                limit_per_host=self.limit_per_host,
+                keepalive_timeout=self.keepalive_timeout,
+                ttl_dns_cache=self.dns_cache_ttl,
+                use_dns_cache=True
+            )
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(total=self.timeout)
+            )
+        return self._session
+    
+    async def close(self):
+        """Close the session and every pooled connection"""
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+    
+    @asynccontextmanager
+    async def request(self, method: str, url: str, **kwargs):
+        """Send a request over a pooled connection"""
+        session = await self.start()
+        self._in_flight += 1
+        self._requests_total += 1
+        try:
+            async with session.request(method, url, **kwargs) as response:
+                yield response
+        finally:
+            self._in_flight -= 1
+    
+    def stats(self) -> Dict[str, Any]:
+        """Connection pool statistics for monitoring"""
+        idle = 0
+        acquired = 0
+        if self._session is not None and not self._session.closed:
+            connector = self._session.connector
+            # aiohttp does not expose these counters publicly
+            idle = sum(len(conns) for conns in getattr(connector, "_conns", {}).values())
+            acquired = len(getattr(connector, "_acquired", ()))
+        return {
+            "open": idle + acquired,
+            "idle": idle,
+            "in_flight": self._in_flight,
+            "requests_total": self._requests_total,
+            "limit": self.limit,
+            "limit_per_host": self.limit_per_host
+        }
+
 class CMSService:
     """Client Management System (SOAP/XML) integration"""
     
-    def __init__(self, base_url: str = "http://localhost:8001"):
+    def __init__(self, base_url: str = "http://localhost:8001", mock_fallback: bool = UPSTREAM_MOCK_FALLBACK):
         self.base_url = base_url
+        self.pool = HTTPConnectionPool("cms")
+        self.mock_fallback = mock_fallback
     
     async def submit_order(self, order_data: Dict[str, Any]) -> Dict[str, Any]:
         """Submit order to CMS via SOAP"""
@@ -41,25 +125,26 @@ class CMSService:
         }
         
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.post(
-                    f"{self.base_url}/soap",
-                    data=soap_body,
-                    headers=headers,
-                    timeout=30
-                ) as response:
-                    if response.status == 200:
-                        xml_response = await response.text()
-                        # Parse XML response
-                        root = ET.fromstring(xml_response)
-                        reference_id = root.find('.//ReferenceId')
-                        return {
-                            "reference_id": reference_id.text if reference_id is not None else f"CMS_{order_data['order_id']}",
-                            "status": "submitted"
-                        }
-                    else:
-                        raise Exception(f"CMS error: {response.status}")
+            async with self.pool.request(
+                "POST",
+                f"{self.base_url}/soap",
+                data=soap_body,
+                headers=headers
+            ) as response:
+                if response.status == 200:
+                    xml_response = await response.text()
+                    # Parse XML response
+                    root = ET.fromstring(xml_response)
+                    reference_id = root.find('.//ReferenceId')
+                    return {
+                        "reference_id": reference_id.text if reference_id is not None else f"CMS_{order_data['order_id']}",
+                        "status": "submitted"
+                    }
+                else:
+                    raise Exception(f"CMS error: {response.status}")
         except Exception as e:
+            if not self.mock_fallback:
+                raise
             # Mock response for development
             print(f"CMS Service Error: {e}")
             return {
@@ -67,6 +152,97 @@ class CMSService:
                 "status": "submitted"
             }
     
+    async def submit_orders(self, orders: List[Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+        """Submit several orders to CMS in one SOAP call, keyed by order id"""
+        order_elements = "".join(f"""
+                    <Order>
+                        <OrderId>{escape(str(order['order_id']))}</OrderId>
+                        <ClientId>{escape(str(order['client_id']))}</ClientId>
+                        <PickupAddress>{escape(order['pickup_address'])}</PickupAddress>
+                        <DeliveryAddress>{escape(order['delivery_address'])}</DeliveryAddress>
+                    </Order>""" for order in orders)
+        soap_body = f"""
+        <soap:Envelope xmlns:soap="http://schemas.xmlsoap.org/soap/envelope/">
+            <soap:Body>
+                <SubmitOrders xmlns="http://cms.swiftlogistics.com/">{order_elements}
+                </SubmitOrders>
+            </soap:Body>
+        </soap:Envelope>
+        """
+        
+        headers = {
+            'Content-Type': 'text/xml; charset=utf-8',
+            'SOAPAction': 'http://cms.swiftlogistics.com/SubmitOrders'
+        }
+        
+        try:
+            async with self.pool.request(
+                "POST",
+                f"{self.base_url}/soap",
+                data=soap_body,
+                headers=headers
+            ) as response:
+                if response.status != 200:
+                    raise Exception(f"CMS error: {response.status}")
+                root = ET.fromstring(await response.text())
+                results = {}
+                for element in root.iter():
+                    if not element.tag.endswith('OrderResult'):
+                        continue
+                    order_id = element.findtext('.//{*}OrderId')
+                    reference_id = element.findtext('.//{*}ReferenceId')
+                    if order_id:
+                        results[order_id] = {
+                            "reference_id": reference_id or f"CMS_{order_id}",
+                            "status": "submitted"
+                        }
+                return results
+        except Exception as e:
+            if not self.mock_fallback:
+                raise
+            # Mock response for development
+            print(f"CMS Service Error: {e}")
+            return {
+                order['order_id']: {
+                    "reference_id": f"CMS_MOCK_{order['order_id']}",
+                    "status": "submitted"
+                } for order in orders
+            }
+    
+    async def cancel_order(self, reference_id: str) -> Dict[str, Any]:
+        """Cancel a previously submitted order in CMS via SOAP"""
+        soap_body = f"""
+        <soap:Envelope xmlns:soap="http://schemas.xmlsoap.org/soap/envelope/">
+            <soap:Body>
+                <CancelOrder xmlns="http://cms.swiftlogistics.com/">
+                    <ReferenceId>{reference_id}</ReferenceId>
+                </CancelOrder>
+            </soap:Body>
+        </soap:Envelope>
+        """
+        
+        headers = {
+            'Content-Type': 'text/xml; charset=utf-8',
+            'SOAPAction': 'http://cms.swiftlogistics.com/CancelOrder'
+        }
+        
+        try:
+            async with self.pool.request(
+                "POST",
+                f"{self.base_url}/soap",
+                data=soap_body,
+                headers=headers
+            ) as response:
+                if response.status != 200:
+                    raise Exception(f"CMS error: {response.status}")
+                return {"reference_id": reference_id, "status": "cancelled"}
+        except Exception as e:
+            if not self.mock_fallback:
+                raise
+            # Mock response for development
+            print(f"CMS Service Error: {e}")
+            return {"reference_id": reference_id, "status": "cancelled"}
+    
     async def get_order_status(self, reference_id: str) -> Dict[str, Any]:
         """Get order status from CMS"""
         # Mock implementation
@@ -79,9 +255,18 @@ class CMSService:
 class ROSService:
     """Route Optimization System (REST/JSON) integration"""
     
-    def __init__(self, base_url: str = "http://localhost:8002"):
+    def __init__(
+        self,
+        base_url: str = "http://localhost:8002",
+        optimizer: str = os.getenv("ROUTE_OPTIMIZER", "ros"),
+        mock_fallback: bool = UPSTREAM_MOCK_FALLBACK
+    ):
         self.base_url = base_url
         self.api_key = "demo_api_key"  # Should be in environment variables
+        self.pool = HTTPConnectionPool("ros")
+        self.mock_fallback = mock_fallback
+        # "ros": ask ROS, falling back to route_optimizer.py; "local": route_optimizer.py only
+        self.optimizer = optimizer
     
     async def add_delivery_point(self, delivery_data: Dict[str, Any]) -> Dict[str, Any]:
         """Add delivery point to route optimization"""
@@ -93,29 +278,32 @@ class ROSService:
         payload = {
             'delivery_id': delivery_data['order_id'],
             'address': delivery_data['delivery_address'],
+            'latitude': delivery_data.get('latitude'),
+            'longitude': delivery_data.get('longitude'),
             'priority': delivery_data['priority'],
-            'time_window': '09:00-18:00',
-            'service_time': 5  # minutes
+            'time_window': DELIVERY_TIME_WINDOW,
+            'service_time': SERVICE_MINUTES  # minutes
         }
         
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.post(
-                    f"{self.base_url}/api/v1/delivery-points",
-                    json=payload,
-                    headers=headers,
-                    timeout=30
-                ) as response:
-                    if response.status == 201:
-                        result = await response.json()
-                        return {
-                            "route_point_id": result.get('id', f"ROS_{delivery_data['order_id']}"),
-                            "estimated_delivery_time": result.get('estimated_time'),
-                            "route_sequence": result.get('sequence')
-                        }
-                    else:
-                        raise Exception(f"ROS error: {response.status}")
+            async with self.pool.request(
+                "POST",
+                f"{self.base_url}/api/v1/delivery-points",
+                json=payload,
+                headers=headers
+            ) as response:
+                if response.status == 201:
+                    result = await response.json()
+                    return {
+                        "route_point_id": result.get('id', f"ROS_{delivery_data['order_id']}"),
+                        "estimated_delivery_time": result.get('estimated_time'),
+                        "route_sequence": result.get('sequence')
+                    }
+                else:
+                    raise Exception(f"ROS error: {response.status}")
         except Exception as e:
+            if not self.mock_fallback:
+                raise
             # Mock response for development
             print(f"ROS Service Error: {e}")
             return {
@@ -124,42 +312,103 @@ class ROSService:
                 "route_sequence": 1
             }
     
-    async def get_optimized_route(self, driver_id: int) -> Dict[str, Any]:
-        """Get optimized route for driver"""
+    async def add_delivery_points(self, deliveries: List[Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+        """Add several delivery points in one request, keyed by order id"""
+        headers = {
+            'Content-Type': 'application/json',
+            'Authorization': f'Bearer {self.api_key}'
+        }
+        
+        payload = [{
+            'delivery_id': delivery['order_id'],
+            'address': delivery['delivery_address'],
+            'latitude': delivery.get('latitude'),
+            'longitude': delivery.get('longitude'),
+            'priority': delivery['priority'],
+            'time_window': DELIVERY_TIME_WINDOW,
+            'service_time': SERVICE_MINUTES  # minutes
+        } for delivery in deliveries]
+        
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.get(
-                    f"{self.base_url}/api/v1/routes/driver/{driver_id}",
-                    headers={'Authorization': f'Bearer {self.api_key}'},
-                    timeout=30
-                ) as response:
-                    if response.status == 200:
-                        return await response.json()
-                    else:
-                        raise Exception(f"ROS error: {response.status}")
+            async with self.pool.request(
+                "POST",
+                f"{self.base_url}/api/v1/delivery-points/batch",
+                json=payload,
+                headers=headers
+            ) as response:
+                if response.status not in (200, 201):
+                    raise Exception(f"ROS error: {response.status}")
+                results = {}
+                for result in await response.json():
+                    order_id = result.get('delivery_id')
+                    if order_id is None:
+                        # Cannot be matched to an order; the order is reported as missing a result
+                        print(f"ROS returned a delivery point without delivery_id: {result}")
+                        continue
+                    results[order_id] = {
+                        "route_point_id": result.get('id', f"ROS_{order_id}"),
+                        "estimated_delivery_time": result.get('estimated_time'),
+                        "route_sequence": result.get('sequence')
+                    }
+                return results
         except Exception as e:
+            if not self.mock_fallback:
+                raise
             # Mock response for development
             print(f"ROS Service Error: {e}")
             return {
-                "driver_id": driver_id,
-                "route": [
-                    {
-                        "sequence": 1,
-                        "address": "123 Main St, Colombo",
-                        "estimated_time": "10:30",
-                        "order_id": "mock_order_1"
-                    }
-                ],
-                "total_distance": 25.5,
-                "estimated_duration": 120
+                delivery['order_id']: {
+                    "route_point_id": f"ROS_MOCK_{delivery['order_id']}",
+                    "estimated_delivery_time": "14:00",
+                    "route_sequence": sequence
+                } for sequence, delivery in enumerate(deliveries, start=1)
             }
+    
+    async def remove_delivery_point(self, route_point_id: str) -> Dict[str, Any]:
+        """Remove a delivery point from route optimization"""
+        try:
+            async with self.pool.request(
+                "DELETE",
+                f"{self.base_url}/api/v1/delivery-points/{route_point_id}",
+                headers={'Authorization': f'Bearer {self.api_key}'}
+            ) as response:
+                if response.status not in (200, 204, 404):
+                    raise Exception(f"ROS error: {response.status}")
+                return {"route_point_id": route_point_id, "removed": True}
+        except Exception as e:
+            if not self.mock_fallback:
+                raise
+            # Mock response for development
+            print(f"ROS Service Error: {e}")
+            return {"route_point_id": route_point_id, "removed": True}
+    
+    async def get_optimized_route(self, driver_id: int) -> Dict[str, Any]:
+        """Get optimized route for driver"""
+        if self.optimizer == "local":
+            return await optimize_driver_route(driver_id)
+        try:
+            async with self.pool.request(
+                "GET",
+                f"{self.base_url}/api/v1/routes/driver/{driver_id}",
+                headers={'Authorization': f'Bearer {self.api_key}'}
+            ) as response:
+                if response.status == 200:
+                    return await response.json()
+                else:
+                    raise Exception(f"ROS error: {response.status}")
+        except Exception as e:
+            # Optimize in process from the driver's open orders
+            print(f"ROS Service Error: {e}")
+            return await optimize_driver_route(driver_id)
 
 class WMSService:
     """Warehouse Management System (TCP/IP) integration"""
     
-    def __init__(self, host: str = "localhost", port: int = 8003):
+    def __init__(self, host: str = "localhost", port: int = 8003, mock_fallback: bool = UPSTREAM_MOCK_FALLBACK):
         self.host = host
         self.port = port
+        self.pool = WMSConnectionPool(host, port)
+        self.mock_fallback = mock_fallback
     
     async def add_package(self, package_data: Dict[str, Any]) -> Dict[str, Any]:
         """Add package to warehouse system"""
@@ -171,10 +420,10 @@ class WMSService:
         }
         
         try:
-            # Simulate TCP/IP communication
-            response = await self._send_tcp_message(json.dumps(message))
-            return json.loads(response)
+            return await self._send_tcp_message(message)
         except Exception as e:
+            if not self.mock_fallback:
+                raise
             # Mock response for development
             print(f"WMS Service Error: {e}")
             return {
@@ -183,6 +432,34 @@ class WMSService:
                 "status": "received"
             }
     
+    async def add_packages(self, packages: List[Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+        """Add several packages in one WMS message, keyed by order id"""
+        message = {
+            "action": "ADD_PACKAGES",
+            "packages": [{
+                "order_id": package['order_id'],
+                "package_details": package['package_details']
+            } for package in packages],
+            "timestamp": datetime.utcnow().isoformat()
+        }
+        
+        try:
+            response = await self._send_tcp_message(message)
+            return {package['order_id']: package for package in response['packages'] if package.get('order_id') is not None}
+        except Exception as e:
+            if not self.mock_fallback:
+                raise
+            # Mock response for development
+            print(f"WMS Service Error: {e}")
+            return {
+                package['order_id']: {
+                    "order_id": package['order_id'],
+                    "package_id": f"WMS_MOCK_{package['order_id']}",
+                    "warehouse_location": "A-01-15",
+                    "status": "received"
+                } for package in packages
+            }
+    
     async def update_package_status(self, order_id: str, status: str) -> Dict[str, Any]:
         """Update package status in warehouse"""
         message = {
@@ -193,8 +470,7 @@ class WMSService:
         }
         
         try:
-            response = await self._send_tcp_message(json.dumps(message))
-            return json.loads(response)
+            return await self._send_tcp_message(message)
         except Exception as e:
             # Mock response for development
             print(f"WMS Service Error: {e}")
@@ -204,112 +480,66 @@ class WMSService:
                 "updated": True
             }
     
-    async def _send_tcp_message(self, message: str) -> str:
-        """Send message via TCP/IP"""
+    async def remove_package(self, order_id: str) -> Dict[str, Any]:
+        """Remove a package from the warehouse system"""
+        message = {
+            "action": "REMOVE_PACKAGE",
+            "order_id": order_id,
+            "timestamp": datetime.utcnow().isoformat()
+        }
+        
+        try:
+            return await self._send_tcp_message(message)
+        except Exception as e:
+            if not self.mock_fallback:
+                raise
+            # Mock response for development
+            print(f"WMS Service Error: {e}")
+            return {
+                "order_id": order_id,
+                "removed": True
+            }
+    
+    async def _send_tcp_message(self, message: Dict[str, Any]) -> Dict[str, Any]:
+        """Send message over a pooled TCP/IP connection"""
         try:
-            reader, writer = await asyncio.open_connection(self.host, self.port)
-            writer.write(message.encode())
-            await writer.drain()
-            
-            data = await reader.read(1024)
-            writer.close()
-            await writer.wait_closed()
-            
-            return data.decode()
+            response = await self.pool.request(message)
         except Exception as e:
-            raise Exception(f"TCP communication failed: {e}")
+            raise Exception(f"TCP communication failed: {e!r}")
+        if "error" in response:
+            raise Exception(f"WMS error: {response['error']}")
+        return response
+
+def rabbitmq_url() -> str:
+    """AMQP URL from RABBITMQ_URL or RABBITMQ_USER/PASS/HOST/PORT"""
+    return os.getenv("RABBITMQ_URL") or "amqp://{}:{}@{}:{}/".format(
+        os.getenv('RABBITMQ_USER', 'guest'),
+        os.getenv('RABBITMQ_PASS', 'guest'),
+        os.getenv('RABBITMQ_HOST', 'localhost'),
+        os.getenv('RABBITMQ_PORT', '5672')
+    )
 
 class MessageBroker:
-    """RabbitMQ message broker for asynchronous communication"""
+    """RabbitMQ message broker for asynchronous communication
     
-    def __init__(self, host: str = "localhost", port: int = 5672):
-        self.host = host
-        self.port = port
-        self.credentials = pika.PlainCredentials(
-            os.getenv('RABBITMQ_USER', 'guest'),
-            os.getenv('RABBITMQ_PASS', 'guest')
-        )
-        self.connection = None
-        self.channel = None
-        self._setup_connection()
+    Events are consumed by consumer.py and order jobs by worker.py, each
+    running as its own process.
+    """
     
-    def _setup_connection(self):
-        """Setup RabbitMQ connection"""
-        try:
-            self.connection = pika.BlockingConnection(
-                pika.ConnectionParameters(
-                    host=self.host,
-                    port=self.port,
-                    credentials=self.credentials,
-                    heartbeat=600
-                )
-            )
-            self.channel = self.connection.channel()
-            
-            # Declare exchanges and queues
-            self.channel.exchange_declare(exchange='swiftlogistics', exchange_type='topic', durable=True)
-            
-            # Declare queues
-            queues = ['order.submitted', 'order.processed', 'order.failed', 'delivery.updated']
-            for queue in queues:
-                self.channel.queue_declare(queue=queue, durable=True)
-                self.channel.queue_bind(exchange='swiftlogistics', queue=queue, routing_key=queue)
-            
-        except Exception as e:
-            print(f"RabbitMQ connection failed: {e}")
-            self.connection = None
-            self.channel = None
-    
-    async def publish_message(self, routing_key: str, message: Dict[str, Any]):
-        """Publish message to RabbitMQ"""
-        if not self.channel:
-            print("RabbitMQ not connected - message not sent")
-            return
-        
-        try:
-            self.channel.basic_publish(
-                exchange='swiftlogistics',
-                routing_key=routing_key,
-                body=json.dumps(message),
-                properties=pika.BasicProperties(
-                    delivery_mode=2,  # Make message persistent
-                    timestamp=int(datetime.utcnow().timestamp())
-                )
-            )
-            print(f"Message published to {routing_key}: {message}")
-        except Exception as e:
-            print(f"Failed to publish message: {e}")
+    def __init__(self):
+        self.publisher = AMQPPublisher(rabbitmq_url)
     
-    def start_consumer(self, queue: str, callback):
-        """Start consuming messages from queue"""
-        if not self.channel:
-            print("RabbitMQ not connected - cannot start consumer")
-            return
-        
-        def wrapper(ch, method, properties, body):
-            try:
-                message = json.loads(body.decode())
-                callback(message)
-                ch.basic_ack(delivery_tag=method.delivery_tag)
-            except Exception as e:
-                print(f"Error processing message: {e}")
-                ch.basic_nack(delivery_tag=method.delivery_tag, requeue=False)
-        
-        self.channel.basic_consume(queue=queue, on_message_callback=wrapper)
-        print(f"Started consuming from {queue}")
+    async def publish_message(self, routing_key: str, message: Dict[str, Any], confirm: bool = False) -> bool:
+        """Publish message to RabbitMQ without blocking the event loop
         
-        # Start consuming in a separate thread
-        def consume():
-            self.channel.start_consuming()
-        
-        consumer_thread = threading.Thread(target=consume)
-        consumer_thread.daemon = True
-        consumer_thread.start()
+        Returns once the message is buffered, or with ``confirm`` once the
+        broker has confirmed it.
+        """
+        return await self.publisher.publish(routing_key, message, confirm=confirm)
     
-    def close_connection(self):
-        """Close RabbitMQ connection"""
-        if self.connection and not self.connection.is_closed:
-            self.connection.close()
+    async def close_publisher(self):
+        """Flush buffered messages and close the publishing connection"""
+        await self.publisher.close()
 
 class NotificationService:
     """Service for sending notifications"""
@@ -342,24 +572,22 @@ wms_service = WMSService()
 message_broker = MessageBroker()
 notification_service = NotificationService()
 
-# Message handlers
-def handle_order_processed(message: Dict[str, Any]):
-    """Handle order processed event"""
-    print(f"Order processed: {message}")
-    # Send notification to client
-    asyncio.create_task(
-        notification_service.send_email(
-            "client@example.com",
-            "Order Processed",
-            f"Your order {message['order_id']} is being processed."
-        )
-    )
+async def start_connection_pools():
+    """Open the shared upstream connection pools"""
+    await cms_service.pool.start()
+    await ros_service.pool.start()
+    await wms_service.pool.start()
 
-def handle_delivery_updated(message: Dict[str, Any]):
-    """Handle delivery update event"""
-    print(f"Delivery updated: {message}")
-    # Send real-time update to client
+async def close_connection_pools():
+    """Close the shared upstream connection pools"""
+    await cms_service.pool.close()
+    await ros_service.pool.close()
+    await wms_service.pool.close()
 
-# Start message consumers
-message_broker.start_consumer('order.processed', handle_order_processed)
-message_broker.start_consumer('delivery.updated', handle_delivery_updated)
\ No newline at end of file
+def connection_pool_stats() -> Dict[str, Any]:
+    """Statistics for every shared upstream connection pool"""
+    return {
+        "cms": cms_service.pool.stats(),
+        "ros": ros_service.pool.stats(),
+        "wms": wms_service.pool.stats()
+    }
\ No newline at end of file
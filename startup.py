@@ -0,0 +1,55 @@
+# startup.py - Startup phase timing checked against a time budget
+import logging
+import os
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+class StartupProfiler:
+    """Records how long each startup phase takes and compares the total with a budget
+
+    The clock starts when this module is first imported, which main.py does
+    before anything else, so the "import" phase covers loading the app.
+    """
+
+    def __init__(self, budget_ms: float = float(os.getenv("STARTUP_BUDGET_MS", "3000"))):
+        self.budget_ms = budget_ms
+        self.started = time.perf_counter()
+        self.finished: Optional[float] = None
+        self.phases: List[Tuple[str, float]] = []
+
+    def record(self, name: str, started: float):
+        self.phases.append((name, (time.perf_counter() - started) * 1000))
+
+    @contextmanager
+    def phase(self, name: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, started)
+
+    def finish(self) -> Dict[str, Any]:
+        """Close the measurement and log the report, warning when over budget"""
+        self.finished = time.perf_counter()
+        report = self.report()
+        phases = ", ".join(f"{name} {ms:.0f}ms" for name, ms in self.phases)
+        if report["within_budget"]:
+            logger.info(f"Startup took {report['total_ms']:.0f}ms of {self.budget_ms:.0f}ms budget ({phases})")
+        else:
+            logger.warning(f"Startup took {report['total_ms']:.0f}ms, over the {self.budget_ms:.0f}ms budget ({phases})")
+        return report
+
+    def report(self) -> Dict[str, Any]:
+        total_ms = ((self.finished or time.perf_counter()) - self.started) * 1000
+        return {
+            "total_ms": round(total_ms, 1),
+            "budget_ms": self.budget_ms,
+            "within_budget": total_ms <= self.budget_ms,
+            "complete": self.finished is not None,
+            "phases": {name: round(ms, 1) for name, ms in self.phases}
+        }
+
+startup_profiler = StartupProfiler()
@@ -0,0 +1,55 @@
+# test_analytics.py - Daily delivery rollups and histogram percentiles
+import numpy as np
+
+from analytics import ALL_DRIVERS, LATENCY_BINS, histogram_percentiles, summarize_day
+
+def extract(rows):
+    """Columns of extract_day() from (driver_id, delivered, latency_s) rows"""
+    return {
+        "driver_id": np.array([row[0] for row in rows], dtype=np.int64),
+        "delivered": np.array([row[1] for row in rows], dtype=bool),
+        "latency_s": np.array([row[2] for row in rows], dtype=np.float64)
+    }
+
+def histogram(row):
+    return np.frombuffer(row["latency_histogram"], dtype=np.int32)
+
+def test_summarize_day_per_driver_and_total():
+    rows = summarize_day(extract([
+        (7, True, 120.0), (7, True, 3600.0), (7, False, 50.0),
+        (3, True, 600.0), (3, False, 10.0), (3, False, 20.0)
+    ]))
+    by_driver = {row["driver_id"]: row for row in rows}
+    assert [row["driver_id"] for row in rows] == [3, 7, ALL_DRIVERS]
+
+    assert (by_driver[7]["deliveries"], by_driver[7]["failures"]) == (2, 1)
+    assert (by_driver[3]["deliveries"], by_driver[3]["failures"]) == (1, 2)
+    assert by_driver[7]["latency_sum_s"] == 3720.0
+    # Failed updates count as failures but never as latency
+    assert by_driver[3]["latency_sum_s"] == 600.0
+
+    total = by_driver[ALL_DRIVERS]
+    assert (total["deliveries"], total["failures"], total["latency_sum_s"]) == (3, 3, 4320.0)
+    assert len(histogram(total)) == LATENCY_BINS
+    assert histogram(by_driver[7]).sum() == 2
+    assert np.array_equal(histogram(total), histogram(by_driver[3]) + histogram(by_driver[7]))
+
+def test_summarize_day_without_updates():
+    assert summarize_day(extract([])) == []
+
+def test_histogram_percentiles_within_bin_width():
+    latencies = [90.0] * 50 + [1800.0] * 40 + [86400.0] * 10
+    row = summarize_day(extract([(1, True, latency) for latency in latencies]))[0]
+    p50, p90, p99 = histogram_percentiles(histogram(row), [0.5, 0.9, 0.99])[0]
+    # Each bin is ~19% wide and reports its geometric middle
+    assert abs(p50 / 90 - 1) < 0.1
+    assert abs(p90 / 1800 - 1) < 0.1
+    assert abs(p99 / 86400 - 1) < 0.1
+
+def test_histogram_percentiles_of_a_stack():
+    empty = np.zeros(LATENCY_BINS, dtype=np.int32)
+    late = histogram(summarize_day(extract([(1, True, 40 * 86400.0)]))[0])
+    result = histogram_percentiles(np.stack([empty, late]), [0.5])
+    assert np.isnan(result[0, 0])
+    # Beyond the last edge, the overflow bin reports its lower bound of 30 days
+    assert result[1, 0] == 30 * 86400
@@ -0,0 +1,19 @@
+# test_api.py - API helpers that run without a database
+from datetime import datetime
+
+import pytest
+from fastapi import HTTPException
+
+from main import decode_order_cursor, encode_order_cursor
+
+def test_order_cursor_round_trip():
+    created_at = datetime(2024, 3, 1, 12, 30, 5, 123456)
+    cursor = encode_order_cursor(created_at, "ORD-42")
+    assert "=" not in cursor
+    assert decode_order_cursor(cursor) == (created_at, "ORD-42")
+
+@pytest.mark.parametrize("cursor", ["", "not a cursor", "bm90IGpzb24", "WzEsMiwzXQ", "WyJub3QgYSBkYXRlIiwgIngiXQ"])
+def test_invalid_order_cursor_is_rejected(cursor):
+    with pytest.raises(HTTPException) as error:
+        decode_order_cursor(cursor)
+    assert error.value.status_code == 400
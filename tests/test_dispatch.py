@@ -0,0 +1,47 @@
+# test_dispatch.py - Nearest-driver lookups on the dispatch grid
+import random
+
+import pytest
+
+from dispatch import DriverGrid
+from geo import haversine_km
+
+def brute_force(drivers, latitude, longitude, k, max_km):
+    distances = sorted(
+        (haversine_km(latitude, longitude, driver_latitude, driver_longitude), driver_id)
+        for driver_id, (driver_latitude, driver_longitude) in drivers.items()
+    )
+    return [pair for pair in distances if pair[0] <= max_km][:k]
+
+@pytest.mark.parametrize("k,max_km", [(1, 30), (5, 30), (20, 2), (3, 500)])
+def test_nearest_matches_brute_force(k, max_km):
+    rng = random.Random(k)
+    grid = DriverGrid(cell_degrees=0.01)
+    drivers = {}
+    for driver_id in range(300):
+        # Clustered around Colombo, with a few far away to exercise the ring bounds
+        spread = 0.2 if driver_id % 10 else 2.0
+        drivers[driver_id] = (6.9 + rng.uniform(-spread, spread), 79.9 + rng.uniform(-spread, spread))
+        grid.update(driver_id, *drivers[driver_id])
+    for _ in range(50):
+        latitude, longitude = 6.9 + rng.uniform(-1, 1), 79.9 + rng.uniform(-1, 1)
+        found = grid.nearest(latitude, longitude, k=k, max_km=max_km)
+        expected = brute_force(drivers, latitude, longitude, k, max_km)
+        assert [driver_id for _, driver_id in found] == [driver_id for _, driver_id in expected]
+        assert [distance for distance, _ in found] == pytest.approx([distance for distance, _ in expected])
+
+def test_update_moves_and_remove_forgets_a_driver():
+    grid = DriverGrid(cell_degrees=0.01)
+    assert grid.nearest(6.9, 79.9) == []
+    grid.update(1, 6.90, 79.90)
+    grid.update(2, 6.95, 79.95)
+    assert grid.nearest(6.90, 79.90)[0][1] == 1
+
+    grid.update(1, 7.20, 80.20)
+    assert grid.position(1) == (7.20, 80.20)
+    assert grid.nearest(6.90, 79.90)[0][1] == 2
+
+    grid.remove(2)
+    grid.remove(2)
+    assert 2 not in grid and len(grid) == 1
+    assert grid.nearest(6.90, 79.90, k=5, max_km=10) == []
@@ -0,0 +1,80 @@
+# test_geocoding.py - Address normalization and the in-process geocoder cache
+import asyncio
+
+import pytest
+
+import geocoding
+from geocoding import Geocoder, OfflineBackend, normalize_address
+
+@pytest.mark.parametrize("address,expected", [
+    ("No. 12, Galle Rd., COLOMBO 03, Sri Lanka", "12 galle road colombo 03"),
+    ("12  galle   road,colombo 03", "12 galle road colombo 03"),
+    ("Apt 4, 7 Temple St, Kandy", "apartment 4 7 temple street kandy"),
+    ("ＫＡＮＤＹ", "kandy"),
+    ("Sri Lanka Road, Kandy", "sri lanka road kandy"),
+])
+def test_normalize_address(address, expected):
+    assert normalize_address(address) == expected
+
+def test_offline_backend_is_stable_and_near_the_place():
+    backend = OfflineBackend(spread_km=2)
+
+    async def run():
+        return (
+            await backend.geocode("12 galle road colombo 03"),
+            await backend.geocode("12 galle road colombo 03"),
+            await backend.geocode("somewhere unknown")
+        )
+
+    first, second, unknown = asyncio.run(run())
+    assert first == second
+    assert abs(first[0] - 6.9271) <= 2 / 111.2 and abs(first[1] - 79.8612) <= 2 / 111.2
+    assert unknown is None
+
+class CountingBackend:
+    name = "counting"
+
+    def __init__(self):
+        self.calls = []
+
+    async def geocode(self, address):
+        self.calls.append(address)
+        await asyncio.sleep(0.01)
+        return (1.0, 2.0) if "known" in address else None
+
+    async def close(self):
+        pass
+
+@pytest.fixture
+def no_database(monkeypatch):
+    """Geocoder whose geocode_cache reads find nothing; writes fail and are only logged"""
+    async def load(self, keys):
+        return {}
+    monkeypatch.setattr(Geocoder, "_load", load)
+    monkeypatch.setattr(geocoding, "AsyncSessionLocal", None)
+
+def test_equivalent_addresses_are_looked_up_once(no_database):
+    backend = CountingBackend()
+    geocoder = Geocoder(backend)
+
+    async def run():
+        first, second = await asyncio.gather(
+            geocoder.geocode_many(["Known St, Colombo", "known street colombo", "Nowhere"]),
+            geocoder.geocode_many(["KNOWN ST., COLOMBO, Sri Lanka", "6.9, 79.85"])
+        )
+        third = await geocoder.geocode_many(["known st colombo", "nowhere"])
+        return first, second, third
+
+    first, second, third = asyncio.run(run())
+    assert sorted(backend.calls) == ["known street colombo", "nowhere"]
+    assert first == {"Known St, Colombo": (1.0, 2.0), "known street colombo": (1.0, 2.0), "Nowhere": None}
+    assert second == {"KNOWN ST., COLOMBO, Sri Lanka": (1.0, 2.0), "6.9, 79.85": (6.9, 79.85)}
+    assert third == {"known st colombo": (1.0, 2.0), "nowhere": None}
+    assert geocoder.stats()["hits"] == 2
+
+def test_without_a_backend_only_literal_coordinates_resolve(monkeypatch):
+    monkeypatch.delenv("GEOCODER", raising=False)
+    geocoder = Geocoder()
+    assert geocoder.backend is None
+    assert asyncio.run(geocoder.geocode_many(["12 Galle Rd, Colombo", "6.9,79.85"])) == {"6.9,79.85": (6.9, 79.85)}
+    assert geocoder.stats()["backend"] is None
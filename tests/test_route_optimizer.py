@@ -0,0 +1,60 @@
+# test_route_optimizer.py - Local search moves of the in-process route optimizer
+import numpy as np
+import pytest
+
+from route_optimizer import RouteProblem
+
+def line_problem(positions, start_minute=9 * 60, stops=None):
+    """Start at positions[0] and stops at the rest, on a straight road at 1 km a minute"""
+    positions = np.asarray(positions, dtype=float)
+    km = np.abs(positions[:, None] - positions[None, :])
+    stops = stops or [{"order_id": f"O{i}", "time_window": "00:00-23:59"} for i in range(1, len(positions))]
+    return RouteProblem(km, km.copy(), stops, start_minute)
+
+def tour_km(problem, tour):
+    return float(problem.distance[tour[:-1], tour[1:]].sum())
+
+def test_apply_2opt_reverses_the_segment():
+    tour = np.arange(7)
+    assert RouteProblem.apply(tour, "2opt", 1, 4, 0).tolist() == [0, 1, 4, 3, 2, 5, 6]
+
+@pytest.mark.parametrize("i,j,expected", [
+    (1, 4, [0, 3, 4, 1, 2, 5, 6]),  # Segment moved forward, after tour[4]
+    (4, 1, [0, 1, 4, 5, 2, 3, 6]),  # Segment moved back, after tour[1]
+])
+def test_apply_oropt_moves_the_segment(i, j, expected):
+    assert RouteProblem.apply(np.arange(7), "oropt", i, j, 2).tolist() == expected
+
+def test_candidate_move_deltas_match_applied_tours():
+    rng = np.random.default_rng(3)
+    problem = line_problem(rng.uniform(0, 50, 15))
+    tour = np.concatenate(([0], rng.permutation(np.arange(1, 15)), [15]))
+    moves = problem.candidate_moves(tour)
+    assert moves
+    for delta, kind, i, j, length in moves:
+        moved = RouteProblem.apply(tour, kind, i, j, length)
+        assert sorted(moved.tolist()) == list(range(16))
+        assert moved[0] == 0 and moved[-1] == 15
+        assert tour_km(problem, moved) - tour_km(problem, tour) == pytest.approx(delta)
+
+def test_improve_finds_the_straight_run():
+    rng = np.random.default_rng(5)
+    positions = np.concatenate(([0.0], rng.permutation(np.arange(1.0, 21.0))))
+    problem = line_problem(positions)
+    start = np.concatenate(([0], rng.permutation(np.arange(1, 21)), [21]))
+    improved = problem.improve(start, time_budget=5)
+    assert tour_km(problem, improved) == pytest.approx(20.0)
+    assert problem.schedule(improved.tolist())[0] <= problem.schedule(start.tolist())[0]
+
+def test_improve_trades_distance_for_a_closing_window():
+    # Serving the near stop first reaches the far one 29 minutes after it closes,
+    # which costs more than the 9 km detour of serving it first
+    stops = [
+        {"order_id": "near", "time_window": "09:00-18:00", "service_minutes": 30},
+        {"order_id": "far", "time_window": "09:00-09:11"}
+    ]
+    problem = line_problem([0.0, 1.0, 10.0], stops=stops)
+    improved = problem.improve(np.array([0, 1, 2, 3]), time_budget=5)
+    assert improved.tolist() == [0, 2, 1, 3]
+    cost, arrivals = problem.schedule(improved.tolist())
+    assert arrivals[1] == 9 * 60 + 10
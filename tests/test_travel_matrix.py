@@ -0,0 +1,77 @@
+# test_travel_matrix.py - Geocell travel time cache and per-driver travel matrices
+import numpy as np
+import pytest
+
+from geo import geohash_cells, geohash_centers
+from travel_matrix import HaversineBackend, TravelMatrix, TravelTimes
+
+def random_points(count, seed):
+    rng = np.random.default_rng(seed)
+    return 6.9 + rng.uniform(-0.2, 0.2, count), 79.9 + rng.uniform(-0.2, 0.2, count)
+
+def snapped(latitudes, longitudes, precision):
+    return geohash_centers(geohash_cells(latitudes, longitudes, precision), precision)
+
+def test_pairs_are_computed_between_cell_centres_and_cached():
+    times = TravelTimes(precision=7)
+    lat1, lon1 = random_points(200, 1)
+    lat2, lon2 = random_points(200, 2)
+    km, minutes = times.pairs(lat1, lon1, lat2, lon2)
+
+    expected_km, expected_minutes = HaversineBackend().compute(*snapped(lat1, lon1, 7), *snapped(lat2, lon2, 7))
+    assert km == pytest.approx(expected_km, rel=1e-6)
+    assert minutes == pytest.approx(expected_minutes, rel=1e-6)
+    assert np.all(np.diff(times._keys) > 0)
+
+    computed = times.computed
+    again_km, _ = times.pairs(lat1[::-1], lon1[::-1], lat2[::-1], lon2[::-1])
+    assert times.computed == computed
+    assert np.array_equal(again_km, km[::-1])
+
+def test_merge_keeps_keys_sorted_across_lookups():
+    times = TravelTimes(precision=7)
+    for seed in range(5):
+        latitudes, longitudes = random_points(30, seed)
+        times.matrix(latitudes, longitudes)
+    assert np.all(np.diff(times._keys) > 0)
+    assert len(times._keys) == len(times._km) == len(times._minutes) == times.computed
+
+def test_matrix_agrees_with_pairs():
+    times = TravelTimes(precision=7)
+    latitudes, longitudes = random_points(40, 3)
+    km, minutes = times.matrix(latitudes, longitudes)
+    pair_km, pair_minutes = TravelTimes(precision=7).pairs(latitudes[:, None], longitudes[:, None], latitudes, longitudes)
+    assert np.array_equal(km, pair_km)
+    assert np.array_equal(minutes, pair_minutes)
+    assert np.all(np.diag(km) == 0)
+
+def test_cache_is_cleared_at_max_entries():
+    times = TravelTimes(precision=7, max_entries=500)
+    latitudes, longitudes = random_points(20, 4)
+    times.matrix(latitudes, longitudes)
+    assert times.resets == 0
+    latitudes, longitudes = random_points(20, 5)
+    times.matrix(latitudes, longitudes)
+    assert times.resets == 1
+    assert len(times._keys) == 400
+
+def test_travel_matrix_add_matches_a_full_matrix():
+    times = TravelTimes(precision=7)
+    latitudes, longitudes = random_points(100, 6)
+    points = [(f"O{i}", latitude, longitude) for i, (latitude, longitude) in enumerate(zip(latitudes, longitudes))]
+    day = TravelMatrix(times, capacity=8)
+    assert day.add(points[:10]) == 10
+    # Repeated keys, already present or within one call, are skipped
+    assert day.add(points[5:60] + points[50:60]) == 50
+    assert day.add(points[60:]) == 40
+    assert len(day) == 100 and "O99" in day
+    assert day.stats()["capacity"] == 128
+
+    origin = (6.95, 79.85)
+    keys = [point[0] for point in points][::-1]
+    km, minutes = day.with_origin(origin, keys)
+    full_km, full_minutes = times.matrix(
+        np.r_[origin[0], latitudes[::-1]], np.r_[origin[1], longitudes[::-1]]
+    )
+    assert km == pytest.approx(full_km, rel=1e-6)
+    assert minutes == pytest.approx(full_minutes, rel=1e-6)
@@ -0,0 +1,68 @@
+# test_wms_pool.py - WMS connection pool against the local stub server
+import asyncio
+import socket
+
+import pytest
+
+from wms_pool import WMSConnectionPool
+from wms_stub import WMSStubServer
+
+async def started_stub(latency: float = 0.0) -> WMSStubServer:
+    stub = WMSStubServer(port=0, latency=latency)
+    await stub.start()
+    return stub
+
+def test_concurrent_requests_get_their_own_responses():
+    async def run():
+        # Jittered latency makes the stub answer out of order on each connection
+        stub = await started_stub(latency=0.02)
+        pool = WMSConnectionPool(stub.host, stub.port, size=2, health_check_interval=0)
+        try:
+            order_ids = [f"ORD{i:03d}" for i in range(50)]
+            responses = await asyncio.gather(*(
+                pool.request({"action": "ADD_PACKAGE", "order_id": order_id}) for order_id in order_ids
+            ))
+            assert [response["package_id"] for response in responses] == [f"WMS_{order_id}" for order_id in order_ids]
+            assert stub.connections_total == 2
+            stats = pool.stats()
+            assert stats["requests_total"] == 50
+            assert stats["in_flight"] == 0
+        finally:
+            await pool.close()
+            await stub.close()
+
+    asyncio.run(run())
+
+def test_batch_and_follow_up_actions():
+    async def run():
+        stub = await started_stub()
+        pool = WMSConnectionPool(stub.host, stub.port, size=1, health_check_interval=0)
+        try:
+            response = await pool.request({"action": "ADD_PACKAGES", "packages": [{"order_id": "A"}, {"order_id": "B"}]})
+            assert [package["order_id"] for package in response["packages"]] == ["A", "B"]
+            assert (await pool.request({"action": "UPDATE_STATUS", "order_id": "A", "status": "loaded"}))["updated"]
+            assert stub.packages["A"]["status"] == "loaded"
+            assert (await pool.request({"action": "REMOVE_PACKAGE", "order_id": "B"}))["removed"]
+            assert "error" in await pool.request({"action": "SHRED"})
+            assert "correlation_id" not in response
+        finally:
+            await pool.close()
+            await stub.close()
+
+    asyncio.run(run())
+
+def test_unreachable_server_raises_connection_error():
+    # A port that was free a moment ago, so nothing is listening on it
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        port = probe.getsockname()[1]
+
+    async def run():
+        pool = WMSConnectionPool("127.0.0.1", port, size=1, connect_timeout=1, health_check_interval=0)
+        try:
+            with pytest.raises(ConnectionError):
+                await pool.request({"action": "PING"})
+        finally:
+            await pool.close()
+
+    asyncio.run(run())
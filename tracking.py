@@ -0,0 +1,309 @@
+# tracking.py - Driver GPS ingestion: in-memory buffer, bulk writes and latest positions
+import asyncio
+import json
+import os
+import re
+import time
+from collections import deque
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import func, select, text
+
+from database import AsyncSessionLocal
+from metrics import percentile
+from models import DriverLocation
+from redis_client import get_redis
+from schemas import LocationPoint
+
+# Redis hash of driver id -> latest position JSON, shared by all API workers, and the hash of
+# driver id -> that position's recorded_at in epoch seconds that guards it
+LATEST_POSITIONS_KEY = "drivers:positions"
+LATEST_RECORDED_AT_KEY = "drivers:positions:recorded_at"
+# ARGV is (driver id, recorded_at epoch seconds, position JSON) triples; a position only
+# replaces an older one, so a worker flushing late cannot overwrite a newer point
+PUBLISH_IF_NEWER = """
+for i = 1, #ARGV, 3 do
+    local current = redis.call('HGET', KEYS[2], ARGV[i])
+    if not current or tonumber(current) < tonumber(ARGV[i + 1]) then
+        redis.call('HSET', KEYS[2], ARGV[i], ARGV[i + 1])
+        redis.call('HSET', KEYS[1], ARGV[i], ARGV[i + 2])
+    end
+end
+return 0
+"""
+# pg_try_advisory_xact_lock key so one worker at a time deletes expired points
+TRACKING_LOCK_KEY = 0x747261
+
+# Columns of a buffered point, in driver_locations order
+Row = Tuple[int, datetime, float, float, Optional[float], Optional[float], Optional[int]]
+
+INSERT_POINTS = text("""
+    INSERT INTO driver_locations (driver_id, recorded_at, latitude, longitude, accuracy_m, speed_mps, heading)
+    SELECT * FROM unnest(
+        CAST(:driver_id AS integer[]), CAST(:recorded_at AS timestamp[]),
+        CAST(:latitude AS real[]), CAST(:longitude AS real[]),
+        CAST(:accuracy_m AS real[]), CAST(:speed_mps AS real[]), CAST(:heading AS smallint[])
+    )
+    ON CONFLICT DO NOTHING
+""")
+
+def to_utc(value: datetime) -> datetime:
+    """Naive UTC, the convention of every DateTime column"""
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+def parse_location(location: Optional[str]) -> Optional[Tuple[float, float]]:
+    """(latitude, longitude) from a free-text "lat,lon" location, if it is one"""
+    match = re.fullmatch(r"\s*(-?\d+(?:\.\d+)?)\s*,\s*(-?\d+(?:\.\d+)?)\s*", location or "")
+    if not match:
+        return None
+    latitude, longitude = float(match.group(1)), float(match.group(2))
+    if -90 <= latitude <= 90 and -180 <= longitude <= 180:
+        return latitude, longitude
+    return None
+
+def position_dict(driver_id: int, row: Row) -> Dict[str, Any]:
+    return {
+        "driver_id": driver_id,
+        "latitude": row[2],
+        "longitude": row[3],
+        "recorded_at": row[1].isoformat(),
+        "accuracy_m": row[4],
+        "speed_mps": row[5],
+        "heading": row[6]
+    }
+
+class LocationIngestor:
+    """Buffers GPS points in memory and writes them to driver_locations in bulk
+
+    Points are written once batch_size have arrived or every flush_interval
+    seconds, with one INSERT ... SELECT FROM unnest() per batch. Duplicate
+    (driver, timestamp) points are ignored. When the database falls behind,
+    the buffer is capped at max_buffer points and add() refuses the excess.
+    The newest point per driver is kept in process and in a Redis hash.
+    Timestamps more than max_clock_skew ahead of the server clock are
+    clamped to it, so one bad device clock cannot pin a driver's position.
+    """
+
+    def __init__(
+        self,
+        batch_size: int = int(os.getenv("LOCATION_BATCH_SIZE", "5000")),
+        flush_interval: float = float(os.getenv("LOCATION_FLUSH_INTERVAL", "1.0")),
+        max_buffer: int = int(os.getenv("LOCATION_MAX_BUFFER", "200000")),
+        retention: timedelta = timedelta(days=float(os.getenv("LOCATION_RETENTION_DAYS", "30"))),
+        max_clock_skew: timedelta = timedelta(seconds=float(os.getenv("LOCATION_MAX_CLOCK_SKEW", "60")))
+    ):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_buffer = max_buffer
+        self.retention = retention
+        self.max_clock_skew = max_clock_skew
+        self._buffer: List[Row] = []
+        self._latest: Dict[int, Row] = {}
+        self._changed: Dict[int, Row] = {}
+        self._wakeup: Optional[asyncio.Event] = None
+        self._flusher: Optional[asyncio.Task] = None
+        self._flush_times = deque(maxlen=1024)
+        self.received = 0
+        self.written = 0
+        self.dropped = 0
+        self.clamped = 0
+        self.failures = 0
+
+    def start(self):
+        if self._flusher is None:
+            self._wakeup = asyncio.Event()
+            self._flusher = asyncio.create_task(self._flush_loop())
+
+    async def close(self):
+        """Stop the flusher and write what is still buffered"""
+        if self._flusher is not None:
+            self._flusher.cancel()
+            try:
+                await self._flusher
+            except asyncio.CancelledError:
+                pass
+            self._flusher = None
+        await self.flush()
+
+    def add(self, driver_id: int, points: Iterable[LocationPoint]) -> int:
+        """Buffer a driver's points; returns how many were accepted"""
+        now = datetime.utcnow()
+        accepted = 0
+        for point in points:
+            self.received += 1
+            if len(self._buffer) >= self.max_buffer:
+                self.dropped += 1
+                continue
+            recorded_at = to_utc(point.recorded_at) if point.recorded_at else now
+            if recorded_at > now + self.max_clock_skew:
+                recorded_at = now
+                self.clamped += 1
+            row = (
+                driver_id,
+                recorded_at,
+                point.latitude,
+                point.longitude,
+                point.accuracy_m,
+                point.speed_mps,
+                point.heading
+            )
+            self._buffer.append(row)
+            accepted += 1
+            latest = self._latest.get(driver_id)
+            if latest is None or row[1] >= latest[1]:
+                self._latest[driver_id] = row
+                self._changed[driver_id] = row
+        if len(self._buffer) >= self.batch_size and self._wakeup is not None:
+            self._wakeup.set()
+        return accepted
+
+    async def flush(self):
+        """Write buffered points, keeping them for the next flush if the write fails"""
+        rows, self._buffer = self._buffer, []
+        changed, self._changed = self._changed, {}
+        started = time.perf_counter()
+        for offset in range(0, len(rows), self.batch_size):
+            batch = rows[offset:offset + self.batch_size]
+            try:
+                await self._write(batch)
+                self.written += len(batch)
+            except Exception as e:
+                self.failures += 1
+                print(f"Location write failed: {e!r}")
+                # Retry with the next flush, newest points first to go if the buffer overflows
+                retry = rows[offset:][:max(self.max_buffer - len(self._buffer), 0)]
+                self.dropped += len(rows) - offset - len(retry)
+                self._buffer[:0] = retry
+                break
+        if rows:
+            self._flush_times.append((time.perf_counter() - started) * 1000)
+        await self._publish_latest(changed)
+
+    async def _write(self, rows: List[Row]):
+        columns = list(zip(*rows))
+        async with AsyncSessionLocal() as db:
+            await db.execute(INSERT_POINTS, {
+                "driver_id": list(columns[0]),
+                "recorded_at": list(columns[1]),
+                "latitude": list(columns[2]),
+                "longitude": list(columns[3]),
+                "accuracy_m": list(columns[4]),
+                "speed_mps": list(columns[5]),
+                "heading": list(columns[6])
+            })
+            await db.commit()
+
+    async def _publish_latest(self, changed: Dict[int, Row]):
+        client = get_redis()
+        if client is None or not changed:
+            return
+        args = []
+        for driver_id, row in changed.items():
+            args += [str(driver_id), repr(row[1].replace(tzinfo=timezone.utc).timestamp()), json.dumps(position_dict(driver_id, row))]
+        try:
+            await client.register_script(PUBLISH_IF_NEWER)(keys=[LATEST_POSITIONS_KEY, LATEST_RECORDED_AT_KEY], args=args)
+        except Exception as e:
+            print(f"Latest position Redis error: {e}")
+
+    async def _flush_loop(self):
+        last_cleanup = time.monotonic()
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+            if time.monotonic() - last_cleanup > 3600:
+                await self._delete_expired()
+                last_cleanup = time.monotonic()
+
+    async def _delete_expired(self):
+        """Delete points older than the retention period, in chunks"""
+        cutoff = datetime.utcnow() - self.retention
+        try:
+            while True:
+                async with AsyncSessionLocal() as db:
+                    if not await db.scalar(select(func.pg_try_advisory_xact_lock(TRACKING_LOCK_KEY))):
+                        return  # Another worker is cleaning up
+                    result = await db.execute(text(
+                        "DELETE FROM driver_locations WHERE ctid IN "
+                        "(SELECT ctid FROM driver_locations WHERE recorded_at < :cutoff LIMIT 50000)"
+                    ), {"cutoff": cutoff})
+                    await db.commit()
+                if result.rowcount < 50000:
+                    return
+        except Exception as e:
+            print(f"Location cleanup failed: {e!r}")
+
+    async def get_latest(self, driver_id: int) -> Optional[Dict[str, Any]]:
+        """Newest known position of a driver
+
+        With Redis, the shared hash, unless this process holds a newer point
+        it has not published yet. Without it, this process's latest point,
+        which is only complete with a single worker. Then the database.
+        """
+        row = self._latest.get(driver_id)
+        local = position_dict(driver_id, row) if row is not None else None
+
+        client = get_redis()
+        if client is not None:
+            try:
+                data = await client.hget(LATEST_POSITIONS_KEY, str(driver_id))
+                if data is not None:
+                    position = json.loads(data)
+                    if local is None or datetime.fromisoformat(position["recorded_at"]) >= row[1]:
+                        return position
+            except Exception as e:
+                print(f"Latest position Redis error: {e}")
+        if local is not None:
+            return local
+
+        async with AsyncSessionLocal() as db:
+            result = await db.execute(
+                select(DriverLocation)
+                .where(DriverLocation.driver_id == driver_id)
+                .order_by(DriverLocation.recorded_at.desc())
+                .limit(1)
+            )
+            location = result.scalars().first()
+        if location is None:
+            return None
+        return position_dict(driver_id, (
+            # Stored as 4-byte reals; rounding drops float noise beyond their resolution
+            driver_id, location.recorded_at, round(location.latitude, 6), round(location.longitude, 6),
+            location.accuracy_m, location.speed_mps, location.heading
+        ))
+
+    async def get_all_latest(self) -> Dict[int, Dict[str, Any]]:
+        """Newest position of every driver seen by any worker (this process only without Redis)"""
+        positions = {driver_id: position_dict(driver_id, row) for driver_id, row in self._latest.items()}
+        client = get_redis()
+        if client is not None:
+            try:
+                for driver_id, data in (await client.hgetall(LATEST_POSITIONS_KEY)).items():
+                    position = json.loads(data)
+                    local = self._latest.get(int(driver_id))
+                    if local is None or datetime.fromisoformat(position["recorded_at"]) > local[1]:
+                        positions[int(driver_id)] = position
+            except Exception as e:
+                print(f"Latest position Redis error: {e}")
+        return positions
+
+    def stats(self):
+        return {
+            "received": self.received,
+            "written": self.written,
+            "dropped": self.dropped,
+            "clamped": self.clamped,
+            "buffered": len(self._buffer),
+            "write_failures": self.failures,
+            "drivers": len(self._latest),
+            "flush_p50_ms": round(percentile(self._flush_times, 0.50), 1),
+            "flush_p99_ms": round(percentile(self._flush_times, 0.99), 1)
+        }
+
+location_ingestor = LocationIngestor()
@@ -0,0 +1,233 @@
+# travel_matrix.py - Cached travel distances and times between points, keyed by geocell
+import os
+import threading
+from typing import Any, Dict, Hashable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from geo import geohash_cells, geohash_centers, haversine_km_array
+
+TRAVEL_MATRIX_PRECISION = int(os.getenv("TRAVEL_MATRIX_PRECISION", "7"))  # Geohash length; 7 is ~150m
+TRAVEL_MATRIX_CACHE_SIZE = int(os.getenv("TRAVEL_MATRIX_CACHE_SIZE", "5000000"))  # Cell pairs
+TRAVEL_ROAD_FACTOR = float(os.getenv("TRAVEL_ROAD_FACTOR", "1.3"))  # Road km per straight-line km
+TRAVEL_SPEED_KMH = float(os.getenv("TRAVEL_SPEED_KMH", "30"))
+
+class HaversineBackend:
+    """Straight-line distance times a road factor, at a constant speed"""
+
+    name = "haversine"
+
+    def __init__(self, road_factor: float = TRAVEL_ROAD_FACTOR, speed_kmh: float = TRAVEL_SPEED_KMH):
+        self.road_factor = road_factor
+        self.speed_kmh = speed_kmh
+
+    def compute(self, lat1, lon1, lat2, lon2) -> Tuple[np.ndarray, np.ndarray]:
+        """Road km and minutes between pairs of points, elementwise"""
+        km = haversine_km_array(lat1, lon1, lat2, lon2) * self.road_factor
+        return km, km / self.speed_kmh * 60
+
+class TravelTimes:
+    """Travel distance and time between geocells, computed by a backend and cached in sorted arrays
+
+    Points are snapped to the centre of their geohash cell, so entries are
+    shared by every pair of points in the same two cells. The cache is one
+    sorted int64 array of (origin cell, destination cell) keys with float32
+    km and minutes alongside: 16 bytes per pair, looked up with
+    searchsorted. Missing pairs are computed in one vectorized backend call
+    per lookup and merged in. The cache is cleared when it reaches
+    max_entries.
+    """
+
+    def __init__(
+        self,
+        backend=None,
+        precision: int = TRAVEL_MATRIX_PRECISION,
+        max_entries: int = TRAVEL_MATRIX_CACHE_SIZE
+    ):
+        self.backend = backend or HaversineBackend()
+        self.precision = precision
+        self.max_entries = max_entries
+        self._cell_ids: Dict[int, int] = {}  # Geohash cell -> dense id, so a pair fits in one int64 key
+        self._cells: List[int] = []
+        self._cell_array = np.empty(0, dtype=np.int64)
+        self._keys = np.empty(0, dtype=np.int64)
+        self._km = np.empty(0, dtype=np.float32)
+        self._minutes = np.empty(0, dtype=np.float32)
+        self._lock = threading.Lock()  # The route optimizer calls in from executor threads
+        self.hits = 0
+        self.computed = 0
+        self.resets = 0
+
+    def _ids(self, latitudes, longitudes) -> np.ndarray:
+        cells = geohash_cells(latitudes, longitudes, self.precision)
+        unique, inverse = np.unique(cells, return_inverse=True)
+        ids = np.empty(len(unique), dtype=np.int64)
+        for i, cell in enumerate(unique.tolist()):
+            cell_id = self._cell_ids.get(cell)
+            if cell_id is None:
+                cell_id = self._cell_ids[cell] = len(self._cells)
+                self._cells.append(cell)
+            ids[i] = cell_id
+        return ids[inverse].reshape(np.shape(cells))
+
+    def pairs(self, lat1, lon1, lat2, lon2) -> Tuple[np.ndarray, np.ndarray]:
+        """Road km and minutes from each point to the matching point, elementwise (arguments broadcast)"""
+        lat1, lon1, lat2, lon2 = np.broadcast_arrays(*(np.asarray(value, dtype=np.float64) for value in (lat1, lon1, lat2, lon2)))
+        with self._lock:
+            keys = (self._ids(lat1.ravel(), lon1.ravel()) << 31) | self._ids(lat2.ravel(), lon2.ravel())
+            km, minutes = self._lookup(keys)
+        return km.reshape(lat1.shape), minutes.reshape(lat1.shape)
+
+    def matrix(self, lat1, lon1, lat2=None, lon2=None) -> Tuple[np.ndarray, np.ndarray]:
+        """Road km and minutes from every origin to every destination (the origins themselves by default)"""
+        lat1, lon1 = np.asarray(lat1, dtype=np.float64), np.asarray(lon1, dtype=np.float64)
+        if lat2 is None:
+            lat2, lon2 = lat1, lon1
+        lat2, lon2 = np.asarray(lat2, dtype=np.float64), np.asarray(lon2, dtype=np.float64)
+        with self._lock:
+            origins, origin_index = np.unique(self._ids(lat1, lon1), return_inverse=True)
+            destinations, destination_index = np.unique(self._ids(lat2, lon2), return_inverse=True)
+            # One lookup per pair of distinct cells; the keys of the grid are already unique and sorted
+            km, minutes = self._lookup(((origins[:, None] << 31) | destinations[None, :]).ravel(), unique=True)
+        shape = (len(origins), len(destinations))
+        rows, columns = origin_index[:, None], destination_index[None, :]
+        return km.reshape(shape)[rows, columns], minutes.reshape(shape)[rows, columns]
+
+    def _lookup(self, keys: np.ndarray, unique: bool = False) -> Tuple[np.ndarray, np.ndarray]:
+        if unique:
+            inverse = None
+        else:
+            keys, inverse = np.unique(keys, return_inverse=True)
+        positions = np.searchsorted(self._keys, keys)
+        found = positions < len(self._keys)
+        found[found] = self._keys[positions[found]] == keys[found]
+        km = np.empty(len(keys), dtype=np.float64)
+        minutes = np.empty(len(keys), dtype=np.float64)
+        km[found] = self._km[positions[found]]
+        minutes[found] = self._minutes[positions[found]]
+        self.hits += int(found.sum())
+
+        missing = ~found
+        if missing.any():
+            if len(self._cell_array) != len(self._cells):
+                self._cell_array = np.array(self._cells, dtype=np.int64)
+            cells = self._cell_array
+            lat1, lon1 = geohash_centers(cells[keys[missing] >> 31], self.precision)
+            lat2, lon2 = geohash_centers(cells[keys[missing] & ((1 << 31) - 1)], self.precision)
+            computed_km, computed_minutes = self.backend.compute(lat1, lon1, lat2, lon2)
+            # Rounded to the stored precision so cold and cached answers agree
+            km[missing] = computed_km.astype(np.float32)
+            minutes[missing] = computed_minutes.astype(np.float32)
+            self.computed += int(missing.sum())
+            self._merge(keys[missing], positions[missing], km[missing], minutes[missing])
+        if inverse is None:
+            return km, minutes
+        return km[inverse], minutes[inverse]
+
+    def _merge(self, keys: np.ndarray, positions: np.ndarray, km: np.ndarray, minutes: np.ndarray):
+        if len(self._keys) + len(keys) > self.max_entries:
+            self._keys = np.empty(0, dtype=np.int64)
+            self._km = np.empty(0, dtype=np.float32)
+            self._minutes = np.empty(0, dtype=np.float32)
+            self.resets += 1
+            positions = np.zeros(len(keys), dtype=np.int64)
+        # keys are sorted and positions are their insertion points in the current arrays
+        self._keys = np.insert(self._keys, positions, keys)
+        self._km = np.insert(self._km, positions, km)
+        self._minutes = np.insert(self._minutes, positions, minutes)
+
+    def stats(self):
+        return {
+            "backend": self.backend.name,
+            "cells": len(self._cells),
+            "pairs": len(self._keys),
+            "bytes": self._keys.nbytes + self._km.nbytes + self._minutes.nbytes,
+            "hits": self.hits,
+            "computed": self.computed,
+            "resets": self.resets
+        }
+
+travel_times = TravelTimes()
+
+class TravelMatrix:
+    """Road km and minutes among a growing set of keyed points, such as one driver's stops for a day
+
+    add() computes only the rows and columns of new points. Storage is a
+    pair of float32 arrays whose capacity doubles as points are added.
+    """
+
+    def __init__(self, times: Optional[TravelTimes] = None, capacity: int = 64):
+        self.times = times or travel_times
+        self._index: Dict[Hashable, int] = {}
+        self._latitudes = np.empty(capacity)
+        self._longitudes = np.empty(capacity)
+        self._km = np.empty((capacity, capacity), dtype=np.float32)
+        self._minutes = np.empty((capacity, capacity), dtype=np.float32)
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._index
+
+    def _grow(self, size: int):
+        capacity = len(self._latitudes)
+        if size <= capacity:
+            return
+        while capacity < size:
+            capacity *= 2
+        n = len(self._index)
+        for name in ("_latitudes", "_longitudes"):
+            grown = np.empty(capacity)
+            grown[:n] = getattr(self, name)[:n]
+            setattr(self, name, grown)
+        for name in ("_km", "_minutes"):
+            grown = np.empty((capacity, capacity), dtype=np.float32)
+            grown[:n, :n] = getattr(self, name)[:n, :n]
+            setattr(self, name, grown)
+
+    def add(self, points: Sequence[Tuple[Hashable, float, float]]) -> int:
+        """Add (key, latitude, longitude) points not present yet; returns how many were added"""
+        with self._lock:
+            new, seen = [], set()
+            for key, latitude, longitude in points:
+                if key not in self._index and key not in seen:
+                    seen.add(key)
+                    new.append((key, latitude, longitude))
+            if not new:
+                return 0
+            n, m = len(self._index), len(new)
+            self._grow(n + m)
+            self._latitudes[n:n + m] = [point[1] for point in new]
+            self._longitudes[n:n + m] = [point[2] for point in new]
+            latitudes, longitudes = self._latitudes[:n + m], self._longitudes[:n + m]
+            # New rows against every point, then the old points' columns for the new ones
+            km, minutes = self.times.matrix(latitudes[n:], longitudes[n:], latitudes, longitudes)
+            self._km[n:n + m, :n + m], self._minutes[n:n + m, :n + m] = km, minutes
+            if n:
+                km, minutes = self.times.matrix(latitudes[:n], longitudes[:n], latitudes[n:], longitudes[n:])
+                self._km[:n, n:n + m], self._minutes[:n, n:n + m] = km, minutes
+            for offset, point in enumerate(new):
+                self._index[point[0]] = n + offset
+            return m
+
+    def with_origin(self, origin: Tuple[float, float], keys: Sequence[Hashable]) -> Tuple[np.ndarray, np.ndarray]:
+        """Road km and minutes among origin followed by the given points, which must have been added"""
+        with self._lock:
+            index = np.array([self._index[key] for key in keys], dtype=np.int64)
+            size = len(index) + 1
+            km = np.empty((size, size))
+            minutes = np.empty((size, size))
+            km[1:, 1:] = self._km[np.ix_(index, index)]
+            minutes[1:, 1:] = self._minutes[np.ix_(index, index)]
+            latitudes, longitudes = self._latitudes[index], self._longitudes[index]
+        from_origin = self.times.matrix([origin[0]], [origin[1]], latitudes, longitudes)
+        to_origin = self.times.matrix(latitudes, longitudes, [origin[0]], [origin[1]])
+        km[0, 1:], minutes[0, 1:] = from_origin[0][0], from_origin[1][0]
+        km[1:, 0], minutes[1:, 0] = to_origin[0][:, 0], to_origin[1][:, 0]
+        km[0, 0] = minutes[0, 0] = 0
+        return km, minutes
+
+    def stats(self) -> Dict[str, Any]:
+        return {"points": len(self._index), "capacity": len(self._latitudes), "bytes": self._km.nbytes + self._minutes.nbytes}
@@ -0,0 +1,227 @@
+# wms_pool.py - Persistent, multiplexed connections to the WMS TCP server
+import asyncio
+import json
+import os
+import time
+import uuid
+from typing import Dict, Any, List, Optional
+
+# Frames are newline-delimited JSON documents; json.dumps never emits raw newlines
+MAX_FRAME_SIZE = 1024 * 1024
+
+def encode_frame(message: Dict[str, Any]) -> bytes:
+    """Encode a message as a single newline-terminated frame"""
+    return json.dumps(message, separators=(",", ":")).encode() + b"\n"
+
+async def read_frame(reader: asyncio.StreamReader) -> Optional[Dict[str, Any]]:
+    """Read one frame, returning None when the peer closed the connection"""
+    line = await reader.readline()
+    if not line:
+        return None
+    return json.loads(line)
+
+class WMSConnection:
+    """Single persistent WMS socket shared by many in-flight requests"""
+
+    def __init__(self, host: str, port: int):
+        self.host = host
+        self.port = port
+        self._reader = None
+        self._writer = None
+        self._reader_task = None
+        self._write_lock = asyncio.Lock()
+        self.connect_lock = asyncio.Lock()
+        self._pending: Dict[str, asyncio.Future] = {}
+        self.last_failure = 0.0
+
+    @property
+    def connected(self) -> bool:
+        return self._writer is not None and not self._writer.is_closing()
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._pending)
+
+    async def connect(self, timeout: float):
+        """Open the socket and start dispatching responses"""
+        try:
+            self._reader, self._writer = await asyncio.wait_for(
+                asyncio.open_connection(self.host, self.port, limit=MAX_FRAME_SIZE),
+                timeout
+            )
+        except Exception:
+            self.last_failure = time.monotonic()
+            raise
+        self._reader_task = asyncio.create_task(self._read_loop())
+
+    async def _read_loop(self):
+        """Route each response frame to the request waiting on its correlation id"""
+        error: Exception = ConnectionError("WMS closed the connection")
+        try:
+            while True:
+                message = await read_frame(self._reader)
+                if message is None:
+                    break
+                future = self._pending.pop(message.pop("correlation_id", None), None)
+                if future is not None and not future.done():
+                    future.set_result(message)
+        except asyncio.CancelledError:
+            error = ConnectionError("WMS connection closed")
+        except Exception as e:
+            error = ConnectionError(f"WMS connection lost: {e}")
+        finally:
+            self.last_failure = time.monotonic()
+            self._fail_pending(error)
+            if self._writer is not None:
+                self._writer.close()
+
+    def _fail_pending(self, error: Exception):
+        pending, self._pending = self._pending, {}
+        for future in pending.values():
+            if not future.done():
+                future.set_exception(error)
+
+    async def request(self, message: Dict[str, Any], timeout: float) -> Dict[str, Any]:
+        """Send a message and wait for the response carrying the same correlation id"""
+        if not self.connected:
+            raise ConnectionError("WMS connection is not open")
+        correlation_id = uuid.uuid4().hex
+        future = asyncio.get_running_loop().create_future()
+        self._pending[correlation_id] = future
+        try:
+            async with self._write_lock:
+                self._writer.write(encode_frame({**message, "correlation_id": correlation_id}))
+                await self._writer.drain()
+            return await asyncio.wait_for(future, timeout)
+        finally:
+            self._pending.pop(correlation_id, None)
+
+    async def close(self):
+        """Close the socket and fail any request still waiting"""
+        if self._reader_task is not None:
+            self._reader_task.cancel()
+            try:
+                await self._reader_task
+            except asyncio.CancelledError:
+                pass
+            self._reader_task = None
+        if self._writer is not None:
+            self._writer.close()
+            try:
+                await self._writer.wait_closed()
+            except Exception:
+                pass
+        self._reader = None
+        self._writer = None
+
+class WMSConnectionPool:
+    """Fixed-size pool of multiplexed WMS connections with health checks"""
+
+    def __init__(
+        self,
+        host: str,
+        port: int,
+        size: int = int(os.getenv("WMS_POOL_SIZE", "4")),
+        request_timeout: float = float(os.getenv("WMS_REQUEST_TIMEOUT", "10")),
+        connect_timeout: float = float(os.getenv("WMS_CONNECT_TIMEOUT", "3")),
+        health_check_interval: float = float(os.getenv("WMS_HEALTH_CHECK_INTERVAL", "30")),
+        reconnect_backoff: float = float(os.getenv("WMS_RECONNECT_BACKOFF", "2"))
+    ):
+        self.host = host
+        self.port = port
+        self.request_timeout = request_timeout
+        self.connect_timeout = connect_timeout
+        self.health_check_interval = health_check_interval
+        self.reconnect_backoff = reconnect_backoff
+        self._connections: List[WMSConnection] = [WMSConnection(host, port) for _ in range(size)]
+        self._connect_lock = asyncio.Lock()
+        self._start_lock = asyncio.Lock()
+        self._health_task = None
+        self._started = False
+        self._requests_total = 0
+        self._connects_total = 0
+
+    async def start(self):
+        """Open every connection and start the health checker"""
+        await asyncio.gather(
+            *(self._reconnect(conn, force=True) for conn in self._connections),
+            return_exceptions=True
+        )
+        self._started = True
+        if self._health_task is None and self.health_check_interval > 0:
+            self._health_task = asyncio.create_task(self._health_check_loop())
+
+    async def close(self):
+        """Stop health checks and close every connection"""
+        if self._health_task is not None:
+            self._health_task.cancel()
+            try:
+                await self._health_task
+            except asyncio.CancelledError:
+                pass
+            self._health_task = None
+        self._started = False
+        await asyncio.gather(*(conn.close() for conn in self._connections))
+
+    async def _reconnect(self, conn: WMSConnection, force: bool = False):
+        async with conn.connect_lock:
+            if conn.connected:
+                return
+            if not force and time.monotonic() - conn.last_failure < self.reconnect_backoff:
+                raise ConnectionError("WMS reconnect backing off")
+            await conn.close()
+            await conn.connect(self.connect_timeout)
+            self._connects_total += 1
+
+    async def _acquire(self) -> WMSConnection:
+        """Pick the open connection with the fewest in-flight requests"""
+        open_connections = [conn for conn in self._connections if conn.connected]
+        if not open_connections:
+            async with self._connect_lock:
+                for conn in self._connections:
+                    try:
+                        await self._reconnect(conn)
+                    except Exception:
+                        continue
+                    open_connections.append(conn)
+                    break
+        if not open_connections:
+            raise ConnectionError(f"No WMS connection available at {self.host}:{self.port}")
+        return min(open_connections, key=lambda conn: conn.in_flight)
+
+    async def request(self, message: Dict[str, Any]) -> Dict[str, Any]:
+        """Send a message over the pool and return the decoded response"""
+        if not self._started:
+            async with self._start_lock:
+                if not self._started:
+                    await self.start()
+        conn = await self._acquire()
+        self._requests_total += 1
+        return await conn.request(message, self.request_timeout)
+
+    async def _health_check_loop(self):
+        while True:
+            await asyncio.sleep(self.health_check_interval)
+            for conn in self._connections:
+                if not conn.connected and time.monotonic() - conn.last_failure < self.reconnect_backoff:
+                    continue
+                try:
+                    if conn.connected:
+                        await conn.request({"action": "PING"}, self.request_timeout)
+                    else:
+                        await self._reconnect(conn)
+                except Exception as e:
+                    print(f"WMS health check failed: {e}")
+                    await conn.close()
+
+    def stats(self) -> Dict[str, Any]:
+        """Connection pool statistics for monitoring"""
+        open_connections = [conn for conn in self._connections if conn.connected]
+        return {
+            "size": len(self._connections),
+            "open": len(open_connections),
+            "idle": sum(1 for conn in open_connections if conn.in_flight == 0),
+            "in_flight": sum(conn.in_flight for conn in self._connections),
+            "requests_total": self._requests_total,
+            "connects_total": self._connects_total
+        }
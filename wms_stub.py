@@ -0,0 +1,103 @@
+# wms_stub.py - Local stand-in for the WMS TCP server (development and tests)
+import argparse
+import asyncio
+import random
+from datetime import datetime
+from typing import Dict, Any
+
+from wms_pool import encode_frame, read_frame
+
+class WMSStubServer:
+    """Speaks the framed WMS protocol and answers from an in-memory package store"""
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 8003, latency: float = 0.0):
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.packages: Dict[str, Dict[str, Any]] = {}
+        self.connections_total = 0
+        self._server = None
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle_client, self.host, self.port)
+        # Port 0 binds an ephemeral port; expose the real one to callers
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    async def close(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _handle_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.connections_total += 1
+        write_lock = asyncio.Lock()
+        tasks = set()
+
+        async def respond(message: Dict[str, Any]):
+            if self.latency:
+                # Jitter so responses come back out of order, like the real WMS
+                await asyncio.sleep(self.latency * random.uniform(0.5, 1.5))
+            response = self.handle(message)
+            response["correlation_id"] = message.get("correlation_id")
+            async with write_lock:
+                writer.write(encode_frame(response))
+                await writer.drain()
+
+        try:
+            while True:
+                message = await read_frame(reader)
+                if message is None:
+                    break
+                task = asyncio.create_task(respond(message))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+        except (ConnectionError, ValueError):
+            pass
+        finally:
+            for task in tasks:
+                task.cancel()
+            writer.close()
+
+    def handle(self, message: Dict[str, Any]) -> Dict[str, Any]:
+        """Build the response for a single WMS action"""
+        action = message.get("action")
+        if action == "PING":
+            return {"status": "ok", "timestamp": datetime.utcnow().isoformat()}
+        if action == "ADD_PACKAGE":
+            order_id = message["order_id"]
+            package = {
+                "package_id": f"WMS_{order_id}",
+                "warehouse_location": f"A-{len(self.packages) % 20 + 1:02d}-{len(self.packages) % 50 + 1:02d}",
+                "status": "received"
+            }
+            self.packages[order_id] = package
+            return dict(package)
+        if action == "ADD_PACKAGES":
+            return {"packages": [
+                {"order_id": package["order_id"], **self.handle({"action": "ADD_PACKAGE", **package})}
+                for package in message["packages"]
+            ]}
+        if action == "UPDATE_STATUS":
+            order_id = message["order_id"]
+            if order_id in self.packages:
+                self.packages[order_id]["status"] = message["status"]
+            return {"order_id": order_id, "status": message["status"], "updated": order_id in self.packages}
+        if action == "REMOVE_PACKAGE":
+            order_id = message["order_id"]
+            return {"order_id": order_id, "removed": self.packages.pop(order_id, None) is not None}
+        return {"error": f"Unknown action: {action}"}
+
+async def serve(host: str, port: int, latency: float):
+    server = WMSStubServer(host, port, latency)
+    await server.start()
+    print(f"WMS stub listening on {server.host}:{server.port}")
+    await asyncio.Event().wait()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a local stand-in WMS server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8003)
+    parser.add_argument("--latency", type=float, default=0.0, help="Simulated processing time in seconds")
+    args = parser.parse_args()
+    asyncio.run(serve(args.host, args.port, args.latency))
@@ -0,0 +1,211 @@
+# worker.py - Order processing worker (run separately from the API: python worker.py)
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import signal
+from datetime import timedelta
+from typing import Dict, List, Set
+
+import aio_pika
+from dotenv import load_dotenv
+
+from jobs import (
+    ORDER_QUEUE, DEAD_LETTER_QUEUE, RETRY_QUEUE_PREFIX,
+    job_message, batch_job_message, set_job_status, set_jobs_status, requeue_pending_jobs
+)
+from geocoding import geocoder
+from order_processing import process_order, process_order_batch, fail_order
+from services import rabbitmq_url, message_broker, start_connection_pools, close_connection_pools
+
+load_dotenv()
+
+EXCHANGE = "swiftlogistics"
+
+class OrderWorker:
+    """Consumes order.submitted jobs with bounded concurrency, retries and a dead-letter queue"""
+
+    def __init__(
+        self,
+        concurrency: int = int(os.getenv("ORDER_WORKER_CONCURRENCY", "10")),
+        max_attempts: int = int(os.getenv("ORDER_JOB_MAX_ATTEMPTS", "5")),
+        retry_base_delay: float = float(os.getenv("ORDER_JOB_RETRY_BASE_DELAY", "2")),
+        retry_max_delay: float = float(os.getenv("ORDER_JOB_RETRY_MAX_DELAY", "300")),
+        sweep_interval: float = float(os.getenv("ORDER_JOB_SWEEP_INTERVAL", "60")),
+        sweep_pending: bool = True
+    ):
+        self.concurrency = concurrency
+        self.max_attempts = max_attempts
+        self.retry_base_delay = retry_base_delay
+        self.retry_max_delay = retry_max_delay
+        self.sweep_interval = sweep_interval
+        self.sweep_pending = sweep_pending
+        self._stopping = asyncio.Event()
+        self._tasks: Set[asyncio.Task] = set()
+        self._retry_queues: Set[str] = set()
+        self._channel = None
+
+    def retry_delay(self, attempt: int) -> float:
+        """Exponential backoff before the given attempt is retried"""
+        return min(self.retry_base_delay * 2 ** (attempt - 1), self.retry_max_delay)
+
+    def stop(self):
+        self._stopping.set()
+
+    async def run(self):
+        connection = await aio_pika.connect_robust(rabbitmq_url())
+        await start_connection_pools()
+        try:
+            self._channel = await connection.channel(publisher_confirms=True)
+            await self._channel.set_qos(prefetch_count=self.concurrency)
+            exchange = await self._channel.declare_exchange(
+                EXCHANGE, aio_pika.ExchangeType.TOPIC, durable=True
+            )
+            queue = await self._channel.declare_queue(ORDER_QUEUE, durable=True)
+            await queue.bind(exchange, routing_key=ORDER_QUEUE)
+            dead_letters = await self._channel.declare_queue(DEAD_LETTER_QUEUE, durable=True)
+            await dead_letters.bind(exchange, routing_key=DEAD_LETTER_QUEUE)
+
+            consumer_tag = await queue.consume(self._on_message)
+            print(f"Worker consuming {ORDER_QUEUE} with concurrency {self.concurrency}")
+            sweeper = asyncio.create_task(self._sweep_loop()) if self.sweep_pending else None
+
+            await self._stopping.wait()
+
+            # Graceful drain: stop taking new jobs, let in-flight jobs finish
+            await queue.cancel(consumer_tag)
+            if sweeper is not None:
+                sweeper.cancel()
+            if self._tasks:
+                await asyncio.gather(*self._tasks, return_exceptions=True)
+        finally:
+            await message_broker.close_publisher()
+            await close_connection_pools()
+            await geocoder.close()
+            await connection.close()
+
+    async def _on_message(self, message: aio_pika.abc.AbstractIncomingMessage):
+        task = asyncio.create_task(self._handle(message))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _handle(self, message: aio_pika.abc.AbstractIncomingMessage):
+        try:
+            job = json.loads(message.body)
+            attempt = int(job.get("attempt", 1))
+            is_batch = "batch" in job
+            entries = job["batch"] if is_batch else [{"job_id": job.get("job_id"), "order_id": job["order_id"]}]
+            job_ids = [entry["job_id"] for entry in entries]
+            order_ids = [entry["order_id"] for entry in entries]
+        except (ValueError, KeyError, TypeError, AttributeError) as e:
+            print(f"Discarding malformed job: {e!r}")
+            await message.reject(requeue=False)
+            return
+
+        try:
+            await set_jobs_status(job_ids, "running", attempts=attempt)
+            if is_batch:
+                outcomes = await process_order_batch(order_ids)
+            else:
+                await process_order(order_ids[0])
+                outcomes = {order_ids[0]: None}
+        except Exception as e:
+            outcomes = {order_id: str(e) for order_id in order_ids}
+
+        failed = [entry for entry in entries if outcomes.get(entry["order_id"])]
+        succeeded = [entry["job_id"] for entry in entries if not outcomes.get(entry["order_id"])]
+        try:
+            if failed:
+                await self._retry_or_bury(failed, attempt, outcomes, is_batch)
+            await set_jobs_status(succeeded, "succeeded", attempts=attempt)
+        except Exception as e:
+            # The failed jobs could not be rescheduled; let the broker redeliver the message
+            print(f"Failed to reschedule jobs {job_ids}: {e}")
+            await message.nack(requeue=True)
+            return
+        await message.ack()
+
+    async def _retry_or_bury(self, entries: List[dict], attempt: int, outcomes: Dict[str, str], is_batch: bool):
+        if attempt >= self.max_attempts:
+            errors = {entry["order_id"]: outcomes[entry["order_id"]] for entry in entries}
+            await self._publish(DEAD_LETTER_QUEUE, {**batch_job_message(entries, attempt), "errors": errors})
+            for entry in entries:
+                error = errors[entry["order_id"]]
+                await set_job_status(entry["job_id"], "dead", error=error)
+                await fail_order(entry["order_id"], error)
+                print(f"Job {entry['job_id']} for order {entry['order_id']} dead-lettered after {attempt} attempts: {error}")
+            return
+
+        delay_ms = int(self.retry_delay(attempt) * 1000)
+        retry_queue = await self._declare_retry_queue(delay_ms)
+        if is_batch:
+            body = batch_job_message(entries, attempt + 1)
+        else:
+            body = job_message(entries[0]["job_id"], entries[0]["order_id"], attempt + 1)
+        await self._publish(retry_queue, body)
+        for entry in entries:
+            await set_job_status(entry["job_id"], "retrying", error=outcomes[entry["order_id"]])
+
+    async def _declare_retry_queue(self, delay_ms: int) -> str:
+        """One queue per delay, whose expired messages flow back into order.submitted"""
+        name = f"{RETRY_QUEUE_PREFIX}.{delay_ms}"
+        if name not in self._retry_queues:
+            await self._channel.declare_queue(name, durable=True, arguments={
+                "x-message-ttl": delay_ms,
+                "x-dead-letter-exchange": EXCHANGE,
+                "x-dead-letter-routing-key": ORDER_QUEUE
+            })
+            self._retry_queues.add(name)
+        return name
+
+    async def _publish(self, queue_name: str, body: dict):
+        await self._channel.default_exchange.publish(
+            aio_pika.Message(
+                json.dumps(body).encode(),
+                content_type="application/json",
+                delivery_mode=aio_pika.DeliveryMode.PERSISTENT
+            ),
+            routing_key=queue_name
+        )
+
+    async def _sweep_loop(self):
+        while True:
+            try:
+                requeued = await requeue_pending_jobs(older_than=timedelta(seconds=self.sweep_interval))
+                if requeued:
+                    print(f"Requeued {requeued} pending jobs")
+            except Exception as e:
+                print(f"Pending job sweep failed: {e}")
+            await asyncio.sleep(self.sweep_interval)
+
+def run_worker(concurrency: int, sweep_pending: bool):
+    worker = OrderWorker(concurrency=concurrency, sweep_pending=sweep_pending)
+
+    async def main():
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, worker.stop)
+        await worker.run()
+
+    asyncio.run(main())
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run order processing workers")
+    parser.add_argument("--processes", type=int, default=int(os.getenv("ORDER_WORKER_PROCESSES", "1")))
+    parser.add_argument("--concurrency", type=int, default=int(os.getenv("ORDER_WORKER_CONCURRENCY", "10")),
+                        help="Jobs processed at once by each process")
+    args = parser.parse_args()
+
+    if args.processes == 1:
+        run_worker(args.concurrency, sweep_pending=True)
+    else:
+        # Only the first process sweeps pending jobs so they are not published twice
+        processes = [
+            multiprocessing.Process(target=run_worker, args=(args.concurrency, index == 0))
+            for index in range(args.processes)
+        ]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()